@@ -6,15 +6,224 @@
 import os, sys
 import numpy as np
 
-__all__ = ['data_bin', 'data_2d_bin', 'calc_bins'] 
+__all__ = ['data_bin', 'data_2d_bin', 'calc_bins', 'DataBins', 'bin_ids_2d'] 
+
+class DataBins(object):
+    """Compact binned data: data of bin i (flat bin index) are data[indices[offsets[i]:offsets[i+1]]].
+    Bins are laid out in shape, e.g. (len(y_points)-1, len(x_points)-1) for data_2d_bin.
+    Reductions (count, sum, mean, std, min, max, median, percentile) are done for all bins at once,
+    and return dense arrays of shape, with nan for empty bins.
+    Indexing with a full index tuple gives the data array of that bin, with an int on 2d or more bins gives
+    the list of the bins in that row, so it also works as the nested lists returned by the old data_2d_bin.
+    Attributes:
+        data: the data array.
+        offsets: int array, number of bins + 1 .
+        indices: int array of data positions, grouped by bin, ascending inside a bin.
+        shape: shape of bins.
+        edges: bin edges of 1d bins, or None.
+    """
+    def __init__(self, data, offsets, indices, shape=None, edges=None):
+        self.data = np.asarray(data)
+        self.offsets = np.asarray(offsets, dtype='i8')
+        self.indices = np.asarray(indices, dtype='i8')
+        if shape is None:
+            shape = (len(self.offsets) - 1, )
+        self.shape = tuple(shape)
+        self.edges = edges
+        self._sorted = None
+
+    @classmethod
+    def from_ids(cls, data, ids, shape):
+        """group data by flat bin ids (negative or out of range ids are dropped), in one sort"""
+        ids = np.asarray(ids).ravel()
+        nbins = int(np.prod(shape))
+        order = np.argsort(ids, kind='mergesort')
+        valid = (ids >= 0) & (ids < nbins)
+        offsets = np.zeros(nbins + 1, dtype='i8')
+        np.cumsum(np.bincount(ids[valid], minlength=nbins), out=offsets[1:])
+        offsets += np.count_nonzero(ids < 0)
+        return cls(data, offsets, order, shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key, )
+        if len(key) > len(self.shape):
+            raise IndexError("too many indices for bins")
+        index = []
+        for axis, k in enumerate(key):
+            if isinstance(k, slice):
+                # # list of bins, as indexing nested lists
+                return [self[tuple(index) + (j, ) + key[axis+1:]] for j in range(self.shape[axis])[k]]
+            k = int(k)
+            if k < 0:
+                k += self.shape[axis]
+            if k < 0 or k >= self.shape[axis]:
+                raise IndexError("bin index out of range")
+            index.append(k)
+        if len(index) < len(self.shape):
+            # # a row of bins
+            return [self[tuple(index) + (j, )] for j in range(self.shape[len(index)])]
+        i = np.ravel_multi_index(index, self.shape)
+        return self.data[self.indices[self.offsets[i]:self.offsets[i+1]]]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __repr__(self):
+        return "DataBins<%s bins, %d records>" % ('x'.join([str(n) for n in self.shape]), self.offsets[-1] - self.offsets[0])
+
+    @property
+    def nbins(self):
+        return len(self.offsets) - 1
+
+    @property
+    def sorted_data(self):
+        """data grouped by bin, the data of bin i are sorted_data[offsets[i]-offsets[0]:offsets[i+1]-offsets[0]]"""
+        if self._sorted is None:
+            self._sorted = self.data[self.indices[self.offsets[0]:self.offsets[-1]]]
+        return self._sorted
+
+    def view(self, i):
+        """data of flat bin i, as a view of sorted_data"""
+        return self.sorted_data[self.offsets[i]-self.offsets[0]:self.offsets[i+1]-self.offsets[0]]
+
+    def where(self):
+        """a lazy list of np.where style tuples of each flat bin"""
+        return _WhereBins(self)
+
+    @property
+    def bin_info(self):
+        """list of (bin_start, bin_end) tuples of 1d bins"""
+        return zip(self.edges[:-1], self.edges[1:])
+
+    @property
+    def sorted_ids(self):
+        """flat bin id of each of sorted_data"""
+        return np.repeat(np.arange(self.nbins), np.diff(self.offsets))
+
+    def bin_ids(self):
+        """flat bin id of each of the input data, -1 for data in no bin"""
+        ids = np.zeros(len(self.data), dtype='i8') - 1
+        ids[self.indices[self.offsets[0]:self.offsets[-1]]] = self.sorted_ids
+        return ids
+
+    def _dense(self, values):
+        """values of non empty bins into a dense array of shape, nan for empty bins"""
+        counts = np.diff(self.offsets)
+        res = np.empty(self.nbins, dtype='f8')
+        res.fill(np.nan)
+        res[counts > 0] = values
+        return res.reshape(self.shape)
+
+    def count(self):
+        return np.diff(self.offsets).reshape(self.shape)
+
+    def sum(self):
+        """sum of each bin, 0 for empty bins"""
+        return np.bincount(self.sorted_ids, weights=self.sorted_data, minlength=self.nbins).astype('f8').reshape(self.shape)
+
+    def mean(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.sum() / np.diff(self.offsets).reshape(self.shape)
+
+    def std(self, ddof=0):
+        counts = np.diff(self.offsets).astype('f8')
+        ids = self.sorted_ids
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = np.bincount(ids, weights=self.sorted_data, minlength=self.nbins) / counts
+            sq = np.bincount(ids, weights=(self.sorted_data - means[ids]) ** 2, minlength=self.nbins)
+            return np.sqrt(sq / (counts - ddof)).reshape(self.shape)
+
+    def _reduceat(self, ufunc):
+        counts = np.diff(self.offsets)
+        starts = (self.offsets[:-1] - self.offsets[0])[counts > 0]
+        if len(starts) == 0:
+            return self._dense(np.zeros(0))
+        return self._dense(ufunc.reduceat(self.sorted_data, starts))
+
+    def min(self):
+        return self._reduceat(np.minimum)
+
+    def max(self):
+        return self._reduceat(np.maximum)
+
+    def percentile(self, q):
+        """q-th percentile (0-100, scalar or seq) of each bin, linear interpolated as np.percentile.
+        Returns array of shape, or of (len(q), ) + shape for seq q. nan for empty bins or bins with nan.
+        """
+        counts = np.diff(self.offsets)
+        ids = self.sorted_ids
+        data = self.sorted_data.astype('f8')
+        # # sort inside bins, nan goes last
+        order = np.lexsort((data, ids))
+        data = data[order]
+        has_nan = np.bincount(ids, weights=np.isnan(data), minlength=self.nbins) > 0
+        starts = self.offsets[:-1] - self.offsets[0]
+        q = np.asarray(q, dtype='f8')
+        pos = (np.maximum(counts, 1) - 1) * (q.reshape(q.shape + (1, )) / 100.0)
+        lo = np.floor(pos).astype('i8')
+        hi = np.minimum(lo + 1, np.maximum(counts - 1, 0))
+        frac = pos - lo
+        last = max(len(data) - 1, 0)
+        if len(data) == 0:
+            data = np.zeros(1)
+        res = data[np.minimum(starts + lo, last)] * (1 - frac) + data[np.minimum(starts + hi, last)] * frac
+        res[..., (counts == 0) | has_nan] = np.nan
+        return res.reshape(q.shape + self.shape)
+
+    def median(self):
+        return self.percentile(50.0)
+
+    def reduce(self, func, dtype='f8'):
+        """apply func on the data array of each bin, return an array of shape"""
+        res = np.zeros(self.nbins, dtype=dtype)
+        data = self.sorted_data
+        starts = self.offsets - self.offsets[0]
+        for i in range(self.nbins):
+            res[i] = func(data[starts[i]:starts[i+1]])
+        return res.reshape(self.shape)
+
+    def to_list(self):
+        """nested lists of data arrays"""
+        return list(self)
+
+class _WhereBins(object):
+    """np.where style tuples of bins of a DataBins, each tuple is made only when accessed"""
+    def __init__(self, bins):
+        self.bins = bins
+
+    def __len__(self):
+        return self.bins.nbins
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(len(self))[i]]
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError("bin index out of range")
+        return (self.bins.indices[self.bins.offsets[i]:self.bins.offsets[i+1]], )
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __repr__(self):
+        return "WhereBins<%d bins>" % len(self)
+
 def data_bin(data, binsize, start=None, end=None, return_where=False, return_bin_info=False):
     """This function partitions a seq of data into equal bin. 
 
     Return rules:
     If return_where is False (default):
-        Returns a list of binned data array.
+        Returns a DataBins object, which works as a list of binned data arrays,
+        and holds the compact (bin_offsets, sorted_indices) form, see DataBins.
     Else:
-        Returns a list of np.where tuples.
+        Returns a lazy list of np.where tuples (DataBins.where()).
     If return_bin_info is True:
         also returns a list of (bin_start, bin_end) tuples
 
@@ -25,35 +234,34 @@ def data_bin(data, binsize, start=None, end=None, return_where=False, return_bin
     end is a value or None. If it's None, use the last value + 0.5 * binsize in the input sequence as end.
     return_where & return_bin_info:
         see return rules above
+    Data are located with np.digitize in one pass, and grouped without sorting if data is sorted.
     """
-    if len(data) == 0:
-        if return_bin_info:
-            return [], []
+    data = np.asarray(data)
+    if len(data) == 0 and (start is None or end is None):
+        split_points = np.zeros(0)
+    else:
+        if start is None:
+            start = data[0]
+        if end is None:
+            end = data[-1] + binsize * 0.5
         else:
-            return []
-    if start is None:
-        start = data[0]
-    if end is None:
-        end = data[-1] + binsize * 0.5
+            end = end + binsize * 0.001
+        split_points = np.arange(start, end, binsize)
+    nbins = max(len(split_points) - 1, 0)
+    with np.errstate(invalid='ignore'):
+        is_sorted = np.all(data[1:] >= data[:-1])
+    if nbins > 0 and is_sorted:
+        offsets = np.searchsorted(data, split_points, side='left')
+        result = DataBins(data, offsets, np.arange(len(data)), edges=split_points)
+        result._sorted = data[offsets[0]:offsets[-1]]
     else:
-        end = end + binsize * 0.001
-
-    split_points = np.arange(start, end, binsize)
-    start_points = split_points[:-1]
-    end_points   = split_points[1:]
-    d_result = []
-    w_result = []
-    bin_info = []
-    for bi in range(len(start_points)):
-        w = np.where( (data>=start_points[bi]) & (data<end_points[bi]) )
-        w_result.append(w)
-        d_result.append(data[w])
-        bin_info.append((start_points[bi], end_points[bi]))
-    
+        ids = np.digitize(data, split_points) - 1 if nbins > 0 else np.zeros(len(data), dtype='i8') - 1
+        result = DataBins.from_ids(data, ids, (nbins, ))
+        result.edges = split_points
+
+    bin_info = result.bin_info
     if return_where:
-        result = w_result
-    else:
-        result = d_result
+        result = result.where()
 
     if return_bin_info is True:
         return result, bin_info
@@ -61,38 +269,47 @@ def data_bin(data, binsize, start=None, end=None, return_where=False, return_bin
         return result
 
 
+def bin_ids_2d(xs, ys, x_points, y_points):
+    """flat bin ids (jy * (len(x_points)-1) + ix) of coordinates (xs, ys) in 2d bins defined by split points (x_points, y_points), ascending.
+    -1 for points out of all bins.
+    """
+    xs = np.asarray(xs)
+    ys = np.asarray(ys)
+    nx = len(x_points) - 1
+    ny = len(y_points) - 1
+    ix = np.searchsorted(x_points, xs, side='right') - 1
+    jy = np.searchsorted(y_points, ys, side='right') - 1
+    ids = jy * nx + ix
+    ids[(ix < 0) | (ix >= nx) | (jy < 0) | (jy >= ny)] = -1
+    return ids
+
 def data_2d_bin(data, xs, ys, x_points, y_points):
     """This function partitions a seq of data with coordinates (xs, ys), into 2d bins defined by split points (x_points, y_points). 
 
 Parameters:
     data: a seq of data.
     xs, ys: seqs of coordinates of the data.
-    x_points, y_points: seqs of split points. 
+    x_points, y_points: seqs of ascending split points. 
 Returns:
-    A 2d list with the shape of (len(y_points)-1, len(x_points)-1).
+    A DataBins object with the shape of (len(y_points)-1, len(x_points)-1), 
+    which works as the 2d list of the old version (res[jy][ix] is the data array in bin (jy, ix)),
+    and gives per-bin reductions as dense arrays, e.g. res.mean(), res.percentile(90).
     """
     assert len(data) == len(xs) == len(ys)
-    if len(data) == 0:
-        return [[[]]]
-    res = []
-    for jy in range(len(y_points)-1):
-        to_append = []
-        for ix in range(len(x_points)-1):
-            to_append.append([])
-        res.append(to_append)
-
-    for jy in range(len(y_points)-1):
-        wy = np.where( (y_points[jy] <= ys) & (ys < y_points[jy+1]) )
-        sub_data = data[wy]
-        sub_xs = xs[wy]
-        for ix in range(len(x_points)-1):
-            wx = np.where( (x_points[ix] <= sub_xs) & (sub_xs < x_points[ix+1]) )
-            res[jy][ix].extend(sub_data[wx])
-
-    return res
+    ids = bin_ids_2d(xs, ys, x_points, y_points)
+    return DataBins.from_ids(data, ids, (len(y_points)-1, len(x_points)-1))
 
 def calc_bins(bins, func, dtype='f8'):
-    """calc each bin with func, return an array."""
+    """calc each bin with func, return an array.
+    bins: DataBins or nested lists of bins.
+    func: a function on the data of a bin, or name of a DataBins reduction ('count', 'sum', 'mean', 'std', 'min', 'max', 'median').
+    """
+    if isinstance(bins, DataBins):
+        if isinstance(func, str):
+            return getattr(bins, func)().astype(dtype)
+        return bins.reduce(func, dtype)
+    if isinstance(func, str):
+        func = getattr(np, func)
     res_shape = np.shape(bins)[-1]
     res = np.zeros(res_shape, dtype='O')
     for index in np.ndindex(res_shape):
@@ -113,5 +330,5 @@ if __name__ == '__main__':
     xs = np.random.rand(100) * 100.0
     ys = np.random.rand(100) * 100.0
     print xs, ys
-    print data_2d_bin(a, xs, ys, [0, 20, 50, 100], [24, 50, 100])
+    print data_2d_bin(a, xs, ys, [0, 20, 50, 100], [24, 50, 100]).to_list()
 
@@ -43,20 +43,24 @@ Examples
         yield nowdict
 
 class lookup_table(object):
-    def __init__(self, arr, dims):
-        """arr is the big ndarray of lookup_table,
+    def __init__(self, arr, dims, source=None):
+        """arr is the big ndarray of lookup_table, it can also be a np.memmap or a netCDF variable,
+        whose values are only read when needed,
         dims is a list of name, values tuple:
         [('dim1',[0.1,0.2,0.3,0.4,0.5]), ('dim2',[35.,40.,50.]),...]
         any dim name is OK.
+        source: optional, ('nc', ncfname, varname) for arr of a netCDF variable, used to reopen it when pickled.
         """
         self.arr = arr
+        self.source = source
+        self._file = None
         # # check
         shape_checker = []
         for d in dims:
             shape_checker.append(len(d[1]))
             l = list(d[1])
             order_checker = sorted(l)
-            if l != order_checker and l != reversed(order_checker):
+            if l != order_checker and l != order_checker[::-1]:
                 raise ValueError( \
 """Lookup Table's dim: %s is not in ascending or descending order
     %s
@@ -73,6 +77,37 @@ class lookup_table(object):
     def __call__(self, coordinate=None, **kwargs):
         return self.lookup(coordinate, **kwargs)
 
+    def close(self):
+        """close the netCDF file opened by nc2lut, the lut can not be used after that"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self.arr = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __getstate__(self):
+        # memory-mapped / netCDF arrays are reopened instead of copied, e.g. when sent to worker processes
+        state = self.__dict__.copy()
+        state['_file'] = None
+        if isinstance(self.arr, np.memmap) and self.arr.filename is not None:
+            state['arr'] = ('memmap', self.arr.filename, self.arr.dtype, self.arr.shape, self.arr.offset)
+        elif self.source is not None:
+            state['arr'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if isinstance(self.arr, tuple) and len(self.arr) == 5 and self.arr[0] == 'memmap':
+            fname, dtype, shape, offset = self.arr[1:]
+            self.arr = np.memmap(fname, dtype=dtype, mode='r', shape=shape, offset=offset)
+        elif self.arr is None and self.source is not None:
+            self._file, self.arr = _open_nc_var(self.source[1], self.source[2])
+
     def lookup(self, coordinate=None, **kwargs):
         """lt.lookup(dim1=xxx, dim2=xxx,..., dimn=xxx) or 
         lt.lookup([x, y, z ...])
@@ -97,112 +132,165 @@ class lookup_table(object):
     Lookup Table's dim names: %s
     Function args: %s""" % ( self.dimnames, kwargs.keys() ) )
 
-        # # get enough good info
-        good_info = dict()
-        for now_dimname in order:
-            # find dim's index in all dim
-            for i, dim in enumerate(self.dims):
-                if now_dimname == dim[0]:
-                    dim_i = i
-                    dim_value = np.array(dim[1])
-                    break
-            now_value = kwargs[now_dimname]
-            # # To prevent extrapolating
-            if now_value < dim_value.min():
-                now_value = dim_value.min()
-            elif now_value > dim_value.max():
-                now_value = dim_value.max()
-
-            # find layer's index in the dim
-            for i in range(len(dim_value)-1):
-                if (dim_value[i]<=now_value and now_value<=dim_value[i+1]) \
-                    or \
-                    (dim_value[i]>=now_value and now_value>=dim_value[i+1]):
-                    left_i, right_i = i, i+1
-                    break
-            left_value, right_value = dim_value[i], dim_value[i+1]
-            left_ratio = (right_value - now_value) / (right_value - left_value)
-            right_ratio = (now_value - left_value) / (right_value - left_value)
-            good_info[now_dimname] = {'dimname':now_dimname, 'dim_i':dim_i, \
-                    'left_i':left_i, 'right_i':right_i, \
-                    'left_ratio':left_ratio, 'right_ratio':right_ratio }
-        # # make a small array for interp
-        magic = 'self.arr['
-        for dimname in self.dimnames:
-            if dimname not in good_info:
-                magic += ':,'
-            else:
-                info = good_info[dimname]
-                magic += '%d:%d,' % (info['left_i'], info['right_i']+1)
-        magic = magic.rstrip(',') + ']'
-#        print magic
-        small_arr = eval(magic)
-#        print order
-        shift = 0
-        for dimname in order:
-            info = good_info[dimname]
-            pos_left_str=[':'] * len(small_arr.shape)
-            pos_right_str=[':'] * len(small_arr.shape)
-            pos_left_str[info['dim_i']-shift] = '0'
-            pos_right_str[info['dim_i']-shift] = '1'
-            magic = "small_arr[%s] * info['left_ratio'] + small_arr[%s] * info['right_ratio']" % ( ','.join(pos_left_str), ','.join(pos_right_str) )
-#            print magic
-            small_arr = eval(magic)
-            shift += 1
-
+        small_arr = self.lookup_many(**kwargs)
         if len(order) == len(self.dimnames):
             # in this case, small_arr is already a scaler
             return small_arr
         else:
             # make a smaller lookup_table
-            new_dims = []
-            for d in self.dims:
-                if d[0] not in order:
-                    new_dims.append(d)
-#            print self.arr.shape
-#            print small_arr.shape
+            new_dims = [d for d in self.dims if d[0] not in order]
             return lookup_table(small_arr, new_dims)
 
     def fast_lookup(self, pos):
         """lt.lookup(pos)
         pos is a seq of position value in each dim.
-        this function does NOT assert whether pos is good.
-        And assumes that all dims are in acsending order.
-        However, it's not much faster than lookup yet.
+        Same as lookup_many(pos), use lookup_many for many positions at once.
         """
-        dimlen = len(self.dims)
-        left_i = np.zeros(dimlen, dtype='i4')
-        right_i = np.zeros(dimlen, dtype='i4')
-        left_ratio = np.zeros(dimlen, dtype='f4')
-        right_ratio = np.zeros(dimlen, dtype='f4')
-        for d_i in range(dimlen):
-            now_value = pos[d_i]
-            dim_value = self.dims[d_i][1]
-            # find layer's index in the dim
-            for i in range(len(dim_value)-1):
-                if dim_value[i]<=now_value and now_value<=dim_value[i+1]:
-                    left_i[d_i], right_i[d_i] = i, i+1
-                    break
-            left_value, right_value = dim_value[i], dim_value[i+1]
-            left_ratio[d_i] = (right_value - now_value) / (right_value - left_value)
-            right_ratio[d_i] = 1.0 - left_ratio[d_i]
-        
-        # # make a small array for interp
-        # # Time 100 / 430 mu s
-        magic = 'self.arr['
-        for d_i in range(dimlen):
-            magic += '%d:%d,' % (left_i[d_i], right_i[d_i]+1)
-        magic = magic.rstrip(',') + ']'
-        small_arr = eval(magic)
-# #        small_arr = self.arr
-        # # Time 70 / 430 mu s
-        for d_i in range(dimlen-1):
-            small_arr = small_arr[0,:] * left_ratio[d_i] + \
-                        small_arr[1,:] * right_ratio[d_i]
-        small_arr = small_arr[0] * left_ratio[d_i] + \
-                        small_arr[1] * right_ratio[d_i]
-        # # Time
-        return small_arr
+        return self.lookup_many(np.asarray(pos, dtype='f8'))
+
+    def locate(self, dim_i, values):
+        """locate values in the dim dim_i.
+        values are clamped into the dim range.
+        Returns (left_i, right_ratio): indices of the left grid points and weights of the right grid points (left_i+1).
+        """
+        dim_value = self.dims[dim_i][1]
+        n = len(dim_value)
+        values = np.asarray(values, dtype='f8')
+        if n == 1:
+            return np.zeros(values.shape, dtype='i8'), np.zeros(values.shape, dtype='f8')
+        descending = dim_value[0] > dim_value[-1]
+        asc = dim_value[::-1] if descending else dim_value
+        values = np.clip(values, asc[0], asc[-1])
+        left_i = np.clip(np.searchsorted(asc, values, side='right') - 1, 0, n - 2)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            right_ratio = (values - asc[left_i]) / (asc[left_i + 1] - asc[left_i])
+        if descending:
+            left_i = n - 2 - left_i
+            right_ratio = 1.0 - right_ratio
+        return left_i, right_ratio
+
+    def lookup_many(self, points=None, chunk=16384, **kwargs):
+        """lt.lookup_many(points) or lt.lookup_many(dim1=arr1, dim2=arr2, ...)
+        Multilinear interpolation at many points at once.
+        points: array[..., k], coordinates in the first k dims in the default dim order.
+        kwargs: dimname=coordinates, coordinates of all the given dims are broadcasted together.
+        chunk: number of points interpolated at a time, to limit the temporary memory.
+        Coordinates out of the dim ranges are clamped (no extrapolating).
+        Returns array[..., rest dims] of the given points' shape and the dims not given.
+        """
+        if points is not None:
+            points = np.asarray(points, dtype='f8')
+            if points.ndim == 0 or points.shape[-1] > len(self.dimnames):
+                raise ValueError("""Too many dims in the given points.
+        Lookup Table's dims: %s
+        Given points' shape: %s""" % (self.dimnames, points.shape))
+            kwargs = dict(zip(self.dimnames, np.rollaxis(points, -1)))
+        dim_is = [i for i, name in enumerate(self.dimnames) if name in kwargs]
+        if len(dim_is) != len(kwargs):
+            raise ValueError("""Dim names not match.
+    Lookup Table's dim names: %s
+    Function args: %s""" % ( self.dimnames, kwargs.keys() ) )
+        coords = np.broadcast_arrays(*[np.asarray(kwargs[self.dimnames[i]], dtype='f8') for i in dim_is])
+        shape = coords[0].shape if coords else ()
+        coords = [c.ravel() for c in coords]
+        rest_shape = tuple([n for i, n in enumerate(self.arr.shape) if i not in dim_is])
+        total = int(np.prod(shape))
+        res = np.empty((total,) + rest_shape, dtype=np.result_type(self.arr.dtype, 'f8'))
+        if not isinstance(self.arr, np.ndarray):
+            # arrays not in memory (e.g. netCDF variables) are only read around the corners
+            self._lookup_lazy(dim_is, coords, res, chunk)
+            return res.reshape(shape + rest_shape)[()]
+        for beg in range(0, max(total, 1), chunk):
+            end = min(beg + chunk, total)
+            locs = []
+            for i, c in zip(dim_is, coords):
+                left_i, right_ratio = self.locate(i, c[beg:end])
+                locs.append([left_i, np.minimum(left_i + 1, self.arr.shape[i] - 1), right_ratio])
+            self._interp_corners(self.arr, dim_is, locs, res[beg:end])
+        return res.reshape(shape + rest_shape)[()]
+
+    def _lookup_lazy(self, dim_is, coords, out, chunk):
+        """lookup_many on an array not in memory.
+        Points are sorted by grid cell, then each chunk reads the hyperslab around its cells if it is compact,
+        else the corner blocks of its unique cells one by one, so that reads stay local for scattered points.
+        """
+        if not dim_is:
+            out[...] = np.asarray(self.arr[...])
+            return
+        given_shape = tuple([self.arr.shape[i] for i in dim_is])
+        sizes = np.minimum(given_shape, 2)
+        cell_size = int(np.prod(sizes))
+        lefts = []
+        ratios = []
+        for i, c in zip(dim_is, coords):
+            left_i, right_ratio = self.locate(i, c)
+            lefts.append(left_i)
+            ratios.append(right_ratio)
+        cells = np.ravel_multi_index(lefts, given_shape)
+        order = np.argsort(cells, kind='mergesort')
+        for beg in range(0, len(order), chunk):
+            sel = order[beg:beg+chunk]
+            ucells, uid = np.unique(cells[sel], return_inverse=True)
+            ulefts = np.unravel_index(ucells, given_shape)
+            los = [ul.min() for ul in ulefts]
+            his = [ul.max() + size for ul, size in zip(ulefts, sizes)]
+            tmp = np.empty((len(sel),) + out.shape[1:], dtype=out.dtype)
+            if np.prod(np.subtract(his, los)) <= 4 * len(ucells) * cell_size:
+                box = [slice(None)] * len(self.arr.shape)
+                locs = []
+                for j, i in enumerate(dim_is):
+                    box[i] = slice(los[j], his[j])
+                    left_i = lefts[j][sel] - los[j]
+                    locs.append([left_i, left_i + (sizes[j] - 1), ratios[j][sel]])
+                src = np.asarray(self.arr[tuple(box)])
+                self._interp_corners(src, dim_is, locs, tmp)
+            else:
+                blocks = np.empty((len(ucells),) + tuple([sizes[dim_is.index(i)] if i in dim_is else n
+                    for i, n in enumerate(self.arr.shape)]), dtype=self.arr.dtype)
+                for u in range(len(ucells)):
+                    box = [slice(None)] * len(self.arr.shape)
+                    for j, i in enumerate(dim_is):
+                        box[i] = slice(ulefts[j][u], ulefts[j][u] + sizes[j])
+                    blocks[u] = np.asarray(self.arr[tuple(box)])
+                # # the cell is a dim of blocks, with no interpolation in it
+                locs = [[uid, None, None]]
+                for j in range(len(dim_is)):
+                    locs.append([np.zeros(len(sel), dtype='i8'), np.zeros(len(sel), dtype='i8') + (sizes[j] - 1), ratios[j][sel]])
+                self._interp_corners(blocks, [0] + [i + 1 for i in dim_is], locs, tmp)
+            out[sel] = tmp
+
+    @staticmethod
+    def _interp_corners(src, dim_is, locs, out):
+        """out = multilinear interpolation of src over the 2^d corners given by locs ([left_i, right_i, right_ratio] of dims dim_is),
+        dims with right_i None are only indexed by left_i."""
+        # with all dims given on a contiguous array, corners are gathered with flat indices
+        use_flat = len(dim_is) == src.ndim and src.ndim > 0 and src.flags.c_contiguous
+        if use_flat:
+            flat = src.reshape(-1)
+            mults = np.cumprod((1,) + src.shape[:0:-1])[::-1]
+        else:
+            # the given dims first
+            src = np.moveaxis(src, dim_is, range(len(dim_is))) if dim_is else src
+        # corners are expanded dim by dim, each one is (weight, index)
+        corners = [(1.0, 0 if use_flat else ())]
+        for dim_j, (left_i, right_i, right_ratio) in enumerate(locs):
+            if right_i is None:
+                corners = [(w, idx + left_i * mults[dim_j]) if use_flat else (w, idx + (left_i,)) for w, idx in corners]
+                continue
+            left_ratio = 1.0 - right_ratio
+            if use_flat:
+                corners = [(w * left_ratio, idx + left_i * mults[dim_j]) for w, idx in corners] + \
+                        [(w * right_ratio, idx + right_i * mults[dim_j]) for w, idx in corners]
+            else:
+                corners = [(w * left_ratio, idx + (left_i,)) for w, idx in corners] + \
+                        [(w * right_ratio, idx + (right_i,)) for w, idx in corners]
+        out[...] = 0.0
+        for weight, index in corners:
+            if use_flat:
+                out += weight * flat.take(index)
+            else:
+                weight = np.reshape(weight, np.shape(weight) + (1,) * (out.ndim - 1))
+                out += weight * src[index]
 
     def reverse_lookup(self, value, span_num=11):
         """find corresponding dim position for the value.
@@ -212,26 +300,73 @@ class lookup_table(object):
         if len(self.dims) != 1:
             raise RuntimeError("lookup_table.reverse_lookup(value) only \
 works for 1-d lookup_tables. This one is %d-d." % len(self.dims))
+        roots = self.reverse_lookup_many(value, span_num=span_num)
+        return roots[np.isfinite(roots)]
+
+    def reverse_lookup_many(self, values, dimname=None, mode='all', prior=None, span_num=11, chunk=16384, **kwargs):
+        """find corresponding positions in dim dimname for many values at once.
+        values: array of values to find.
+        dimname: the dim to find positions in, default is the only dim not given in kwargs.
+        mode: 'all': all the positions, sorted and unique.
+            'nearest': the position nearest to prior.
+        prior: array of prior positions for mode 'nearest', broadcasted with values.
+        span_num: when 2 adjacent values are identical (and equal to the value to find),
+            mode 'all' returns span_num positions between the 2 dim values,
+            mode 'nearest' returns the prior clipped into them.
+        chunk: number of values processed at a time.
+        kwargs: dimname=coordinates of all the other dims, broadcasted with values.
+        Returns array[values' shape, max number of positions] (nan padded) for mode 'all', array[values' shape] for 'nearest'.
+        nan for values not found.
+        """
+        if dimname is None:
+            free = [name for name in self.dimnames if name not in kwargs]
+            if len(free) != 1:
+                raise ValueError("Cannot decide the dim to reverse lookup in, free dims are: %s" % free)
+            dimname = free[0]
+        if set(self.dimnames) != set(kwargs.keys()) | set([dimname]) or dimname in kwargs:
+            raise ValueError("""Dim names not match, all dims except %s should be given.
+    Lookup Table's dim names: %s
+    Function args: %s""" % (dimname, self.dimnames, kwargs.keys()))
+        if mode not in ('all', 'nearest'):
+            raise ValueError("Unknown mode: %s" % mode)
+        if mode == 'nearest' and prior is None:
+            raise ValueError("prior is needed for mode 'nearest'")
         if span_num <= 1:
             span_num = 2
-        res = []
-        diffs = self.arr[1:] - self.arr[:-1]
-        for i in range(len(self.arr)-1):
-            if value >= np.min(self.arr[i:i+2]) and \
-                    value <= np.max(self.arr[i:i+2]):
-                try:
-                    left_ratio = (self.arr[i+1] - value) / diffs[i]
-                    right_ratio = (value - self.arr[i]) / diffs[i]
-                    dim_value = self.dims[0][1][i] * left_ratio + \
-                            self.dims[0][1][i+1] * right_ratio
-                    if np.isfinite(dim_value):
-                        res.append(dim_value)
-                    else: 
-                        raise ZeroDivisionError
-                except ZeroDivisionError:
-                    res.extend(np.linspace(self.dims[0][1][i],
-                        self.dims[0][1][i+1],span_num))
-        return np.unique(np.array(res))
+        xs = np.asarray(self.dims[self.dimnames.index(dimname)][1], dtype='f8')
+        arrays = [np.asarray(values, dtype='f8')] + [np.asarray(kwargs[name], dtype='f8') for name in kwargs]
+        if mode == 'nearest':
+            arrays.append(np.asarray(prior, dtype='f8'))
+        arrays = np.broadcast_arrays(*arrays)
+        shape = arrays[0].shape
+        flat_arrays = [a.ravel() for a in arrays]
+        values = flat_arrays[0]
+        others = dict(zip(kwargs.keys(), flat_arrays[1:1+len(kwargs)]))
+        total = len(values)
+        spans = np.array([np.linspace(xs[i], xs[i+1], span_num) for i in range(len(xs) - 1)]).reshape(len(xs) - 1, span_num)
+        results = []
+        for beg in range(0, total, chunk):
+            end = min(beg + chunk, total)
+            if others:
+                profiles = self.lookup_many(chunk=chunk, **dict([(name, c[beg:end]) for name, c in others.items()]))
+            else:
+                profiles = np.broadcast_to(np.asarray(self.arr[...], dtype='f8'), (end - beg, len(xs)))
+            roots, flat = _crossings(profiles, xs, values[beg:end])
+            if mode == 'nearest':
+                results.append(_nearest_root(roots, flat, xs, flat_arrays[-1][beg:end]))
+            else:
+                results.append(_all_roots(roots, flat, spans))
+        if mode == 'nearest':
+            res = np.concatenate(results) if results else np.zeros(0)
+            return res.reshape(shape)[()]
+        max_num = max([r.shape[1] for r in results] + [0])
+        res = np.empty((total, max_num))
+        res.fill(np.nan)
+        beg = 0
+        for r in results:
+            res[beg:beg+len(r), :r.shape[1]] = r
+            beg += len(r)
+        return res.reshape(shape + (max_num,))
 
     def __str__(self):
         res = 'lookup_table'
@@ -239,8 +374,96 @@ works for 1-d lookup_tables. This one is %d-d." % len(self.dims))
             res = res + '\n%8s : %s' % (dname, diminfo)
         return res
 
-def nc2lut(ncfname):
-    pass
+def _crossings(profiles, xs, values):
+    """find where profiles[n, m] (on grid xs[m]) cross values[n], by the sign changes of profiles - values.
+    Returns roots[n, m-1] of each interval (nan if no crossing), flat[n, m-1] (intervals identical to the value).
+    """
+    a0 = profiles[:, :-1]
+    a1 = profiles[:, 1:]
+    v = values[:, np.newaxis]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        hit = (a0 - v) * (a1 - v) <= 0
+        diffs = a1 - a0
+        roots = xs[:-1] * ((a1 - v) / diffs) + xs[1:] * ((v - a0) / diffs)
+    finite = np.isfinite(roots)
+    flat = hit & ~finite
+    roots[~(hit & finite)] = np.nan
+    return roots, flat
+
+def _all_roots(roots, flat, spans):
+    """sorted unique roots of each row, with spans of flat intervals, nan padded"""
+    if flat.any():
+        span_roots = np.where(flat[:, :, np.newaxis], spans, np.nan).reshape(len(flat), -1)
+        roots = np.concatenate([roots, span_roots], axis=1)
+    roots = np.sort(roots, axis=1)
+    # drop duplicates, e.g. roots on grid points found in both intervals
+    dup = np.zeros(roots.shape, dtype=bool)
+    dup[:, 1:] = roots[:, 1:] == roots[:, :-1]
+    roots[dup] = np.nan
+    roots = np.sort(roots, axis=1)
+    num = np.sum(np.isfinite(roots), axis=1)
+    return roots[:, :num.max() if len(num) > 0 else 0]
+
+def _nearest_root(roots, flat, xs, prior):
+    """the root of each row nearest to prior"""
+    p = prior[:, np.newaxis]
+    if flat.any():
+        clipped = np.clip(p, np.minimum(xs[:-1], xs[1:]), np.maximum(xs[:-1], xs[1:]))
+        roots = np.where(flat, clipped, roots)
+    dist = np.abs(roots - p)
+    dist[np.isnan(dist)] = np.inf
+    best = np.argmin(dist, axis=1)
+    res = roots[np.arange(len(roots)), best]
+    res[np.isinf(dist[np.arange(len(roots)), best])] = np.nan
+    return res
+
+def _open_nc_var(ncfname, varname):
+    """open varname of ncfname, returns (the opened Dataset, the variable)"""
+    from netCDF4 import Dataset
+    f = Dataset(ncfname)
+    var = f.variables[varname]
+    var.set_auto_mask(False)
+    return f, var
+
+def nc2lut(ncfname, varname=None, load=False):
+    """Load a variable of a netCDF file as lut.
+    The variable's dims are the lut's dims, with values from the coordinate variables of the same names (0, 1, 2, ... if not present).
+    Parameters:
+        ncfname: netCDF file name.
+        varname: name of the lut variable, default is the first one which is not a coordinate variable.
+        load: if True, read the whole variable into memory, 
+            else keep the variable opened and only read the hyperslabs needed by each lookup,
+            call close() of the lut (or use it in a with statement) to close the file.
+"""
+    from netCDF4 import Dataset
+    f = Dataset(ncfname)
+    if varname is None:
+        for name, var in f.variables.items():
+            if not (len(var.dimensions) == 1 and var.dimensions[0] == name):
+                varname = name
+                break
+        else:
+            f.close()
+            raise ValueError("No lut variable found in %s" % ncfname)
+    var = f.variables[varname]
+    dims = []
+    for dname in var.dimensions:
+        if dname in f.variables:
+            dims.append((str(dname), np.asarray(f.variables[dname][:])))
+        else:
+            dims.append((str(dname), np.arange(len(f.dimensions[dname]), dtype='f8')))
+    var.set_auto_mask(False)
+    if load:
+        arr = var[...]
+        f.close()
+        return lookup_table(arr, dims)
+    lut = lookup_table(var, dims, source=('nc', ncfname, varname))
+    lut._file = f
+    return lut
+
+# typecodes of the old scipy.io.numpyio
+_numpyio_types = {'c': 'S1', 'b': 'u1', '1': 'i1', 's': 'i2', 'i': 'i4', 'l': 'l',
+        'f': 'f4', 'd': 'f8', 'F': 'c8', 'D': 'c16'}
 
 def bin2lut(descfname, **kwargs):
     """Load a raw binary file as lut directly. 
@@ -255,12 +478,15 @@ def bin2lut(descfname, **kwargs):
             # dims can either be seperated with ',' or ' '
         kwargs: 
             mem_type:
-                a character in 'cb1silfdFD'
+                a character in 'cb1silfdFD', the whole lut is read into memory if given.
             byteswap:
                 0 : no swap
                 1 : swap
+            mmap:
+                True (default): the lut array is a read-only np.memmap of the binary file, only the parts needed by lookups are read,
+                    and the mapping is shared by forked worker processes.
+                False: read the whole binary file into memory.
 """
-    from scipy.io.numpyio import fread
     descf_folder_path = os.path.dirname(descfname)
     descf_basename = os.path.basename(descfname)
     descf = open(descfname)
@@ -289,10 +515,18 @@ def bin2lut(descfname, **kwargs):
             shp.append(arrayvalue.shape[0])
     total_elements_num = np.multiply.reduce(shp)
     shp = tuple(shp)
+    descf.close()
     binary_file_abspath = os.path.join(descf_folder_path, binary_file)
-    f = open(binary_file_abspath, 'rb')
-    lut_arr = fread(f, total_elements_num, dtype).reshape(shp)
-    f.close()
+    dtype = np.dtype(_numpyio_types.get(dtype, dtype))
+    if kwargs.get('byteswap', 0):
+        dtype = dtype.newbyteorder()
+    mem_type = kwargs.get('mem_type', None)
+    if kwargs.get('mmap', True) and mem_type is None:
+        lut_arr = np.memmap(binary_file_abspath, dtype=dtype, mode='r', shape=shp)
+    else:
+        lut_arr = np.fromfile(binary_file_abspath, dtype=dtype, count=total_elements_num).reshape(shp)
+        if mem_type is not None:
+            lut_arr = lut_arr.astype(_numpyio_types.get(mem_type, mem_type))
     lut = lookup_table(lut_arr, dims)
     return lut
 
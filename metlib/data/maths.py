@@ -27,10 +27,10 @@ def second_derivate(sig):
 def int_sign(a):
     s = np.sign(a)
     if np.isscalar(s):
-        if -np.isfinite(s):
+        if not np.isfinite(s):
             s = 0.0
         return int(s)
     else:
-        s[np.where(-np.isfinite(s))] = 0.0
+        s[np.where(~np.isfinite(s))] = 0.0
         s = s.astype('i')
         return s
@@ -2,6 +2,7 @@ from .datetime_bin import *
 from .logical import *
 from .misc import *
 from .parser import *
+from .dt64 import *
 from .datetime_range import *
 from .datetime_interp import *
 from .datetime_split import *
@@ -17,17 +17,19 @@ from datetime_range import *
 from logical import *
 from misc import *
 from parser import *
+from dt64 import *
 
 __all__ = ['three_month_anomaly']
 
 def three_month_anomaly(dts, data, beg_year, beg_month, end_year, end_month, day=1, least_days=0, return_base=False):
     """three_month_anomaly calculates 3-month anomaly of given data series.
-    dts: datetime seq.
+    dts: datetime seq or datetime64 array.
     data: data seq.
     beg_year, beg_month; end_year, end_month: begin/end date.
     day: day of the beg/end date
     least_days: if the sample number in a 3-month bin is less than least_days, it's omitted.
     """
+    dts = to_datetime64(dts)
     beg_dt = datetime(beg_year, beg_month, day)
     end_dt = datetime(end_year, end_month, day)
     befbeg_dt = beg_dt - TD('1M')
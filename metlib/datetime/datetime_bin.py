@@ -13,65 +13,157 @@ import numpy as np
 #from mpl_toolkits.basemap import Basemap
 #from matplotlib import mlab
 from .parser import *
+from .dt64 import *
+
+__all__ = ['datetime_bin', 'DatetimeBins', 'datetime_period', 'datetime_group', 'datetime_neighbor'] 
+
+class DatetimeBins(object):
+    """Compact result of datetime_bin: indices of bin i are indices[offsets[i]:offsets[i+1]].
+    It also works as the list of np.where style tuples returned by the old datetime_bin,
+    each tuple is made only when accessed.
+    Attributes:
+        offsets: int array, len(bins) + 1 .
+        indices: int array of input positions, grouped by bin, ascending inside a bin.
+        edges: datetime64 array of bin edges, len(bins) + 1 .
+    """
+    def __init__(self, offsets, indices, edges):
+        self.offsets = offsets
+        self.indices = indices
+        self.edges = edges
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(len(self))[i]]
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError("bin index out of range")
+        return (self.indices[self.offsets[i]:self.offsets[i+1]], )
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __repr__(self):
+        return "DatetimeBins<%d bins, %d records>" % (len(self), self.offsets[-1] - self.offsets[0])
+
+    @property
+    def counts(self):
+        """number of records in each bin"""
+        return np.diff(self.offsets)
+
+    def bin_ids(self, length):
+        """bin id of each of the length input records, -1 for records in no bin"""
+        ids = np.zeros(length, dtype='i8') - 1
+        ids[self.indices[self.offsets[0]:self.offsets[-1]]] = np.repeat(np.arange(len(self)), self.counts)
+        return ids
+
+    def to_list(self):
+        """list of np.where style tuples"""
+        return list(self)
+
+def _datetime_bin_edges(starttime, endtime, tdelta):
+    """edges of bins of tdelta from starttime, with the last bin starting before endtime, as datetime64 array"""
+    if isinstance(tdelta, (timedelta, np.timedelta64)):
+        tdelta = to_timedelta64(tdelta).astype('i8')
+        span = (endtime - starttime).astype('m8[us]').astype('i8')
+        nbins = 0 if span <= 0 else (span + tdelta - 1) // tdelta
+        return starttime + np.arange(nbins + 1) * np.timedelta64(int(tdelta), 'us')
+    else:
+        # # calendar tdelta, e.g. relativedelta(months=1)
+        edge = datetime64_to_datetime(starttime)
+        end = datetime64_to_datetime(endtime)
+        edges = [edge]
+        while edge < end:
+            edge = edge + tdelta
+            edges.append(edge)
+        if len(edges) == 1:
+            edges = []
+        return to_datetime64(edges).astype('M8[us]')
 
-__all__ = ['datetime_bin', 'datetime_period', 'datetime_group', 'datetime_neighbor'] 
 def datetime_bin(datetimes, tdelta, starttime=None, endtime=None, return_bin_info=False):
     """This function partition a serie of datetime objects into equal timedelta bin. 
-    Returns a list of np.where style tuples. If return_bin_info is True, also returns a list of (bin_start, bin_end) tuples.
+    Returns a DatetimeBins object, which works as a list of np.where style tuples, and holds the compact (offsets, indices) form.
+    If return_bin_info is True, also returns a list of (bin_start, bin_end) tuples.
     Parameters:
-    datetimes is a seq of datetime objects, 
+    datetimes is a seq of datetime objects or a datetime64 array, sorted or not,
     tdelta is a timedelta object,
     starttime is a datetime object or None. When it's None, use the first datetime in the input sequence as starttime
     endtime is a datetime object or None. When it's None, use the last datetime in the input sequence as endtime
+    Bin edges are computed once, and records are located with np.searchsorted.
     """
     if len(datetimes) == 0:
         if return_bin_info:
             return [], []
         else:
             return []
-    datetimes = parse_datetime(datetimes)
+    as_datetime64 = is_datetime64(datetimes)
+    datetimes = to_datetime64(datetimes).astype('M8[us]')
     if starttime is None:
         starttime = datetimes[0]
     else:
-        starttime = parse_datetime(starttime)
+        starttime = to_datetime64(starttime)
     if endtime is None:
         endtime = datetimes[-1] # + tdelta / 2
     else:
-        endtime = parse_datetime(endtime)
+        endtime = to_datetime64(endtime)
     if tdelta is None:
-        tdelta = endtime - starttime
-    else:
+        tdelta = to_timedelta64(endtime - starttime)
+    elif not isinstance(tdelta, np.timedelta64):
         tdelta = parse_timedelta(tdelta)
 
-    tmpbin_start = starttime
-    result = []
-    bin_info = []
-    tmpbin = []
-    tmpbin_end = tmpbin_start + tdelta
-    i = 0
-    while tmpbin_start < endtime:
-        if i == len(datetimes) or datetimes[i] >= tmpbin_end:
-            bin_info.append((tmpbin_start, tmpbin_end))
-            result.append((np.array(tmpbin, dtype='i8'), ))
-            tmpbin = []
-            tmpbin_start, tmpbin_end = tmpbin_end, tmpbin_end + tdelta
-        elif datetimes[i] < tmpbin_start:
-            i += 1
-        else:
-            tmpbin.append(i)
-            i += 1
-            
+    edges = _datetime_bin_edges(starttime, endtime, tdelta)
+    nbins = max(len(edges) - 1, 0)
+    if nbins == 0:
+        result = DatetimeBins(np.zeros(1, dtype='i8'), np.zeros(0, dtype='i8'), edges)
+    elif np.all(datetimes[1:] >= datetimes[:-1]):
+        offsets = np.searchsorted(datetimes, edges, side='left')
+        result = DatetimeBins(offsets, np.arange(len(datetimes)), edges)
+    else:
+        ids = np.searchsorted(edges, datetimes, side='right') - 1
+        ids[ids >= nbins] = -1
+        order = np.argsort(ids, kind='mergesort')
+        offsets = np.searchsorted(ids[order], np.arange(nbins + 1), side='left')
+        result = DatetimeBins(offsets, order, edges)
+
     if return_bin_info is True:
+        edges = _like_input(edges, as_datetime64)
+        bin_info = zip(edges[:-1], edges[1:])
         return result, bin_info
     else:
         return result
 
+def _group_indices(ids, n):
+    """group indices by ids in range(n), in one sort. Negative or >= n ids are dropped.
+    Returns a list of np.where style tuples, indices in each group are ascending.
+    """
+    order = np.argsort(ids, kind='mergesort')
+    bounds = np.searchsorted(ids[order], np.arange(n + 1), side='left')
+    return [(order[bounds[k]:bounds[k+1]], ) for k in range(n)]
+
+def _like_input(dts64, as_datetime64):
+    """return datetime64 values as is, or as datetime objects"""
+    if as_datetime64:
+        return dts64
+    return datetime64_to_datetime(dts64)
+
+def _out_of_range(datetimes, starttime, endtime):
+    """check starttime/endtime against datetimes (datetime64), returns (starttime, endtime, out_of_range)"""
+    min_dts = np.min(datetimes)
+    max_dts = np.max(datetimes)
+    starttime = min_dts if starttime is None else to_datetime64(starttime)
+    endtime = max_dts if endtime is None else to_datetime64(endtime)
+    return starttime, endtime, (starttime > max_dts or endtime < min_dts)
+
 def datetime_period(datetimes, splitpoints, starttime=None, endtime=None, return_bin_info=False, include_period_before_first_splitpoint=False):
     """This function partition a serie of datetime objects into periods according to splitpoints. 
     Returns a list of np.where style tuples. If return_bin_info is True, also returns a list of (bin_start, bin_end) tuples.
     Parameters:
-    datetimes is a seq of datetime objects, 
-    splitpoints is a seq of datetime objects as splitpoints,
+    datetimes is a seq of datetime objects or a datetime64 array, 
+    splitpoints is a sorted seq of datetime objects (or datetime64) as splitpoints,
     starttime is a datetime object or None. When it's None, use the first datetime in the input sequence as starttime
     endtime is a datetime object or None. When it's None, use the last datetime in the input sequence as endtime
     return_bin_info: default False
@@ -82,18 +174,9 @@ def datetime_period(datetimes, splitpoints, starttime=None, endtime=None, return
             return [], []
         else:
             return []
-    datetimes = parse_datetime(datetimes)
-    min_dts = np.min(datetimes)
-    max_dts = np.max(datetimes)
-    if starttime is None:
-        starttime = min_dts
-    else:
-        starttime = parse_datetime(starttime)
-    if endtime is None:
-        endtime = max_dts
-    else:
-        endtime = parse_datetime(endtime)
-    if starttime > max_dts or endtime < min_dts:
+    datetimes = to_datetime64(datetimes)
+    starttime, endtime, out_of_range = _out_of_range(datetimes, starttime, endtime)
+    if out_of_range:
         if return_bin_info:
             return [], []
         else:
@@ -106,13 +189,13 @@ def datetime_period(datetimes, splitpoints, starttime=None, endtime=None, return
         begs = [datetime.min] + list(splitpoints)
         ends = list(splitpoints) + [datetime.max]
     
-#    start_i = np.argmax(splitpoints >= starttime)
-#    end_i = np.argmin(splitpoints >= endtime)
 # TODO: add actual starttime and endtime support
     bes = zip(begs, ends)
-    periods = []
-    for b, e in bes:
-        periods.append( np.where((datetimes >= b) & (datetimes < e)) )
+    # # period id of each datetime, -1 for before the first splitpoint
+    ids = np.searchsorted(to_datetime64(splitpoints), datetimes, side='right')
+    if not include_period_before_first_splitpoint:
+        ids -= 1
+    periods = _group_indices(ids, len(bes))
 
     if return_bin_info:
         return periods, bes
@@ -124,7 +207,7 @@ def datetime_group(datetimes, tdelta_threshold, starttime=None, endtime=None, re
     """This function partition a serie of datetime objects into groups (clusters) according to a tdelta_threshold. 
     Returns a list of np.where style tuples. If return_bin_info is True, also returns a list of (bin_start, bin_end) tuples.
     Parameters:
-    datetimes is a seq of datetime objects, which should be sorted.
+    datetimes is a seq of datetime objects or a datetime64 array, which should be sorted.
     tdelta_threshold: a timedelta object.
     starttime is a datetime object or None. When it's None, use the first datetime in the input sequence as starttime. Not Implemented
     endtime is a datetime object or None. When it's None, use the last datetime in the input sequence as endtime. NOt Implemented
@@ -135,35 +218,20 @@ def datetime_group(datetimes, tdelta_threshold, starttime=None, endtime=None, re
             return [], []
         else:
             return []
-    datetimes = parse_datetime(datetimes)
-    min_dts = np.min(datetimes)
-    max_dts = np.max(datetimes)
-    if starttime is None:
-        starttime = min_dts
-    else:
-        starttime = parse_datetime(starttime)
-    if endtime is None:
-        endtime = max_dts
-    else:
-        endtime = parse_datetime(endtime)
-    if starttime > max_dts or endtime < min_dts:
+    as_datetime64 = is_datetime64(datetimes)
+    datetimes = to_datetime64(datetimes)
+    starttime, endtime, out_of_range = _out_of_range(datetimes, starttime, endtime)
+    if out_of_range:
         if return_bin_info:
             return [], []
         else:
             return []
     
-    basket = [0]
-    pool = []
-    for i in range (1, len(datetimes)):
-        if datetimes[i] - datetimes[i-1] < tdelta_threshole:
-            basket.append(i)
-        else:
-            pool.append(basket)
-            basket = [i]
-    pool.append(basket)
+    cuts = np.where(np.diff(datetimes) >= to_timedelta64(tdelta_threshold))[0] + 1
+    pool = np.split(np.arange(len(datetimes)), cuts)
     result = [(b, ) for b in pool]
     if return_bin_info:
-        return result, [(datetimes[b[0]], datetimes[b[-1]]) for b in pool] 
+        return result, [(_like_input(datetimes[b[0]], as_datetime64), _like_input(datetimes[b[-1]], as_datetime64)) for b in pool] 
     else:
         return result
 
@@ -171,7 +239,7 @@ def datetime_neighbor(datetimes, target_datetimes, tdelta_threshold, starttime=N
     """This function finds proper datetimes which are near each target datetime point, within tdelta_threshold, from a serie of datetimes . 
     Returns a list of np.where style tuples. If return_bin_info is True, also returns a list of (bin_start, bin_end) tuples.
     Parameters:
-    datetimes is a seq of datetime objects, to be choosen from.
+    datetimes is a seq of datetime objects or a datetime64 array, to be choosen from.
     target_datetimes: for each one in this, find its neighborhood.
     tdelta_threshold: a timedelta object.
     starttime is a datetime object or None. When it's None, use the first datetime in the input sequence as starttime. Not Implemented
@@ -183,33 +251,27 @@ def datetime_neighbor(datetimes, target_datetimes, tdelta_threshold, starttime=N
             return [], []
         else:
             return []
-    datetimes = parse_datetime(datetimes)
-    min_dts = np.min(datetimes)
-    max_dts = np.max(datetimes)
-    if starttime is None:
-        starttime = min_dts
-    else:
-        starttime = parse_datetime(starttime)
-    if endtime is None:
-        endtime = max_dts
-    else:
-        endtime = parse_datetime(endtime)
-    if starttime > max_dts or endtime < min_dts:
+    datetimes = to_datetime64(datetimes)
+    starttime, endtime, out_of_range = _out_of_range(datetimes, starttime, endtime)
+    if out_of_range:
         if return_bin_info:
             return [], []
         else:
             return []
     
-    result = []
-    bes = []
-    for target in target_datetimes:
-        b = target - tdelta_threshold
-        e = target + tdelta_threshold
-        w = np.where((datetimes>=b) & (datetimes<=e))
-        result.append(w)
-        bes.append((b,e))
+    as_datetime64 = is_datetime64(target_datetimes)
+    target_datetimes = np.atleast_1d(to_datetime64(target_datetimes))
+    tdelta_threshold = to_timedelta64(tdelta_threshold)
+    order = np.argsort(datetimes, kind='mergesort')
+    sorted_dts = datetimes[order]
+    begs = target_datetimes - tdelta_threshold
+    ends = target_datetimes + tdelta_threshold
+    lows = np.searchsorted(sorted_dts, begs, side='left')
+    highs = np.searchsorted(sorted_dts, ends, side='right')
+    result = [(np.sort(order[l:h]), ) for l, h in zip(lows, highs)]
 
     if return_bin_info:
+        bes = zip(_like_input(begs, as_datetime64), _like_input(ends, as_datetime64))
         return result, bes
     else:
         return result
@@ -2,13 +2,20 @@
 
 from datetime import datetime, timedelta
 from dateutil.parser import parse
+import numpy as np
 from .parser import parse_datetime, parse_timedelta
+from .dt64 import is_datetime64, to_datetime64, to_timedelta64
 
 __all__ = ['datetime_range']
 
 def datetime_range(beg, end, tdelta):
     """Returns a list of datetimes from beg to end with tdelta.
+    If beg is a numpy.datetime64, returns a datetime64 array instead (tdelta should not be months or years).
     """
+    if is_datetime64(beg):
+        if not isinstance(tdelta, (timedelta, np.timedelta64)):
+            tdelta = parse_timedelta(tdelta)
+        return np.arange(beg, to_datetime64(end), to_timedelta64(tdelta))
     if not isinstance(beg, datetime):
         beg = parse_datetime(beg)
     if not isinstance(end, datetime):
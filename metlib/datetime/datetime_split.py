@@ -5,8 +5,10 @@ import sys
 from .logical import *
 from .misc import *
 from .parser import *
+from .dt64 import *
 
 __all__ = ['datetime_split', 
+        'CalendarIndex', 'calendar_index',
         'split_type',
         'split_season', 'split_month', 
         'split_weekday', 'split_hour', 'split_year',
@@ -14,10 +16,75 @@ __all__ = ['datetime_split',
         'split_datetime_str'
         ]
 
+class CalendarIndex(object):
+    """Calendar fields of a time axis, computed once as int arrays.
+    Fields: year, month (1-12), hour (0-23), weekday (iso, Mon is 1), 
+        season (1-4, spring to winter), season_year (Jan/Feb belong to the winter of the previous year).
+    Pass it as dts of the split_* functions to reuse it across calls; 
+    the sort order of each field is cached on first use.
+    """
+    fields = ('year', 'month', 'hour', 'weekday', 'season', 'season_year')
+
+    def __init__(self, dts):
+        self.datetimes = to_datetime64(dts).astype('M8[us]')
+        months = self.datetimes.astype('M8[M]').astype('i8')
+        days = self.datetimes.astype('M8[D]').astype('i8')
+        self.year = months // 12 + 1970
+        self.month = months % 12 + 1
+        self.hour = (self.datetimes.astype('M8[h]').astype('i8') - days * 24)
+        self.weekday = (days + 3) % 7 + 1
+        self.season = (self.month + 9) // 3 % 4 + 1
+        self.season_year = self.year - (self.month <= 2)
+        self._orders = dict()
+
+    def __len__(self):
+        return len(self.datetimes)
+
+    def codes(self, field):
+        """int codes of field, which is one of self.fields, or 'year_month' / 'year_season'"""
+        if field == 'year_month':
+            return self.year * 12 + self.month - 1
+        elif field == 'year_season':
+            return self.season_year * 4 + self.season - 1
+        return getattr(self, field)
+
+    def group(self, field, values):
+        """list of index arrays, where field's code equals each of values.
+        Indices are ascending inside each group, the same as np.where .
+        """
+        if field not in self._orders:
+            codes = self.codes(field)
+            order = np.argsort(codes, kind='mergesort')
+            self._orders[field] = (codes[order], order)
+        sorted_codes, order = self._orders[field]
+        values = np.asarray(values, dtype='i8')
+        begs = np.searchsorted(sorted_codes, values, side='left')
+        ends = np.searchsorted(sorted_codes, values, side='right')
+        return [order[b:e] for b, e in zip(begs, ends)]
+
+def calendar_index(dts):
+    """Returns a CalendarIndex of dts (dts itself if it is a CalendarIndex).
+    A new index is made for every other dts, so make one with CalendarIndex(dts)
+    and pass it to the split_* functions to reuse it across calls.
+    """
+    if isinstance(dts, CalendarIndex):
+        return dts
+    return CalendarIndex(dts)
+
+def _split_by(rec, dts, field, values):
+    """split rec by codes of field in index of dts"""
+    if dts is None:
+        dts = rec['datetime']
+    index = calendar_index(dts)
+    return [rec[indice] for indice in index.group(field, values)]
+
 def datetime_split(rec, dts=None, funcs=[]):
     if dts is None:
         dts = rec['datetime']
-    dts = parse_datetime(dts)
+    if isinstance(dts, CalendarIndex):
+        dts = dts.datetimes
+    else:
+        dts = parse_datetime(dts)
     bins = []
     for func in funcs:
         part = rec[np.where(func(dts))]
@@ -25,45 +92,37 @@ def datetime_split(rec, dts=None, funcs=[]):
     return bins
 
 def split_type(rec, codes, return_info=False):
-    unique_codes = list(set(codes))
-    funcs = [lambda s, code=code: s == code for code in unique_codes]
-    res = datetime_split(rec, np.array(codes), funcs)
+    unique_codes, inverse = np.unique(np.asarray(codes), return_inverse=True)
+    order = np.argsort(inverse, kind='mergesort')
+    offsets = np.searchsorted(inverse[order], np.arange(len(unique_codes) + 1))
+    res = [rec[order[offsets[i]:offsets[i+1]]] for i in range(len(unique_codes))]
     if return_info:
-        return res, unique_codes
+        return res, unique_codes.tolist()
     else:
         return res
 
 def split_season(rec, dts=None):
-    return datetime_split(rec, dts, funcs=[
-        lambda s: season_is('spring', s),
-        lambda s: season_is('summer', s),
-        lambda s: season_is('autumn', s),
-        lambda s: season_is('winter', s)
-        ]
-        )
+    return _split_by(rec, dts, 'season', range(1, 5))
 
 def split_month(rec, dts=None):
-    return datetime_split(rec, dts, 
-            funcs=[lambda s, month=month: month_is(month, s) for month in range(1, 13)])
+    return _split_by(rec, dts, 'month', range(1, 13))
 
 def split_weekday(rec, dts=None):
-    return datetime_split(rec, dts, 
-            funcs=[lambda s, weekday=weekday: weekday_is(weekday, s) for weekday in range(1, 8)] )
+    return _split_by(rec, dts, 'weekday', range(1, 8))
 
 def split_hour(rec, dts=None):
-    return datetime_split(rec, dts, 
-            funcs=[lambda s, hour=hour: hour_is(hour, s) for hour in range(0,24)] )
+    return _split_by(rec, dts, 'hour', range(0, 24))
 
 def split_year(rec, dts=None, start_year=None, end_year=None, return_info=False):
     if dts is None:
         dts = rec['datetime']
+    index = calendar_index(dts)
     if start_year is None:
-        start_year = dts[0].year
+        start_year = int(index.year[0])
     if end_year is None:
-        end_year = dts[-1].year + 1
+        end_year = int(index.year[-1]) + 1
     years = range(start_year, end_year)
-    res = datetime_split(rec, dts, 
-            funcs=[lambda s, year=year: year_is(year, s) for year in years] )
+    res = _split_by(rec, index, 'year', years)
     if return_info:
         return res, years
     else:
@@ -72,18 +131,19 @@ def split_year(rec, dts=None, start_year=None, end_year=None, return_info=False)
 def split_year_season(rec, dts=None, start_year=None, end_year=None, start_season=None, end_season=None, return_info=False):
     if dts is None:
         dts = rec['datetime']
+    index = calendar_index(dts)
     auto_start_year = False
     auto_end_year = False
     if start_year is None:
-        start_year = dts[0].year
+        start_year = int(index.year[0])
         auto_start_year = True
     if end_year is None:
-        end_year = dts[-1].year + 1
+        end_year = int(index.year[-1]) + 1
         auto_end_year = True
     if start_season is None:
-        start_season = month2season(dts[0].month, '1234')
+        start_season = int(index.season[0])
     if end_season is None:
-        end_season = month2season(dts[-1].month, '1234')
+        end_season = int(index.season[-1])
     if start_season == 4  and auto_start_year:
         start_year -= 1
     if end_season == 1 and auto_end_year:
@@ -92,8 +152,7 @@ def split_year_season(rec, dts=None, start_year=None, end_year=None, start_seaso
     end_i = -(4-end_season)
     if end_i == 0: end_i = None 
     ys = ys[start_season-1:end_i]
-    res = datetime_split(rec, dts, 
-            funcs=[lambda s, year=year, season=season: year_season_is(year, season, s) for year, season in ys] )
+    res = _split_by(rec, index, 'year_season', [year * 4 + season - 1 for year, season in ys])
     if return_info:
         return res, ys
     else:
@@ -102,20 +161,20 @@ def split_year_season(rec, dts=None, start_year=None, end_year=None, start_seaso
 def split_year_month(rec, dts=None, start_year=None, end_year=None, start_month=None, end_month=None, return_info=False):
     if dts is None:
         dts = rec['datetime']
+    index = calendar_index(dts)
     if start_year is None:
-        start_year = dts[0].year
+        start_year = int(index.year[0])
     if end_year is None:
-        end_year = dts[-1].year + 1
+        end_year = int(index.year[-1]) + 1
     if start_month is None:
-        start_month = dts[0].month
+        start_month = int(index.month[0])
     if end_month is None:
-        end_month = dts[-1].month
+        end_month = int(index.month[-1])
     ym = [(y, m) for y in range(start_year, end_year) for m in range(1,13)]
     end_i = -(12-end_month)
     if end_i == 0: end_i = None
     ym = ym[start_month-1:end_i]
-    res = datetime_split(rec, dts, 
-            funcs=[lambda s, year=year, month=month: year_is(year, s) & month_is(month, s) for year, month in ym] )
+    res = _split_by(rec, index, 'year_month', [year * 12 + month - 1 for year, month in ym])
     if return_info:
         return res, ym
     else:
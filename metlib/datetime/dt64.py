@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+# dt64.py
+"""numpy.datetime64 helpers.
+Inputs of other types (datetime objects, strs, ints) are converted once here,
+after that all comparisons and calendar field extractions are integer arithmetics.
+"""
+
+from datetime import datetime, timedelta, date
+import numpy as np
+from .parser import parse_datetime, _parse_datetime64
+
+__all__ = ['is_datetime64', 'to_datetime64', 'to_timedelta64', 'datetime64_to_datetime',
+        'dt64_year', 'dt64_month', 'dt64_day', 'dt64_hour', 'dt64_minute', 'dt64_second',
+        'dt64_isoweekday', 'dt64_dayofyear']
+
+def is_datetime64(dts):
+    """Returns True if dts is a numpy.datetime64 scalar or array"""
+    return isinstance(dts, np.datetime64) or (isinstance(dts, np.ndarray) and dts.dtype.kind == 'M')
+
+_epoch_ordinal = date(1970, 1, 1).toordinal()
+
+def _datetimes_to_datetime64(dts):
+    """Converts a list / object array of naive datetime objects into datetime64[us] array with int arithmetics,
+    which is several times faster than numpy's own conversion. Returns None if dts is not such a seq.
+    """
+    if isinstance(dts, np.ndarray):
+        if dts.dtype != object:
+            return None
+        shape = dts.shape
+        dts = dts.ravel()
+    elif isinstance(dts, (list, tuple)):
+        shape = (len(dts), )
+    else:
+        return None
+    if len(dts) > 0 and getattr(dts[0], 'tzinfo', None) is not None:
+        return None
+    try:
+        us = np.array([((d.toordinal() - _epoch_ordinal) * 86400 + d.hour * 3600 + d.minute * 60 + d.second) * 1000000 + d.microsecond for d in dts], dtype='i8')
+    except (AttributeError, TypeError):
+        return None
+    return us.view('M8[us]').reshape(shape)
+
+def to_datetime64(dts, unit=None):
+    """Converts datetime/date/str/int or seq of them into numpy.datetime64 scalar or array.
+    datetime64 input is returned as is (or converted to unit).
+    unit: datetime64 unit, e.g. 's', 'us'. Default is 'us' for non datetime64 input, which loses nothing of datetime objects.
+    Failed items (None from parse_datetime) become NaT.
+    """
+    if not is_datetime64(dts):
+        fast_dts = _datetimes_to_datetime64(dts)
+        if fast_dts is not None:
+            dts = fast_dts
+        else:
+            if np.ndim(dts) == 0:
+                first = dts
+            elif np.size(dts) > 0:
+                first = np.ravel(dts)[0]
+            else:
+                first = None
+            try:
+                if first is not None and not isinstance(first, (datetime, date)):
+                    raise TypeError
+                dts = np.array(dts, dtype='M8[us]')
+            except (TypeError, ValueError):
+                dts = _parse_datetime64(dts)
+        if dts.ndim == 0:
+            dts = dts[()]
+    if unit is not None:
+        dts = dts.astype('M8[%s]' % unit)
+    return dts
+
+def to_timedelta64(tdelta, unit='us'):
+    """Converts timedelta (or seq of timedelta) into numpy.timedelta64 in unit"""
+    if isinstance(tdelta, np.timedelta64) or (isinstance(tdelta, np.ndarray) and tdelta.dtype.kind == 'm'):
+        return tdelta.astype('m8[%s]' % unit)
+    return np.array(tdelta, dtype='m8[us]').astype('m8[%s]' % unit)[()]
+
+def datetime64_to_datetime(dts):
+    """Converts datetime64 scalar or array into datetime object(s)"""
+    return np.asarray(dts).astype('M8[us]').astype(object)[()]
+
+def dt64_year(dts):
+    """year of datetime64 array, as int array"""
+    return to_datetime64(dts).astype('M8[Y]').astype('i8') + 1970
+
+def dt64_month(dts):
+    """month (1-12) of datetime64 array, as int array"""
+    return to_datetime64(dts).astype('M8[M]').astype('i8') % 12 + 1
+
+def dt64_day(dts):
+    """day of month of datetime64 array, as int array"""
+    dts = to_datetime64(dts)
+    return (dts.astype('M8[D]') - dts.astype('M8[M]').astype('M8[D]')).astype('i8') + 1
+
+def dt64_dayofyear(dts):
+    """day of year (1-366) of datetime64 array, as int array"""
+    dts = to_datetime64(dts)
+    return (dts.astype('M8[D]') - dts.astype('M8[Y]').astype('M8[D]')).astype('i8') + 1
+
+def dt64_hour(dts):
+    """hour of datetime64 array, as int array"""
+    dts = to_datetime64(dts)
+    return (dts.astype('M8[h]') - dts.astype('M8[D]')).astype('i8')
+
+def dt64_minute(dts):
+    """minute of datetime64 array, as int array"""
+    dts = to_datetime64(dts)
+    return (dts.astype('M8[m]') - dts.astype('M8[h]')).astype('i8')
+
+def dt64_second(dts):
+    """second of datetime64 array, as int array"""
+    dts = to_datetime64(dts)
+    return (dts.astype('M8[s]') - dts.astype('M8[m]')).astype('i8')
+
+def dt64_isoweekday(dts):
+    """iso weekday (Mon is 1, Sun is 7) of datetime64 array, as int array"""
+    # # 1970-01-01 is Thursday
+    return (to_datetime64(dts).astype('M8[D]').astype('i8') + 3) % 7 + 1
+
+if __name__ == '__main__':
+    print dt64_isoweekday(to_datetime64([20130101, 20130106]))
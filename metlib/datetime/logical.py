@@ -3,6 +3,7 @@
 from datetime import datetime, timedelta
 import numpy as np
 from .parser import *
+from .dt64 import *
 
 __all__ = ['year_is', 'month_is', 'hour_is', 'weekday_is',
         'season_is', 'year_season_is', 'datetime_is_between']
@@ -12,97 +13,52 @@ _s_m = {1:(3,4,5),2:(6,7,8),3:(9,10,11),4:(12,1,2),
         'autumn':(9,10,11), 'winter':(12,1,2),
         'fall':(9,10,11)}
 
+def _seasons2months(seasons):
+    months = set()
+    for s in np.array(seasons).flat:
+        try:
+            s = s.lower()
+        except:
+            pass
+        months.update(_s_m[s])
+    return list(months)
+
+def _in(field, values):
+    """True where field is in values, keeping field's shape"""
+    return np.in1d(np.ravel(field), np.ravel(values)).reshape(np.shape(field))
+
+def _field_is(field_func, values, the_datetime):
+    """True where field_func(the_datetime) is in values"""
+    return _in(field_func(to_datetime64(the_datetime)), values)
+
 def year_is(years, the_datetime):
-    the_datetime = parse_datetime(the_datetime)
-    years = np.array(years)
-    the_datetime = np.array(the_datetime)
-    res = np.zeros(the_datetime.shape, dtype='?')
-    for i in range(res.size):
-        res.flat[i] = True if the_datetime.flat[i].year \
-                in years else False
-    return res
+    return _field_is(dt64_year, years, the_datetime)
 
 def month_is(months, the_datetime):
-    the_datetime = parse_datetime(the_datetime)
-    months = np.array(months)
-    the_datetime = np.array(the_datetime)
-    res = np.zeros(the_datetime.shape, dtype='?')
-    for i in range(res.size):
-        res.flat[i] = True if the_datetime.flat[i].month \
-                in months else False
-    return res
+    return _field_is(dt64_month, months, the_datetime)
 
 def hour_is(hours, the_datetime):
-    the_datetime = parse_datetime(the_datetime)
-    hours = np.array(hours)
-    the_datetime = np.array(the_datetime)
-    res = np.zeros(the_datetime.shape, dtype='?')
-    for i in range(res.size):
-        res.flat[i] = True if the_datetime.flat[i].hour \
-                in hours else False
-    return res
+    return _field_is(dt64_hour, hours, the_datetime)
 
 def weekday_is(weekdays, the_datetime):
     """Notice: Mon is 1, Sun is 7, as iso weekday"""
-    the_datetime = parse_datetime(the_datetime)
-    weekdays = np.array(weekdays)
-    the_datetime = np.array(the_datetime)
-    res = np.zeros(the_datetime.shape, dtype='?')
-    for i in range(res.size):
-        res.flat[i] = True if \
-            the_datetime.flat[i].isoweekday() \
-            in weekdays else False
-    return res
+    return _field_is(dt64_isoweekday, weekdays, the_datetime)
 
 def season_is(seasons, the_datetime):
-    the_datetime = parse_datetime(the_datetime)
-    seasons = np.array(seasons)
-    the_datetime = np.array(the_datetime)
-    res = np.zeros(the_datetime.shape, dtype='?')
-    months = set()
-    global _s_m
-    for s in seasons.flat:
-        try:
-            s = s.lower()
-        except:
-            pass
-        months.update(_s_m[s])
-    for i in range(res.size):
-        res.flat[i] = True if the_datetime.flat[i].month \
-                in months else False
-    return res
+    return _field_is(dt64_month, _seasons2months(seasons), the_datetime)
 
 def year_season_is(years, seasons, the_datetime):
-    the_datetime = parse_datetime(the_datetime)
-    years = np.array(years)
-    seasons = np.array(seasons)
-    the_datetime = np.array(the_datetime)
-    res = np.zeros(the_datetime.shape, dtype='?')
-    months = set()
-    global _s_m
-    for s in seasons.flat:
-        try:
-            s = s.lower()
-        except:
-            pass
-        months.update(_s_m[s])
-    for i in range(res.size):
-        dt = the_datetime.flat[i]
-        extra = 1 if dt.month in (1,2) else 0
-        res.flat[i] = True if (dt.month in months and \
-                dt.year - extra in years) else False
-    return res
+    the_datetime = to_datetime64(the_datetime)
+    months = dt64_month(the_datetime)
+    # # Jan and Feb belong to the winter of the previous year
+    season_years = dt64_year(the_datetime) - ((months == 1) | (months == 2))
+    return _in(months, _seasons2months(seasons)) & _in(season_years, years)
 
 def datetime_is_between(datetime_beg, datetime_end, 
         the_datetime):
     """Returns True if dt_beg <= the_datetime < dt_end"""
-    datetime_beg = parse_datetime(datetime_beg)
-    datetime_end = parse_datetime(datetime_end)
-    the_datetime = np.array(the_datetime)
-    res = np.zeros(the_datetime.shape, dtype='?')
-    for i in range(res.size):
-        dt = the_datetime.flat[i]
-        res.flat[i] = True if dt >= datetime_beg and \
-                dt < datetime_end else False
-    return res
+    datetime_beg = to_datetime64(datetime_beg)
+    datetime_end = to_datetime64(datetime_end)
+    the_datetime = to_datetime64(the_datetime)
+    return np.asarray((the_datetime >= datetime_beg) & (the_datetime < datetime_end))
 
@@ -4,7 +4,7 @@
 # misc.py
 
 #import os, sys
-#import re
+import re
 from datetime import datetime, timedelta
 import numpy as np
 #import scipy as sp
@@ -16,6 +16,7 @@ from matplotlib.dates import num2date as mpl_num2date
 from metlib.misc.datatype import isseq
 
 from .parser import *
+from .dt64 import *
 __all__ = ['month2season', 'datetime2season', 'datetime2yearseason',
         'str2datetime', 'datetime_match', 'datetime_filter',
         'season_names', 'month_names', 'month_short_names', 
@@ -55,19 +56,18 @@ def month2season(month, outformat='0123'):
 def datetime2season(dts, outformat='0123'):
     """Converts datetime to season number or names.
     Parameters:
-        dts: datetime / datetime seq.
+        dts: datetime / datetime seq / datetime64 array.
         outformat: '0123', '1234', 'name' or ANY seq with at least 4 elements
 """
-    if isseq(dts):
-        months = [dt.month for dt in T(dts)]
-    else:
-        months = T(dts).month
+    months = dt64_month(to_datetime64(dts))
+    if np.ndim(months) == 0:
+        months = int(months)
     return month2season(months, outformat=outformat)
 
 def datetime2yearseason(dts, seasonformat='name', sep='_', DJF='JF_year'):
     """Converts datetime to "Year_Season" strs
     Parameters:
-        dts: datetime / datetime seq;
+        dts: datetime / datetime seq / datetime64 array;
         seasonformat: '0123', '1234', 'name' or ANY seq with at least 4 elements;
         sep: result str is "Year" + sep + "Season";
         DJF: 
@@ -77,16 +77,16 @@ def datetime2yearseason(dts, seasonformat='name', sep='_', DJF='JF_year'):
     Returns:
         "Year_Season" str/seq.
 """
-    dts = T(dts)
-    if isseq(dts):
+    dts = to_datetime64(dts)
+    if np.ndim(dts) > 0:
         scalar_res = False
     else:
         scalar_res = True
         dts = np.array([dts])
 
     seasons = datetime2season(dts, seasonformat)
-    years = np.array([dt.year for dt in dts])
-    months = np.array([dt.month for dt in dts])
+    years = dt64_year(dts)
+    months = dt64_month(dts)
     if DJF == 'JF_year':
         years[months == 12] += 1
     elif DJF == 'D_year':
@@ -121,6 +121,147 @@ def str2datetime(fmt='%Y-%m-%d %H:%M:%S', *arrays ):
             res[i] = None
     return res
 
+# # strftime directive -> (key field, radix of the field)
+_fmt_fields = {
+        'Y':('year', None), 'y':('year2', 100),
+        'm':('month', 13), 'b':('month', 13), 'B':('month', 13),
+        'j':('doy', 367), 'd':('day', 32),
+        'H':('hour', 24), 'I':('hour12', 12), 'p':('ampm', 2),
+        'M':('minute', 60), 'S':('second', 62), 'f':('microsecond', 1000000),
+        }
+_key_field_radix = dict(_fmt_fields.values())
+_key_field_order = ['year', 'year2', 'month', 'doy', 'day', 'hour', 'hour12', 'ampm', 'minute', 'second', 'microsecond']
+# # key fields -> datetime64 unit, when keys of them are just datetimes truncated to the unit
+_truncate_units = [
+        (('year',), 'Y'), (('year', 'month'), 'M'), (('year', 'month', 'day'), 'D'), (('year', 'doy'), 'D'), 
+        (('year', 'month', 'day', 'hour'), 'h'), (('year', 'doy', 'hour'), 'h'),
+        (('year', 'month', 'day', 'hour', 'minute'), 'm'), (('year', 'doy', 'hour', 'minute'), 'm'),
+        (('year', 'month', 'day', 'hour', 'minute', 'second'), 's'), (('year', 'doy', 'hour', 'minute', 'second'), 's'),
+        (('year', 'month', 'day', 'hour', 'minute', 'second', 'microsecond'), 'us'),
+        (('year', 'doy', 'hour', 'minute', 'second', 'microsecond'), 'us'),
+        ]
+
+def _fmt_key_fields(fmt):
+    """key fields implied by strftime fmt, in _key_field_order, or None if fmt has unsupported directives"""
+    fields = set()
+    i = 0
+    while i < len(fmt):
+        if fmt[i] == '%':
+            if i + 1 >= len(fmt):
+                return None
+            d = fmt[i+1]
+            if d in _fmt_fields:
+                fields.add(_fmt_fields[d][0])
+            elif d != '%':
+                return None
+            i += 2
+        else:
+            i += 1
+    fields = [f for f in _key_field_order if f in fields]
+    radix = 1
+    for f in fields:
+        if f != 'year':
+            radix *= _key_field_radix[f]
+    if radix > 2 ** 48:
+        return None
+    return fields
+
+def _field_values(dts, field):
+    """int array of key field of datetime64 array"""
+    if field == 'year':
+        return dt64_year(dts)
+    elif field == 'year2':
+        return dt64_year(dts) % 100
+    elif field == 'month':
+        return dt64_month(dts)
+    elif field == 'doy':
+        return dt64_dayofyear(dts)
+    elif field == 'day':
+        return dt64_day(dts)
+    elif field == 'hour':
+        return dt64_hour(dts)
+    elif field == 'hour12':
+        return dt64_hour(dts) % 12
+    elif field == 'ampm':
+        return dt64_hour(dts) // 12
+    elif field == 'minute':
+        return dt64_minute(dts)
+    elif field == 'second':
+        return dt64_second(dts)
+    elif field == 'microsecond':
+        return (dts - dts.astype('M8[s]')).astype('i8')
+
+def _datetime_keys(dts, fields):
+    """int64 matching keys of datetimes: the key fields packed with mixed radix"""
+    dts = np.atleast_1d(to_datetime64(dts)).astype('M8[us]')
+    keys = np.zeros(len(dts), dtype='i8')
+    for f in fields:
+        if f != 'year':
+            keys *= _key_field_radix[f]
+        keys += _field_values(dts, f)
+    return keys
+
+def _str_keys(dtstrs, fmt, fields):
+    """int64 matching keys of strs in fmt, -1 for strs that are not exactly what strftime(fmt) gives"""
+    dts = np.zeros(len(dtstrs), dtype='M8[us]')
+    good = np.zeros(len(dtstrs), dtype=bool)
+    for i, dtstr in enumerate(dtstrs):
+        try:
+            dt = datetime.strptime(dtstr, fmt)
+        except (ValueError, TypeError):
+            continue
+        if dt.strftime(fmt) == dtstr:
+            dts[i] = dt
+            good[i] = True
+    keys = _datetime_keys(dts, fields)
+    keys[~good] = -1
+    return keys
+
+def _match_keys(fmt, fmt2, rec_dts, ref_dts=None, ref_dtstrs=None):
+    """matching keys of both sides, as int64 arrays of the fields shown in fmt, or str arrays (strftime) for unusual fmts or fmt2 != fmt.
+    Keys of refs are from ref_dtstrs (in fmt) if given.
+    """
+    fields = _fmt_key_fields(fmt) if fmt2 == fmt else None
+    if fields is not None:
+        rec_keys = _datetime_keys(rec_dts, fields)
+        if ref_dtstrs is None:
+            ref_keys = _datetime_keys(ref_dts, fields)
+        else:
+            ref_keys = _str_keys(ref_dtstrs, fmt, fields)
+    else:
+        if is_datetime64(rec_dts):
+            rec_dts = datetime64_to_datetime(rec_dts)
+        rec_keys = np.array([dt.strftime(fmt) for dt in rec_dts] + [None])[:-1]
+        if ref_dtstrs is None:
+            ref_dtstrs = [dt.strftime(fmt2) for dt in ref_dts]
+        ref_keys = np.array(list(ref_dtstrs) + [None])[:-1]
+    return rec_keys, ref_keys
+
+def _join_keys(rec_keys, ref_keys):
+    """sorted merge of keys.
+    Returns order (stable argsort of rec_keys), begs, ends: 
+    rec indices matching ref_keys[i] are order[begs[i]:ends[i]], ascending.
+    """
+    order = np.argsort(rec_keys, kind='mergesort')
+    sorted_keys = rec_keys[order]
+    begs = np.searchsorted(sorted_keys, ref_keys, side='left')
+    ends = np.searchsorted(sorted_keys, ref_keys, side='right')
+    return order, begs, ends
+
+def _truncated_datetimes(ref_dts, fmt2):
+    """ref_dts truncated to what fmt2 shows, as datetime objects, same as parse_datetime(dt.strftime(fmt2))"""
+    fields = _fmt_key_fields(fmt2)
+    if re.search(r'[0-9A-Za-z]', re.sub(r'%.', '', fmt2)):
+        # # literal digits or letters (e.g. '%Y%m%d12') are parsed too
+        fields = None
+    for unit_fields, unit in _truncate_units:
+        if fields == list(unit_fields):
+            return np.atleast_1d(to_datetime64(ref_dts)).astype('M8[%s]' % unit).astype('M8[us]').astype('O')
+    ref_dts = np.atleast_1d(datetime64_to_datetime(to_datetime64(ref_dts)))
+    res = np.zeros(len(ref_dts), dtype='O')
+    res[:] = parse_datetime([dt.strftime(fmt2) for dt in ref_dts])
+    return res
+
 def datetime_match(rec, ref_dts, fmt="%Y%m%d%H%M%S", fmt2=None, rec_dts_field='datetime', return_index=False, fill_value=np.nan):
     """match a subset of rec to match ref_dts
     rec: recarray to select from.
@@ -130,6 +271,8 @@ def datetime_match(rec, ref_dts, fmt="%Y%m%d%H%M%S", fmt2=None, rec_dts_field='d
     rec_dts_field: 'datetime', 'date', etc. Use None if rec is a datetime seq. Use a datetime seq if rec does not contain a dts field.
     return_index: if False: return selected rec only; if True: also return matching index.
     fill_value: fill value.
+    Datetimes are matched on integer keys of the fields shown in fmt (strftime strs only for unusual fmts),
+    when several records share a key, the last one is used.
 Bug:  There may be None in returned index.
     """
     if fmt2 is None:
@@ -142,42 +285,35 @@ Bug:  There may be None in returned index.
         rec_dts = rec[rec_dts_field]
     else:
         rec_dts = rec_dts_field
-    rec_dtstrs = [dt.strftime(fmt) for dt in rec_dts]
-    rec_dict = dict(zip(rec_dtstrs, range(len(rec_dtstrs))))
-    ref_dtstr = [dt.strftime(fmt2) for dt in ref_dts]
-    res_i = []
-    for dtstr in ref_dtstr:
-        i = rec_dict.get(dtstr, None)
-        res_i.append(i)
+    rec_keys, ref_keys = _match_keys(fmt, fmt2, rec_dts, ref_dts)
+    order, begs, ends = _join_keys(rec_keys, ref_keys)
+    matched = ends > begs
+    res_i = order[ends[matched] - 1]
     if rec_dts_field is None:
-        res = np.zeros(len(res_i), dtype='O')
+        res = np.zeros(len(ref_keys), dtype='O')
+        fields = None
     else:
-        res = np.atleast_1d(np.zeros(len(res_i), rec.dtype))
+        res = np.atleast_1d(np.zeros(len(ref_keys), rec.dtype))
         fields = rec.dtype.names
     res[:] = fill_value
-    if rec_dts_field is None:
-        for i, rec_i in enumerate(res_i):
-            if rec_i is None:
-                pass
-            else:
-                res[i] = rec[rec_i]
+    if fields is None:
+        res[matched] = rec[res_i]
     else:
-        for i, rec_i in enumerate(res_i):
-            if fields is None:
-                if rec_i is None:
-                    res[i] = fill_value
-                else:
-                    res[i] = rec[rec_i]
-            else:
-                if rec_i is None:
-                    # TODO right hand stuff still not perfect
-                    if isinstance(rec_dts_field, (str, unicode)):
-                        res[rec_dts_field][i] = parse_datetime(ref_dtstr[i])
-                else:
-                    for f in fields:
-                        res[f][i] = rec[f][rec_i]
+        for f in fields:
+            res[f][matched] = rec[f][res_i]
+        if isinstance(rec_dts_field, (str, unicode)) and not np.all(matched):
+            # TODO right hand stuff still not perfect
+            unmatched_dts = _truncated_datetimes(np.array(ref_dts, dtype='O')[~matched], fmt2)
+            if res[rec_dts_field].dtype.kind == 'M':
+                unmatched_dts = to_datetime64(unmatched_dts)
+            res[rec_dts_field][~matched] = unmatched_dts
     if return_index:
-        return res, np.array(res_i)
+        index = np.zeros(len(ref_keys), dtype='i8')
+        index[matched] = res_i
+        if not np.all(matched):
+            index = index.astype('O')
+            index[~matched] = None
+        return res, index
     else:
         return res
 
@@ -192,34 +328,29 @@ def datetime_filter(rec, ref_dts, fmt="%Y%m%d%H%M%S", fmt2=None, rec_dts_field='
     fill_value: fill value.
     """
     rec = np.array(rec)
+    ref_dtstrs = None
     if isinstance(ref_dts[0], (str, unicode)) and fmt2 is None:
-        ref_dtstr = ref_dts
+        ref_dtstrs = ref_dts
+        fmt2 = fmt
     else:
         if fmt2 is None:
             fmt2 = fmt
         ref_dts = parse_datetime(ref_dts)
-        ref_dtstr = [dt.strftime(fmt2) for dt in ref_dts]
     if rec_dts_field is None:
         rec_dts = rec
     elif isinstance(rec_dts_field, (str, unicode)):
         rec_dts = rec[rec_dts_field]
     else:
         rec_dts = rec_dts_field
-    rec_dtstrs = [dt.strftime(fmt) for dt in rec_dts]
-    rec_dict = dict()
-    for i in range(len(rec_dtstrs)):
-        if rec_dtstrs[i] not in rec_dict:
-            rec_dict[rec_dtstrs[i]] = [i]
-        else:
-            rec_dict[rec_dtstrs[i]].append(i)
-    res_i = []
-    for dtstr in ref_dtstr:
-        i_list = rec_dict.get(dtstr, None)
-        if i_list is not None:
-            res_i.extend(i_list)
+    rec_keys, ref_keys = _match_keys(fmt, fmt2, rec_dts, ref_dts, ref_dtstrs)
+    order, begs, ends = _join_keys(rec_keys, ref_keys)
+    counts = ends - begs
+    # # concatenation of order[begs[i]:ends[i]] for all i
+    firsts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    res_i = order[np.repeat(begs - firsts, counts) + np.arange(counts.sum())]
     res = np.atleast_1d(rec[(res_i,)])
     if return_index:
-        return res, np.array(res_i)
+        return res, res_i
     else:
         return res
 
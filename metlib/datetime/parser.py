@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 
 import re
+from collections import OrderedDict
 from datetime import datetime, timedelta, date
 from dateutil.relativedelta import relativedelta
 from dateutil.parser import parse
@@ -8,6 +9,199 @@ import numpy as np
 
 __all__ = ['parse_datetime', 'parse_timedelta', 'T', 'TD']
 
+_numonly_pattern = re.compile(r'\D*')
+_jfmtstr_all = '%Y%j%H%M%S'
+_gfmtstr_all = '%Y%m%d%H%M%S'
+
+def _parse_one(timestr, force_datetime=True):
+    """parse_datetime of a single value"""
+    if isinstance(timestr, (datetime, )):
+        return timestr
+    if isinstance(timestr, (date, )):
+        if force_datetime == True:
+            return datetime.fromordinal(timestr.toordinal())
+        else:
+            return timestr
+    if isinstance(timestr, (int, long, np.integer)):
+        timestr = str(timestr)
+        
+    if len(timestr) == 10:
+        if re.match(r'^\d{10}$', timestr):
+            timestr = timestr + '00'
+        elif re.match(r'^\d{4}.\d{2}.\d{2}$', timestr):
+            timestr = timestr + ' 00:00:00'
+    try:
+        res = parse(timestr)
+    except ValueError:
+        try:
+            numonly_str = re.sub(_numonly_pattern, '', timestr)
+            nl = len(numonly_str)
+            if nl >= 7:
+                if nl % 2 == 1:   #YYYYJJJ[...]
+                    fmtstr = _jfmtstr_all[:4+nl-7]
+                else:             #YYYYMMDD[...]
+                    fmtstr = _gfmtstr_all[:4+nl-8]
+                res = datetime.strptime(numonly_str, fmtstr)
+            else:
+                res = parse(numonly_str)
+        except Exception:
+            res = None
+    return res
+
+_parse_cache = OrderedDict()
+_parse_cache_size = 4096
+
+def _parse_one_cached(timestr, force_datetime=True):
+    """_parse_one with a LRU cache for str and int values.
+    Only values in a full fixed format (see _infer_template) are cached, other strs (e.g. '12:00')
+    may be completed by dateutil with today's date, which must not be kept.
+    """
+    if not isinstance(timestr, (int, long, np.integer, str, unicode)):
+        return _parse_one(timestr, force_datetime)
+    if _infer_template(timestr if isinstance(timestr, (str, unicode)) else str(timestr)) is None:
+        return _parse_one(timestr, force_datetime)
+    key = (type(timestr), timestr)
+    try:
+        res = _parse_cache.pop(key)
+    except KeyError:
+        res = _parse_one(timestr, force_datetime)
+        if len(_parse_cache) >= _parse_cache_size:
+            _parse_cache.popitem(last=False)
+    _parse_cache[key] = res
+    return res
+
+# # Fixed formats for bulk parsing: field codes of digit runs.
+# # Y: year, m: month, d: day, j: day of year, H, M, S: hour, minute, second
+_digit_templates = {
+        7:'YYYYjjj', 8:'YYYYmmdd', 9:'YYYYjjjHH', 10:'YYYYmmddHH', 12:'YYYYmmddHHMM', 14:'YYYYmmddHHMMSS',
+        }
+_sep_templates = ['YYYY?mm?dd', 'YYYY?mm?dd?HH?MM', 'YYYY?mm?dd?HH?MM?SS']
+_sep_chars = '-/.:T _'
+_bulk_min_size = 64
+_bulk_sample_size = 8
+
+def _infer_template(sample):
+    """fixed format template of sample str, e.g. 'YYYY-mm-dd HH:MM:SS', or None"""
+    if sample.isdigit():
+        return _digit_templates.get(len(sample), None)
+    for template in _sep_templates:
+        if len(template) != len(sample):
+            continue
+        ok = True
+        for t, c in zip(template, sample):
+            if (t == '?' and c not in _sep_chars) or (t != '?' and not c.isdigit()):
+                ok = False
+                break
+        if ok:
+            return ''.join([c if t == '?' else t for t, c in zip(template, sample)])
+    return None
+
+def _template_fields(template):
+    """list of (field code, start, length) of template"""
+    fields = []
+    i = 0
+    while i < len(template):
+        c = template[i]
+        if c in 'YmdjHMS':
+            n = 1
+            while i + n < len(template) and template[i+n] == c:
+                n += 1
+            fields.append((c, i, n))
+            i += n
+        else:
+            i += 1
+    return fields
+
+def _values_from_ints(values, template):
+    """dict of field code: int array, and valid mask, of ints written in template (digits only)"""
+    values = np.asarray(values, dtype='i8')
+    L = len(template)
+    valid = (values >= 10 ** (L - 1)) & (values < 10 ** L)
+    fields = dict()
+    rest = values.copy()
+    for code, start, n in reversed(_template_fields(template)):
+        fields[code] = rest % 10 ** n
+        rest //= 10 ** n
+    return fields, valid
+
+def _values_from_strs(timestrs, template):
+    """dict of field code: int array, and valid mask, of strs written in template"""
+    L = len(template)
+    arr = np.asarray(timestrs, dtype='S%d' % (L + 1)).view('u1').reshape(-1, L + 1).astype('i4')
+    valid = arr[:, L] == 0
+    digits = arr - ord('0')
+    fields = dict()
+    for code, start, n in _template_fields(template):
+        seled = digits[:, start:start+n]
+        valid &= np.all((seled >= 0) & (seled <= 9), axis=1)
+        fields[code] = np.dot(seled, 10 ** np.arange(n - 1, -1, -1))
+    for i, c in enumerate(template):
+        if c not in 'YmdjHMS':
+            valid &= arr[:, i] == ord(c)
+    return fields, valid
+
+def _fields_to_datetime64(fields, valid):
+    """datetime64[us] array from field values, invalid dates are marked in valid"""
+    year = fields['Y']
+    valid &= year >= 1
+    years = (year - 1970).astype('M8[Y]')
+    if 'j' in fields:
+        days = years.astype('M8[D]') + (fields['j'] - 1).astype('m8[D]')
+        valid &= (fields['j'] >= 1) & (days.astype('M8[Y]') == years)
+    else:
+        month, day = fields['m'], fields['d']
+        valid &= (month >= 1) & (month <= 12) & (day >= 1)
+        months = years.astype('M8[M]') + (np.clip(month, 1, 12) - 1).astype('m8[M]')
+        days = months.astype('M8[D]') + (day - 1).astype('m8[D]')
+        valid &= days.astype('M8[M]') == months
+    res = days.astype('M8[us]')
+    for code, unit, limit in (('H', 'h', 24), ('M', 'm', 60), ('S', 's', 60)):
+        if code in fields:
+            valid &= fields[code] < limit
+            res = res + fields[code].astype('m8[%s]' % unit)
+    return res
+
+def _parse_bulk(timestrs):
+    """Parses a 1-d seq of identically formatted ints or strs into datetime64[us] array with a fixed format vectorized routine.
+    The format is inferred from a sample and checked against per element parsing of the sample.
+    Returns (datetime64 array, invalid indices) or None if no fixed format applies.
+    Items at invalid indices need per element parsing.
+    """
+    arr = np.asarray(timestrs)
+    if arr.ndim != 1 or len(arr) < _bulk_min_size:
+        return None
+    is_int = arr.dtype.kind in 'iu'
+    if arr.dtype.kind not in 'iuSUO':
+        return None
+    sample_i = np.linspace(0, len(arr) - 1, _bulk_sample_size).astype('i8')
+    sample = arr[sample_i]
+    if arr.dtype.kind == 'O':
+        if all(isinstance(x, (int, long, np.integer)) for x in sample):
+            is_int = True
+        elif not all(isinstance(x, (str, unicode)) for x in sample):
+            return None
+    template = _infer_template(str(sample[0]))
+    if template is None or (is_int and not template.isalpha()):
+        return None
+    try:
+        if is_int:
+            fields, valid = _values_from_ints(arr, template)
+        else:
+            fields, valid = _values_from_strs(arr, template)
+    except (ValueError, TypeError, UnicodeError, OverflowError):
+        return None
+    res = _fields_to_datetime64(fields, valid)
+    res[~valid] = np.datetime64('NaT')
+    for x, r, v in zip(sample, res[sample_i].astype('O'), valid[sample_i]):
+        if not v:
+            continue
+        try:
+            if _parse_one_cached(x) != r:
+                return None
+        except Exception:
+            return None
+    return res, np.flatnonzero(~valid)
+
 def parse_datetime(timestr, force_datetime=True):
     """Try parse timestr or integer or list of str/integer into datetimes
     timestr: single value or seq of:
@@ -18,56 +212,29 @@ def parse_datetime(timestr, force_datetime=True):
     force_datetime: 
                 if True: return datetime even if input is date.
                 if False: return date if input is date.
+    Long seqs of identically formatted ints/strs are parsed in bulk, only items not in the common format are parsed one by one.
+    Single strs/ints are cached.
     """
-    numonly_pattern = re.compile(r'\D*')
-    jfmtstr_all = '%Y%j%H%M%S'
-    gfmtstr_all = '%Y%m%d%H%M%S'
-    return_single = False
     if isinstance(timestr, (int, long, np.integer, str, unicode, datetime, date)):
-        timestrs = [timestr]
-        return_single = True
-    else:
-        timestrs = timestr
-    res_list = []
-    for timestr in timestrs:
-        if isinstance(timestr, (datetime, )):
-            res_list.append(timestr)
-            continue
-        if isinstance(timestr, (date, )):
-            if force_datetime == True:
-                res_list.append(datetime.fromordinal(timestr.toordinal()))
-            else:
-                res_list.append(timestr)
-            continue
-        if isinstance(timestr, (int, long, np.integer)):
-            timestr = str(timestr)
-            
-        if len(timestr) == 10:
-            if re.match(r'^\d{10}$', timestr):
-                timestr = timestr + '00'
-            elif re.match(r'^\d{4}.\d{2}.\d{2}$', timestr):
-                timestr = timestr + ' 00:00:00'
-        try:
-            res = parse(timestr)
-        except ValueError:
-            try:
-                numonly_str = re.sub(numonly_pattern, '', timestr)
-                nl = len(numonly_str)
-                if nl >= 7:
-                    if nl % 2 == 1:   #YYYYJJJ[...]
-                        fmtstr = jfmtstr_all[:4+nl-7]
-                    else:             #YYYYMMDD[...]
-                        fmtstr = gfmtstr_all[:4+nl-8]
-                    res = datetime.strptime(numonly_str, fmtstr)
-                else:
-                    res = parse(numonly_str)
-            except Exception:
-                res = None
-        res_list.append(res)
-    if return_single:
-        return res_list[0]
-    else:
-        return res_list
+        return _parse_one_cached(timestr, force_datetime)
+    bulk = _parse_bulk(timestr)
+    if bulk is None:
+        return [_parse_one_cached(x, force_datetime) for x in timestr]
+    dts, outliers = bulk
+    res = dts.astype('O')
+    for i in outliers:
+        res[i] = _parse_one_cached(timestr[i], force_datetime)
+    return res.tolist()
+
+def _parse_datetime64(timestr):
+    """parse_datetime, but returns datetime64[us] array (NaT for failed items), without making datetime objects for bulk parsed items"""
+    bulk = _parse_bulk(timestr)
+    if bulk is None:
+        return np.array(parse_datetime(timestr), dtype='M8[us]')
+    dts, outliers = bulk
+    if len(outliers) > 0:
+        dts[outliers] = np.array([_parse_one_cached(timestr[i]) for i in outliers], dtype='M8[us]')
+    return dts
 
 _tdelta_dict = {'d':'days', 'h':'hours', 'm':'minutes', 's':'seconds'}
 _rel_tdelta_dict = {'Y':'years', 'M':'months', 'W':'weeks'}
@@ -11,5 +11,6 @@ from .lidarplot import *
 from .filter_cloud  import *
 from .peak import *
 from .layer import *
+from .pipeline import *
 
 __all__ = filter(lambda s: not s.startswith('_'), dir())
@@ -3,6 +3,8 @@
 # atmos.py
 
 import os, sys
+import hashlib
+from collections import OrderedDict
 #import re
 #from datetime import datetime, timedelta
 import numpy as np
@@ -17,33 +19,39 @@ __all__ = ['AtmosProfile',
         'interp_p_t_profile', 
         'interp_single_profile',
         'calc_betam',
+        'BetamCache', 'betam_cache', 'get_betam', 'std_profiles',
         'prof_midlatitude_summer', 'prof_midlatitude_winter',
         'prof_subarctic_summer', 'prof_subarctic_winter', 'prof_tropical',
         'prof_us1976']
 
 
-class AtmosProfile(object):
+class _LazyProfile(object):
+    """Profile read from a csv file on first access of its fields."""
+    _fields = ()
+
     def __init__(self, fname):
-        data = np.loadtxt(fname, dtype=[('height', 'f4'), ('pressure', 'f4'), ('temperature', 'f4')], skiprows=1, delimiter=',')
-        self.height = data['height']
-        self.pressure = data['pressure']
-        self.temperature = data['temperature']
-        self._len = len(self.height)
-        self.name = os.path.basename(fname).rstrip('.profile')
+        self.fname = fname
+        self.name = os.path.splitext(os.path.basename(fname))[0]
+        self._data = None
 
-    def __len__(self):
-        return self._len
+    def load(self):
+        if self._data is None:
+            self._data = np.loadtxt(self.fname, dtype=[(field, 'f4') for field in self._fields], skiprows=1, delimiter=',')
+        return self._data
 
-class SingleProfile(object):
-    def __init__(self, fname):
-        data = np.loadtxt(fname, dtype=[('height', 'f4'), ('value','f4')], skiprows=1, delimiter=',')
-        self.height = data['height']
-        self.value = data['value']
-        self._len = len(self.height)
-        self.name = os.path.basename(fname).rstrip('.profile')
+    def __getattr__(self, name):
+        if name in self._fields:
+            return self.load()[name]
+        raise AttributeError(name)
 
     def __len__(self):
-        return self._len
+        return len(self.load())
+
+class AtmosProfile(_LazyProfile):
+    _fields = ('height', 'pressure', 'temperature')
+
+class SingleProfile(_LazyProfile):
+    _fields = ('height', 'value')
 
 def interp_single_profile(prof, data, elev_angle=90.0):
     """interp single field profile to match lidar data.
@@ -96,6 +104,7 @@ def calc_betam(p, t, l=523.0, rho_n=0.02842):
 
 _real_dir = os.path.dirname(__file__)
 
+# standard atmosphere profiles, the files are read on first access
 prof_midlatitude_summer = AtmosProfile(os.path.join(_real_dir, 'data', 'midlatitude_summer.profile'))
 prof_midlatitude_winter = AtmosProfile(os.path.join(_real_dir, 'data', 'midlatitude_winter.profile'))
 prof_subarctic_summer = AtmosProfile(os.path.join(_real_dir, 'data', 'subarctic_summer.profile'))
@@ -103,5 +112,81 @@ prof_subarctic_winter = AtmosProfile(os.path.join(_real_dir, 'data', 'subarctic_
 prof_tropical = AtmosProfile(os.path.join(_real_dir, 'data', 'tropical.profile'))
 prof_us1976 = AtmosProfile(os.path.join(_real_dir, 'data', 'us1976.profile'))
 
+std_profiles = dict([(prof.name, prof) for prof in (prof_midlatitude_summer, prof_midlatitude_winter,
+    prof_subarctic_summer, prof_subarctic_winter, prof_tropical, prof_us1976)])
+
+class BetamCache(object):
+    """LRU cache of betam profiles, keyed by (profile file, wavelength, rho_n, distance grid, elev_angle).
+    The profile file is identified by its absolute path, mtime and size, so edited files are not served stale.
+    maxsize: max number of profiles kept in memory.
+    cache_dir: if not None, profiles are also saved there as .npy files, and read back when not in memory.
+    Cached profiles are read only.
+    """
+    def __init__(self, maxsize=32, cache_dir=None):
+        self.maxsize = maxsize
+        self.cache_dir = cache_dir
+        self._cache = OrderedDict()
+
+    def __len__(self):
+        return len(self._cache)
+
+    def clear(self):
+        """clear the profiles in memory, .npy files are kept"""
+        self._cache.clear()
+
+    @staticmethod
+    def key(prof, distance, l=523.0, rho_n=0.02842, elev_angle=90.0):
+        """cache key, the distance grid is represented by its size and digest"""
+        distance = np.ascontiguousarray(distance, dtype='f8')
+        fname = os.path.abspath(prof.fname)
+        try:
+            st = os.stat(fname)
+            stamp = (st.st_mtime, st.st_size)
+        except OSError:
+            stamp = (None, None)
+        return (fname, ) + stamp + (float(l), float(rho_n), len(distance), hashlib.sha1(distance.tobytes()).hexdigest(), float(elev_angle))
+
+    def _fname(self, key):
+        name = os.path.splitext(os.path.basename(key[0]))[0]
+        return os.path.join(self.cache_dir, 'betam_%s_%s.npy' % (name, hashlib.sha1(repr(key)).hexdigest()[:16]))
+
+    def get(self, prof, data, l=523.0, rho_n=0.02842, elev_angle=90.0):
+        """betam profile of prof (an AtmosProfile, or a name in std_profiles) on the distance of data, see get_betam"""
+        if isinstance(prof, (str, unicode)):
+            prof = std_profiles[prof]
+        distance = data['distance'] if type(data) is LidarDataset else np.asarray(data)
+        key = self.key(prof, distance, l, rho_n, elev_angle)
+        if key in self._cache:
+            betam = self._cache.pop(key)
+        else:
+            betam = None
+            if self.cache_dir is not None and os.path.exists(self._fname(key)):
+                betam = np.load(self._fname(key))
+            if betam is None:
+                p, t = interp_p_t_profile(prof, distance, elev_angle)
+                betam = calc_betam(p, t, l, rho_n)
+                if self.cache_dir is not None:
+                    if not os.path.isdir(self.cache_dir):
+                        os.makedirs(self.cache_dir)
+                    np.save(self._fname(key), betam)
+            betam.setflags(write=False)
+            if len(self._cache) >= self.maxsize:
+                self._cache.popitem(last=False)
+        self._cache[key] = betam
+        return betam
+
+betam_cache = BetamCache()
+
+def get_betam(prof, data, l=523.0, rho_n=0.02842, elev_angle=90.0, cache=None):
+    """betam (km-1) of prof interpolated onto lidar data, i.e. calc_betam(*interp_p_t_profile(prof, data, elev_angle), l=l, rho_n=rho_n),
+    computed once and cached.
+    prof: an AtmosProfile object, or name of a standard profile, e.g. 'us1976', see std_profiles.
+    data: a LidarDataset object, or simply an array of distance.
+    cache: a BetamCache, default is betam_cache.
+    """
+    if cache is None:
+        cache = betam_cache
+    return cache.get(prof, data, l, rho_n, elev_angle)
+
 if __name__ == '__main__':
     pass
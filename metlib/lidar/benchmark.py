@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+
+# benchmark.py
+"""Benchmarks of lidar processing routines against their plain loop versions.
+Run as:
+    python -m metlib.lidar.benchmark
+"""
+
+import os, sys
+import time
+from datetime import datetime, timedelta
+import numpy as np
+from .lidar import LidarDataset, bin_reduce
+from .process import brutal_denoise, gentle_denoise, find_first_index_below_gate
+
+__all__ = ['fake_dataset', 'bench_time_average', 'bench_denoise']
+
+def fake_dataset(n_records=2880, n_channels=2, n_bins=1000, bin_time=30, nan_ratio=0.01, seed=0):
+    """make a LidarDataset filled with random data, no files needed.
+    n_records, n_channels, n_bins: sizes of TIME, CHANNEL, BIN dims.
+    bin_time: seconds between records.
+    nan_ratio: ratio of nan values in 'data'.
+    """
+    rs = np.random.RandomState(seed)
+    d = LidarDataset.__new__(LidarDataset)
+    d.init_clean()
+    d.dims.update({'TIME':n_records, 'CHANNEL':n_channels, 'BIN':n_bins})
+    data = rs.rand(n_records, n_channels, n_bins).astype('f4')
+    data[rs.rand(*data.shape) < nan_ratio] = np.nan
+    starttime = np.datetime64('2012-01-01T00:00:00')
+    variables = [
+        ('data', ('TIME', 'CHANNEL', 'BIN'), data, 'sum'),
+        ('datetime', ('TIME',), starttime + np.arange(n_records) * bin_time, 'special'),
+        ('distance', ('BIN',), np.arange(n_bins, dtype='f4') * 30.0, 'mean'),
+        ('energy', ('TIME', 'CHANNEL'), rs.rand(n_records, n_channels).astype('f4'), 'sum'),
+        ('background', ('TIME', 'CHANNEL'), rs.rand(n_records, n_channels).astype('f4'), 'sum'),
+        ('background_std_dev', ('TIME', 'CHANNEL'), rs.rand(n_records, n_channels).astype('f4'), 'sqr_mean_sqrt'),
+        ('temperature', ('TIME',), rs.randn(n_records).astype('f8'), 'mean'),
+        ('shots_sum', ('TIME',), np.ones(n_records, dtype='i4') * bin_time * 2500, 'sum'),
+        ('trigger_frequency', ('TIME',), np.ones(n_records, dtype='i4') * 2500, 'first'),
+        ('elev_angle', ('TIME',), np.ones(n_records, dtype='f4') * 90.0, 'min'),
+        ('peak_power', ('TIME',), rs.randn(n_records).astype('f4'), 'positive_max'),
+        ]
+    for vname, dims, arr, aver_method in variables:
+        d.vars[vname] = arr
+        d.var_dims[vname] = dims
+        d.var_aver_methods[vname] = aver_method
+    d.attrs.update({'lidarname':'fake', 'bin_time':bin_time, 'bin_size':30.0,
+        'first_data_bin':0, 'number_bins':n_bins, 'number_channels':n_channels,
+        'desc':'fake data'})
+    d.recheck_time()
+    return d
+
+def _bin_reduce_loop(arr, bin_begs, bin_ends, aver_method):
+    """reference version of lidar.bin_reduce, reducing one bin at a time"""
+    res = np.zeros((len(bin_begs),) + arr.shape[1:], dtype=arr.dtype)
+    for i, (b, e) in enumerate(zip(bin_begs, bin_ends)):
+        seled = arr[b:e]
+        if len(seled) == 0:
+            if arr.dtype.char not in ('f', 'd', 'g'):
+                res[i] = 0
+            else:
+                res[i] = np.nan
+        elif aver_method == 'sum':
+            res[i] = np.nansum(seled, axis=0)
+        elif aver_method == 'mean':
+            res[i] = np.ma.filled(np.ma.masked_invalid(seled).mean(axis=0), np.nan)
+        elif aver_method == 'first':
+            res[i] = seled[0]
+        elif aver_method == 'sqr_mean_sqrt':
+            res[i] = np.ma.filled(np.sqrt(np.mean(np.ma.masked_invalid(seled) ** 2, axis=0)), np.nan)
+        elif aver_method in ('min', 'max', 'positive_min', 'positive_max'):
+            if aver_method == 'positive_min':
+                maskarr = np.ma.masked_where(~(seled >= 0), seled)
+            elif aver_method == 'positive_max':
+                maskarr = np.ma.masked_where(~(seled <= 0), seled)
+            else:
+                maskarr = np.ma.masked_invalid(seled)
+            if aver_method.endswith('min'):
+                extreme = maskarr.min(axis=0)
+            else:
+                extreme = maskarr.max(axis=0)
+            res[i] = np.ma.where(np.ma.getmaskarray(extreme), seled[0], extreme)
+    return res
+
+def _timeit(func, *args, **kwargs):
+    beg = time.time()
+    res = func(*args, **kwargs)
+    return res, time.time() - beg
+
+def bench_time_average(n_records=2880, n_channels=2, n_bins=1000, aver_minutes=5):
+    """compare LidarDataset.time_average's bin_reduce with the per bin loop version.
+    Default size is one day of 30-second profiles.
+    Returns dict of vname: (loop_seconds, vectorized_seconds, max_abs_diff)
+    """
+    d = fake_dataset(n_records, n_channels, n_bins)
+    dts = d['datetime']
+    edges = np.array([dts[0] + timedelta(minutes=aver_minutes) * i for i in range(len(dts) // (aver_minutes * 2) + 2)])
+    bin_begs = np.searchsorted(dts, edges[:-1])
+    bin_ends = np.searchsorted(dts, edges[1:])
+    result = dict()
+    for vname in d.vars:
+        if 'TIME' not in d.var_dims[vname] or vname == 'datetime':
+            continue
+        aver_method = d.var_aver_methods[vname]
+        loop_res, loop_t = _timeit(_bin_reduce_loop, d[vname], bin_begs, bin_ends, aver_method)
+        vec_res, vec_t = _timeit(bin_reduce, d[vname], bin_begs, bin_ends, aver_method)
+        diff = np.abs(loop_res.astype('f8') - vec_res.astype('f8'))
+        same_nan = np.all(np.isnan(loop_res.astype('f8')) == np.isnan(vec_res.astype('f8')))
+        max_diff = np.nanmax(diff) if np.any(np.isfinite(diff)) else 0.0
+        result[vname] = (loop_t, vec_t, max_diff if same_nan else np.inf)
+    total = _timeit(d.copy().time_average, aver_minutes)[1]
+    print "time_average on %d x %d x %d records: %.3fs" % (n_records, n_channels, n_bins, total)
+    print "%-20s %-15s %10s %10s %10s" % ('var', 'aver_method', 'loop(s)', 'vector(s)', 'max_diff')
+    for vname in sorted(result):
+        print "%-20s %-15s %10.4f %10.4f %10.3g" % ((vname, d.var_aver_methods[vname]) + result[vname])
+    return result
+
+def _brutal_denoise_loop(data, gate, **kwargs):
+    """reference version of process.brutal_denoise, one profile at a time"""
+    indice = find_first_index_below_gate(data, gate, **kwargs)
+    for idx in np.ndindex(*indice.shape):
+        i = indice[idx]
+        if i != -1:
+            data[idx][i:] = gate
+
+def _gentle_denoise_loop(data, gate, gate2=None, **kwargs):
+    """reference version of process.gentle_denoise, one profile at a time"""
+    if gate2 is None:
+        gate2 = gate
+    indice = find_first_index_below_gate(data, gate, **kwargs)
+    for idx in np.ndindex(*indice.shape):
+        i = indice[idx]
+        if i != -1:
+            aver = np.ma.masked_invalid(data[idx][i:]).mean()
+            if aver < gate2:
+                aver = gate2
+            data[idx][i:] = aver
+
+def bench_denoise(n_records=2880, n_channels=2, n_bins=1000, gate=0.05, start_i=10):
+    """compare brutal_denoise and gentle_denoise with their per profile loop versions.
+    Default size is one day of 30-second profiles.
+    Returns dict of func name: (loop_seconds, vectorized_seconds, max_abs_diff)
+    """
+    d = fake_dataset(n_records, n_channels, n_bins)
+    # decaying profiles, so that the noise starts at different bins
+    data = d['data'] * np.exp(-np.arange(n_bins) / (n_bins * 0.2)).astype('f4')
+    result = dict()
+    for name, loop_func, vec_func in (('brutal_denoise', _brutal_denoise_loop, brutal_denoise),
+            ('gentle_denoise', _gentle_denoise_loop, gentle_denoise)):
+        loop_res = data.copy()
+        loop_t = _timeit(loop_func, loop_res, gate, start_i=start_i)[1]
+        vec_res, vec_t = _timeit(vec_func, data, gate, out=np.empty_like(data), start_i=start_i)
+        diff = np.abs(loop_res.astype('f8') - vec_res.astype('f8'))
+        same_nan = np.all(np.isnan(loop_res) == np.isnan(vec_res))
+        max_diff = np.nanmax(diff) if np.any(np.isfinite(diff)) else 0.0
+        result[name] = (loop_t, vec_t, max_diff if same_nan else np.inf)
+    print "denoise on %d x %d x %d records:" % (n_records, n_channels, n_bins)
+    print "%-20s %10s %10s %10s" % ('func', 'loop(s)', 'vector(s)', 'max_diff')
+    for name in sorted(result):
+        print "%-20s %10.4f %10.4f %10.3g" % ((name,) + result[name])
+    return result
+
+if __name__ == '__main__':
+    bench_time_average()
+    bench_denoise()
@@ -15,8 +15,53 @@ from .constant import lidar_sm
 from .lidarutil import height_to_index
 from .process import fill_lower_part
 
-__all__ = ['fernald', 'fernald_ref']
-def fernald(data, lidar_constant, lidar_ratio, betam, fill_index=0, fill_aver_num=1, C_contains_E=False, apply_on_data=False):
+__all__ = ['fernald', 'fernald_batch', 'fernald_ref']
+
+def _scratch(workspace, name, shape, dtype):
+    """a scratch array of shape and dtype, reusing workspace[name]'s memory if it is big enough"""
+    size = int(np.prod(shape))
+    buf = workspace.get(name, None)
+    if buf is None or buf.dtype != dtype or buf.size < size:
+        buf = np.empty(size, dtype=dtype)
+        workspace[name] = buf
+    return buf[:size].reshape(shape)
+
+def _time_slicer(arr, length, ndim):
+    """function slicing arr along TIME for a chunk if arr has a TIME axis (as data in ndim dims), or keeping it as is"""
+    if np.ndim(arr) == ndim and ndim >= 2 and np.shape(arr)[0] == length and length > 1:
+        arr = np.asarray(arr)
+        return lambda beg, end: arr[beg:end]
+    return lambda beg, end: arr
+
+def _time_chunks(length, time_chunk):
+    """(beg, end) of TIME chunks"""
+    if time_chunk is None or time_chunk <= 0:
+        time_chunk = max(length, 1)
+    return [(beg, min(beg + time_chunk, length)) for beg in range(0, max(length, 1), time_chunk)]
+
+def _fernald_kernel(X, CE, lidar_ratio, exp_coef, intbm, betam, dz, start_i, fill_index, fill_aver_num, out, tmp):
+    """fernald's retrieval in place: the result is written to out, tmp is scratch of the same shape.
+    exp_coef is -2.0*(lidar_ratio-lidar_sm).
+    The steps are the same as the plain numpy expressions in comments, so are the results.
+    """
+    # # XexpIntBm = data * np.exp(-2.0*(lidar_ratio-lidar_sm)*intbm)
+    np.multiply(X, np.exp(exp_coef*intbm), out=out)
+    # # intXexpIntBm[..., start_i:] = np.add.accumulate(XexpIntBm[..., start_i:] * dz, axis=-1)
+    tmp[..., :start_i] = 0.0
+    np.multiply(out[..., start_i:], dz, out=tmp[..., start_i:])
+    np.add.accumulate(tmp[..., start_i:], axis=-1, out=tmp[..., start_i:])
+    # # bottom_term = CE - 2.0 * lidar_ratio * intXexpIntBm
+    tmp *= 2.0 * lidar_ratio
+    np.subtract(CE, tmp, out=tmp)
+    # # sigma_a = (XexpIntBm / bottom_term - betam) * lidar_ratio
+    out /= tmp
+    out -= betam
+    out[..., :start_i] = 0.0
+    out *= lidar_ratio
+    fill_lower_part(out, fill_index, fill_aver_num)
+    return out
+
+def fernald(data, lidar_constant, lidar_ratio, betam, fill_index=0, fill_aver_num=1, C_contains_E=False, apply_on_data=False, out=None, workspace=None, dtype=None, time_chunk=None):
     """fernald 1984's retrieval method.
     data: a LidarDataset object which contains normalized data or a faked one (dict-like).
     lidar_constant: lidar constant.
@@ -26,8 +71,13 @@ def fernald(data, lidar_constant, lidar_ratio, betam, fill_index=0, fill_aver_nu
     fill_aver_num: fill lower part with this number of samples
     C_contains_E: whether the lidar constant is C or C*E
     apply_on_data: whether to apply the result on data.
+    out: array to write the result into, in the same shape of data['data'].
+    workspace: a dict of scratch arrays, reused across calls.
+    dtype: dtype of the calculation, e.g. 'f4' for float32. Default is the dtype numpy gives.
+    time_chunk: if not None, process data in chunks of this number of records, to bound the scratch memory.
 
-    Returns: aerosol extinction coeffecient (sigma) with the same shape of data['data'].
+    Returns: aerosol extinction coeffecient (sigma) with the same shape of data['data'],
+        as a plain ndarray, with nan where older versions returned masked values.
 
     data should contain the following key-like entries: 
         'data' (in shape of (TIME, CHANNEL, BIN) or (TIME, BIN) or (BIN,));
@@ -47,34 +97,114 @@ def fernald(data, lidar_constant, lidar_ratio, betam, fill_index=0, fill_aver_nu
         lidar_constant = np.array(lidar_constant)[:, np.newaxis, np.newaxis]
     if np.ndim(lidar_ratio) == 1 and np.shape(lidar_ratio)[0] == len(data):
         lidar_ratio = np.array(lidar_ratio)[:, np.newaxis, np.newaxis]
-    CE = np.zeros_like(data['data'])
+    X = data['data']
+    shape = X.shape
+    exp_coef = -2.0*(lidar_ratio-lidar_sm)
+    if dtype is None:
+        dtype = np.result_type(X.dtype, intbm, lidar_ratio)
+    else:
+        dtype = np.dtype(dtype)
+        intbm = intbm.astype(dtype)
+        betam = np.asarray(betam, dtype=dtype)
+        lidar_ratio = np.asarray(lidar_ratio, dtype=dtype)
+        exp_coef = np.asarray(exp_coef, dtype=dtype)
+    if out is None:
+        out = np.empty(shape, dtype=dtype)
+    elif out.shape != shape:
+        raise ValueError("out should be in shape of %s" % (shape, ))
+    if workspace is None:
+        workspace = dict()
+    # # CE is constant along BIN, so it is kept in the shape of lidar_constant * energy
     if C_contains_E:
-        CE[:] = lidar_constant
+        CE = np.asarray(lidar_constant, dtype=X.dtype)
     else:
-        CE[:] = lidar_constant * data['energy'][..., np.newaxis]
-
-    expIntBm = np.exp(-2.0*(lidar_ratio-lidar_sm)*intbm)
+        CE = np.asarray(lidar_constant * np.asarray(data['energy'])[..., np.newaxis], dtype=X.dtype)
 
-    XexpIntBm = data['data'] * expIntBm
-
-    intXexpIntBm = np.zeros_like(XexpIntBm)
-    intXexpIntBm[...,start_i:] = np.add.accumulate(XexpIntBm[...,start_i:] * dz, axis=-1)
-
-    bottom_term = CE - 2.0 * lidar_ratio * intXexpIntBm
-
-    ba = XexpIntBm / bottom_term - betam 
-    ba[...,:start_i] = 0.0
-    sigma_a = ba * lidar_ratio
-    fill_lower_part(sigma_a, fill_index, fill_aver_num)
+    if len(shape) >= 2:
+        length = shape[0]
+        chunks = _time_chunks(length, time_chunk)
+    else:
+        length = 1
+        chunks = [(0, 1)]
+    CE_of = _time_slicer(CE, length, len(shape))
+    ratio_of = _time_slicer(lidar_ratio, length, len(shape))
+    coef_of = _time_slicer(exp_coef, length, len(shape))
+    for beg, end in chunks:
+        if len(shape) >= 2:
+            X_c, out_c = np.asarray(X[beg:end]), out[beg:end]
+        else:
+            X_c, out_c = np.asarray(X), out
+        tmp = _scratch(workspace, 'fernald_tmp', out_c.shape, dtype)
+        _fernald_kernel(X_c, CE_of(beg, end), ratio_of(beg, end), coef_of(beg, end), intbm, betam, dz, start_i, fill_index, fill_aver_num, out_c, tmp)
 
     if apply_on_data:
-        data['data'] = sigma_a
+        data['data'] = out
         data.desc += ',retrieved'
-    
-    return sigma_a.copy()
+        return out.copy()
+    return out
+
+def fernald_batch(data, lidar_constant, lidar_ratios, betam, fill_index=0, fill_aver_num=1, C_contains_E=False, reduce_func=None, max_bytes=256*1024**2, dtype=None, workspace=None):
+    """fernald 1984's retrieval method, with many lidar ratios at once.
+    The lidar ratios are evaluated along an extra leading axis, in chunks of ratios that fit in max_bytes.
+    Work not depending on lidar ratio (integral of betam, C*E) is done only once.
+    data, lidar_constant, betam, fill_index, fill_aver_num, C_contains_E, dtype, workspace: see fernald().
+    lidar_ratios: 1-d seq of lidar ratios.
+    reduce_func: if not None, called on each chunk as reduce_func(sigma_a, ratios), 
+        where sigma_a is in shape of (len(ratios),) + data['data'].shape,
+        it should return an array with ratios as the first axis. 
+        Use it to avoid keeping all the retrievals in memory.
+    max_bytes: memory budget of the temporaries of a chunk.
+
+    Returns: aerosol extinction coeffecient (sigma) in shape of (len(lidar_ratios),) + data['data'].shape,
+        or the concatenated results of reduce_func.
+    """
+    try:
+        start_i = data['first_data_bin']
+    except:
+        start_i = 0
+    dz = data['bin_size'] / 1000.0    # convert to km
+    intbm = np.zeros_like(betam)
+    intbm[..., start_i:] = np.add.accumulate(betam[..., start_i:]*dz)
+    X = np.asarray(data['data'])
+    if np.ndim(lidar_constant) == 1 and np.shape(lidar_constant)[0] == len(data):
+        lidar_constant = np.array(lidar_constant)[:, np.newaxis, np.newaxis]
+    if C_contains_E:
+        CE = np.asarray(lidar_constant, dtype=X.dtype)
+    else:
+        CE = np.asarray(lidar_constant * data['energy'][..., np.newaxis], dtype=X.dtype)
+    if dtype is None:
+        dtype = np.result_type(X, intbm)
+    else:
+        dtype = np.dtype(dtype)
+        intbm = intbm.astype(dtype)
+        betam = np.asarray(betam, dtype=dtype)
+    if workspace is None:
+        workspace = dict()
 
+    lidar_ratios = np.atleast_1d(np.asarray(lidar_ratios, dtype='f8'))
+    chunk_size = max(1, int(max_bytes // max(X.size * dtype.itemsize * 2, 1)))
+    results = []
+    for beg in range(0, len(lidar_ratios), chunk_size):
+        ratios = lidar_ratios[beg:beg+chunk_size]
+        shape = (len(ratios),) + X.shape
+        # # coefficients are computed in float64 then cast, as a python float lidar ratio gives in fernald()
+        S = ratios.reshape((-1,) + (1,) * X.ndim)
+        exp_coef = (-2.0*(S-lidar_sm)).astype(dtype)
+        S = S.astype(dtype)
+        tmp = _scratch(workspace, 'fernald_batch_tmp', shape, dtype)
+        if reduce_func is None:
+            sigma_a = np.empty(shape, dtype=dtype)
+        else:
+            sigma_a = _scratch(workspace, 'fernald_batch_out', shape, dtype)
+        _fernald_kernel(X, CE, S, exp_coef, intbm, betam, dz, start_i, fill_index, fill_aver_num, sigma_a, tmp)
+        if reduce_func is None:
+            results.append(sigma_a)
+        else:
+            # # copied, as the result may be a view of the scratch sigma_a, which the next chunk overwrites
+            results.append(np.array(reduce_func(sigma_a, ratios), copy=True))
+    return np.concatenate(results, axis=0)
 
-def fernald_ref(data, lidar_ratio, betam, ref_height, ref_sigma_a, ref_aver_num, elev_angle=90.0, apply_on_data=False):
+def fernald_ref(data, lidar_ratio, betam, ref_height, ref_sigma_a, ref_aver_num, elev_angle=90.0, apply_on_data=False, out=None, workspace=None, dtype=None, time_chunk=None):
     """fernald 1984's retrieval method.
     data: a LidarDataset object which contains normalized data.
     lidar_ratio: lidar ratio.
@@ -84,8 +214,11 @@ def fernald_ref(data, lidar_ratio, betam, ref_height, ref_sigma_a, ref_aver_num,
     ref_aver_num: average several points around that height.
     elev_angle: elev angle of lidar.
     apply_on_data: whether to apply the result on data.
+    out, workspace, dtype, time_chunk: see fernald().
 
-    Returns: aerosol extinction coeffecient (sigma) with the same shape of data['data'].
+    Returns: aerosol extinction coeffecient (sigma) with the same shape of data['data'],
+        as a plain ndarray, with nan where older versions returned masked values.
+        Profiles without valid data around ref_height are nan.
 
     data should contain the following key-like entries: 
         'data' (in shape of (TIME, CHANNEL, BIN) or (TIME, BIN) or (BIN,));
@@ -104,31 +237,72 @@ def fernald_ref(data, lidar_ratio, betam, ref_height, ref_sigma_a, ref_aver_num,
     ref_index = height_to_index(ref_height, data, elev_angle)
     ref_beg_index = ref_index - ref_aver_num / 2
     ref_end_index = ref_beg_index + ref_aver_num
-    Xref = np.ma.masked_invalid(data['data'][..., ref_beg_index:ref_end_index]).mean(axis=-1)[..., np.newaxis]
-    Xref_beta = Xref / (betam[ref_index] + ref_sigma_a / lidar_ratio)
 
     intbm = np.zeros_like(betam)
     intbm[..., ref_index:] = np.add.accumulate(betam[..., ref_index:]*dz, axis=-1)
     intbm[..., ref_index-1::-1] = np.add.accumulate(-betam[...,ref_index-1::-1]*dz, axis=-1)
 
-    expIntBm = np.exp(-2.0*(lidar_ratio-lidar_sm)*intbm)
-
-    XexpIntBm = data['data'] * expIntBm
-
-    intXexpIntBm = np.zeros_like(XexpIntBm)
-    intXexpIntBm[...,ref_index:] = np.add.accumulate(XexpIntBm[..., ref_index:]*dz, axis=-1)
-    intXexpIntBm[...,ref_index-1::-1] = np.add.accumulate(-XexpIntBm[..., ref_index-1::-1]*dz, axis=-1)
+    X = data['data']
+    shape = X.shape
+    betam_ref = betam[ref_index]
+    exp_coef = -2.0*(lidar_ratio-lidar_sm)
+    if dtype is None:
+        # # the masked mean of reference data may be in a wider dtype than data
+        Xref_dtype = np.ma.masked_invalid(np.zeros(1, dtype=X.dtype)).mean(axis=-1).dtype
+        dtype = np.result_type(X.dtype, Xref_dtype, intbm, lidar_ratio)
+    else:
+        dtype = np.dtype(dtype)
+        intbm = intbm.astype(dtype)
+        betam = np.asarray(betam, dtype=dtype)
+        lidar_ratio = np.asarray(lidar_ratio, dtype=dtype)
+        exp_coef = np.asarray(exp_coef, dtype=dtype)
+    if out is None:
+        out = np.empty(shape, dtype=dtype)
+    elif out.shape != shape:
+        raise ValueError("out should be in shape of %s" % (shape, ))
+    if workspace is None:
+        workspace = dict()
 
-    bottom_term = Xref_beta - 2.0 * lidar_ratio * intXexpIntBm
+    if len(shape) >= 2:
+        length = shape[0]
+        chunks = _time_chunks(length, time_chunk)
+    else:
+        length = 1
+        chunks = [(0, 1)]
+    ratio_of = _time_slicer(lidar_ratio, length, len(shape))
+    coef_of = _time_slicer(exp_coef, length, len(shape))
+    for beg, end in chunks:
+        if len(shape) >= 2:
+            X_c, out_c = np.asarray(X[beg:end]), out[beg:end]
+        else:
+            X_c, out_c = np.asarray(X), out
+        S = ratio_of(beg, end)
+        tmp = _scratch(workspace, 'fernald_tmp', out_c.shape, dtype)
+        Xref = np.ma.filled(np.ma.masked_invalid(X_c[..., ref_beg_index:ref_end_index]).mean(axis=-1), np.nan)[..., np.newaxis]
+        Xref_beta = Xref / (betam_ref + ref_sigma_a / S)
 
-    ba = XexpIntBm / bottom_term - betam 
-    ba[...,:start_i] = 0.0
-    sigma_a = ba * lidar_ratio
+        # # XexpIntBm = data * np.exp(-2.0*(lidar_ratio-lidar_sm)*intbm)
+        np.multiply(X_c, np.exp(coef_of(beg, end)*intbm), out=out_c)
+        # # intXexpIntBm: integrated upwards from ref_index, and downwards below it
+        np.multiply(out_c[..., ref_index:], dz, out=tmp[..., ref_index:])
+        np.add.accumulate(tmp[..., ref_index:], axis=-1, out=tmp[..., ref_index:])
+        np.negative(out_c[..., ref_index-1::-1], out=tmp[..., ref_index-1::-1])
+        tmp[..., ref_index-1::-1] *= dz
+        np.add.accumulate(tmp[..., ref_index-1::-1], axis=-1, out=tmp[..., ref_index-1::-1])
+        # # bottom_term = Xref_beta - 2.0 * lidar_ratio * intXexpIntBm
+        tmp *= 2.0 * S
+        np.subtract(Xref_beta, tmp, out=tmp)
+        # # sigma_a = (XexpIntBm / bottom_term - betam) * lidar_ratio
+        out_c /= tmp
+        out_c -= betam
+        out_c[..., :start_i] = 0.0
+        out_c *= S
 
     if apply_on_data:
-        data['data'] = sigma_a
+        data['data'] = out
         data.desc += ',retrieved'
-    
-    return sigma_a.copy()
+        return out.copy()
+    return out
+
 if __name__ == '__main__':
     pass
@@ -14,37 +14,69 @@ from .lidar import LidarDataset
 
 __all__ = ['filter_cloud']
 
-def filter_cloud(data, gate, repeat=1, start_index=0, fillvalue=np.nan):
-    """
-    Returns: filtered_data, cloud_index
+def _window_all(cr, repeat):
+    """det[..., k] is True if cr[..., k:k+repeat] are all True, using cumulative sums along the last axis."""
+    csum = np.zeros(cr.shape[:-1] + (cr.shape[-1] + 1,), dtype='i4')
+    np.cumsum(cr, axis=-1, out=csum[..., 1:])
+    return (csum[..., repeat:] - csum[..., :-repeat]) == repeat
+
+def _window_cover(det, repeat):
+    """bins covered by any window started at a True of det, i.e. det dilated by repeat - 1 bins upwards."""
+    bin_num = det.shape[-1] + repeat - 1
+    csum = np.zeros(det.shape[:-1] + (bin_num + 1,), dtype='i4')
+    np.cumsum(det, axis=-1, out=csum[..., 1:det.shape[-1]+1])
+    csum[..., det.shape[-1]+1:] = csum[..., det.shape[-1]:det.shape[-1]+1]
+    lo = np.maximum(np.arange(bin_num) - repeat + 1, 0)
+    return csum[..., 1:] - csum[..., lo] > 0
+
+def _compact_int(bin_num):
+    return np.int16 if bin_num < np.iinfo(np.int16).max else np.int32
+
+def filter_cloud(data, gate, repeat=1, start_index=0, fillvalue=np.nan, extended=False):
+    """find clouds in lidar data and fill data from cloud base on with fillvalue.
+    A cloud starts where repeat successive bins are all above gate, in any channel.
+    data: LidarDataset, array[TIME, CHANNEL, BIN] or array[TIME, BIN].
+    gate: threshold, scalar or one per channel.
+    repeat: number of successive bins above gate to be a cloud.
+    start_index: bins below start_index are not checked.
+    fillvalue: value to fill from the cloud base on.
+    extended: if True, also returns cloud top and number of cloud layers.
+    Returns: filtered_data, cloud_index (-1 for no cloud)
+        if extended: filtered_data, cloud_base, cloud_top, layer_num, in compact int arrays, -1 for no cloud.
     """
     if type(data) is LidarDataset:
         data = data['data']
     gate = np.asarray(gate)
     if gate.shape != tuple() and gate.shape[-1] != 1:
         gate = gate[...,np.newaxis]
-    
-    cr = data > gate
+    bin_num = data.shape[-1]
+    repeat = max(min(repeat, bin_num), 1)
+
+    with np.errstate(invalid='ignore'):
+        cr = data > gate
     cr[..., :start_index] = False
-    det = cr[..., repeat-1:].copy()
-    for i in range(1,repeat):
-        det = det & cr[..., repeat-1-i:-i]
+    det = _window_all(cr, repeat)
     # treat as cloud if any channel has cloud
-    final = np.logical_or.accumulate(det, axis=1)
-    if start_index < repeat :
-        start_index = repeat 
-    # The trick of including one pixel under start_index makes that if there's no True value, 
-    # it will return the index below start_index, which is filtered by the tricky compare below. Using start_index-1 to cope with the situation when all False(no cloud), then in the following check: if index[i] >= start_index..., start_index-1 will be filter out. Too tricky anyway.
-    indexs = (final[..., start_index-1:].argmax(axis=-1) + start_index - 1).reshape(final.shape[0])
-#    print indexs
-    
+    if det.ndim == 3:
+        det = det.any(axis=1)
+    has_cloud = det.any(axis=-1)
+    indexs = np.where(has_cloud, det.argmax(axis=-1), -1)
+
     newdata = data.copy()
-    for i in range(data.shape[0]):
-        if indexs[i] >= start_index:
-            newdata[i, :, indexs[i]:] = fillvalue
-        else:
-            indexs[i] = -1
-    return newdata, indexs
+    first = np.where(has_cloud, indexs, bin_num)
+    mask = np.arange(bin_num) >= first[:, np.newaxis]
+    if newdata.ndim == 3:
+        mask = mask[:, np.newaxis, :]
+    np.copyto(newdata, fillvalue, where=mask, casting='unsafe')
+    if not extended:
+        return newdata, indexs
+
+    itype = _compact_int(bin_num)
+    cover = _window_cover(det, repeat)
+    layer_num = (cover[..., 0] + (cover[..., 1:] & ~cover[..., :-1]).sum(axis=-1)).astype(itype)
+    cloud_top = np.where(has_cloud, bin_num - 1 - cover[..., ::-1].argmax(axis=-1), -1).astype(itype)
+    cloud_base = indexs.astype(itype)
+    return newdata, cloud_base, cloud_top, layer_num
 
 if __name__ == '__main__':
     pass
@@ -5,6 +5,7 @@
 import os, sys, re
 import numpy as np
 from copy import copy, deepcopy
+from netCDF4 import Dataset
 from .peak import *
 from metlib.misc.datatype import Null, limited_int
 
@@ -83,6 +84,10 @@ def parse_cells(s):
     return res
 
 def parse_cellfile(cell_fname):
+    """reads cells file, in text format or written by save_cells, into list of lists of LayerCell"""
+    if _is_netcdf(cell_fname):
+        with CellFile(cell_fname) as cf:
+            return list(cf)
     res = []
     with open(cell_fname) as cell_file:
         for line in cell_file:
@@ -98,6 +103,141 @@ def cell2str(cell):
     else:
         return repr(cell)
 
+# Binary (netCDF4) persistence of cells, layers and markers.
+# Cells of all groups (time steps, or layers) are stored column by column along the 'cell' dim,
+# with 'offsets' giving where each group starts, so that any group is read with one hyperslab per column.
+cell_dtype = np.dtype([('ID', 'i4'), ('index', 'i4'), ('center', 'i4'), ('lower', 'i4'), ('upper', 'i4'),
+    ('sign', 'i1'), ('life', 'i4'), ('fulllife', 'i4'), ('healthy', 'i1'), ('has_peak', 'i1'),
+    ('peak_center', 'i4'), ('peak_lower', 'i4'), ('peak_upper', 'i4'), ('peak_depth', 'f8'), ('peak_volume', 'f8')])
+
+marker_dtype = np.dtype([('ID', 'i4'), ('layerID1', 'i4'), ('layerID2', 'i4'), ('x', 'i4'), ('y', 'i4'), ('marker', 'S1')])
+
+def _cell2record(c):
+    p = c.peak
+    if p is None:
+        peak = (0, 0, 0, 0, 0.0, 0.0)
+    else:
+        peak = (1, p.center, p.lower, p.upper, p.depth, p.volume)
+    return (c.ID, c.index, c.center, c.lower, c.upper, c.sign, int(c.life), c.fulllife, c.healthy) + peak
+
+def cells2array(cells):
+    """converts seq of LayerCell into structured array of cell_dtype, None cells are dropped"""
+    return np.array([_cell2record(c) for c in cells if c not in (None, Null)], dtype=cell_dtype)
+
+def array2cells(arr):
+    """converts structured array of cell_dtype into list of LayerCell"""
+    res = []
+    for (ID, index, center, lower, upper, sign, life, fulllife, healthy, has_peak,
+            p_center, p_lower, p_upper, p_depth, p_volume) in arr.tolist():
+        peak = Peak(p_center, p_lower, p_upper, p_depth, p_volume) if has_peak else None
+        res.append(LayerCell(ID, center, lower, upper, sign=sign, life=life, fulllife=fulllife,
+            healthy=bool(healthy), peak=peak, index=index))
+    return res
+
+def _is_netcdf(fname):
+    with open(fname, 'rb') as f:
+        magic = f.read(4)
+    return magic[:3] == 'CDF' or magic == '\x89HDF'
+
+def _write_columns(f, dimname, arr):
+    """write structured array arr as one var per field along dim dimname"""
+    f.createDimension(dimname, len(arr))
+    for name in arr.dtype.names:
+        t = arr.dtype[name]
+        if t.kind == 'S':
+            t = 'S1'
+        f.createVariable(name, t, (dimname,))
+        f.variables[name][:] = arr[name]
+
+def _read_columns(f, dtype, beg=0, end=None):
+    """read records [beg:end] of vars written by _write_columns into a structured array"""
+    names = dtype.names
+    if end is None:
+        end = len(f.variables[names[0]])
+    res = np.empty(end - beg, dtype=dtype)
+    for name in names:
+        res[name] = f.variables[name][beg:end]
+    return res
+
+def _write_cell_groups(fname, cells_list, content, keys=None):
+    counts = [len([c for c in cells if c not in (None, Null)]) for cells in cells_list]
+    offsets = np.zeros(len(cells_list) + 1, dtype='i8')
+    np.cumsum(counts, out=offsets[1:])
+    arr = cells2array([c for cells in cells_list for c in cells])
+    _write_cell_records(fname, arr, offsets, content, keys)
+
+def _write_cell_records(fname, arr, offsets, content, keys=None):
+    f = Dataset(fname, 'w', format='NETCDF4')
+    try:
+        f.setncattr('content', content)
+        f.createDimension('group', len(offsets))
+        f.createVariable('offsets', 'i8', ('group',))
+        f.variables['offsets'][:] = offsets
+        if keys is not None:
+            f.createDimension('key', len(keys))
+            f.createVariable('keys', 'i4', ('key',))
+            f.variables['keys'][:] = keys
+        _write_columns(f, 'cell', arr)
+    finally:
+        f.close()
+
+class CellFile(object):
+    """Reader of cell files written by save_cells / save_layers.
+    Only the group offsets are read when opened, cells of group i (a time step, or a layer) are read on access,
+    e.g.:
+        with CellFile('cells.nc') as cf:
+            cells = cf[100]
+            for cells in cf:
+                ...
+    """
+    def __init__(self, fname):
+        self.fname = fname
+        self.f = Dataset(fname)
+        self.f.set_auto_mask(False)
+        self.content = self.f.getncattr('content')
+        self.offsets = self.f.variables['offsets'][:]
+        self.keys = self.f.variables['keys'][:] if 'keys' in self.f.variables else None
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def records(self, i):
+        """cells of group i as a structured array of cell_dtype"""
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError('group index %d out of range' % i)
+        return _read_columns(self.f, cell_dtype, self.offsets[i], self.offsets[i+1])
+
+    def __getitem__(self, i):
+        return array2cells(self.records(i))
+
+    def iter_records(self, chunk=1024):
+        """yields cells of each group as structured arrays, reading chunk groups at a time"""
+        for gbeg in range(0, len(self), chunk):
+            gend = min(gbeg + chunk, len(self))
+            beg = self.offsets[gbeg]
+            block = _read_columns(self.f, cell_dtype, beg, self.offsets[gend])
+            for i in range(gbeg, gend):
+                yield block[self.offsets[i] - beg:self.offsets[i+1] - beg]
+
+    def __iter__(self):
+        for recs in self.iter_records():
+            yield array2cells(recs)
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def save_cells(fname, cells_list):
+    """save cells_list (list of lists of LayerCell, one per time step, as parse_cellfile returns) in binary format, see CellFile"""
+    _write_cell_groups(fname, cells_list, 'cells')
+
 class LayerInfo(object):
     def __init__(self, beg_cell=None):
         if beg_cell is None:
@@ -165,36 +305,275 @@ class LayerInfo(object):
     def __repr__(self):
         return self.__str__()
 
+def _cell_field(name, conv, writable=True):
+    def fget(self):
+        return conv(self.store.records[name][self.pos])
+    def fset(self, value):
+        self.store.records[name][self.pos] = value
+    return property(fget, fset if writable else None)
+
+class CellView(object):
+    """A LayerCell-like view of one cell in a LayerStore, changes of attributes go into the store.
+    ID and index are read only, as the store is sorted by them.
+    """
+    __slots__ = ('store', 'pos')
+    def __init__(self, store, pos):
+        self.store = store
+        self.pos = pos
+
+    ID = _cell_field('ID', int, False)
+    index = _cell_field('index', int, False)
+    center = _cell_field('center', int)
+    lower = _cell_field('lower', int)
+    upper = _cell_field('upper', int)
+    sign = _cell_field('sign', int)
+    fulllife = _cell_field('fulllife', int)
+    healthy = _cell_field('healthy', bool)
+
+    @property
+    def life(self):
+        return int(self.store.records['life'][self.pos])
+
+    @life.setter
+    def life(self, value):
+        rec = self.store.records[self.pos]
+        rec['life'] = min(max(int(value), 0), rec['fulllife'])
+
+    @property
+    def peak(self):
+        rec = self.store.records[self.pos]
+        if not rec['has_peak']:
+            return None
+        return Peak(int(rec['peak_center']), int(rec['peak_lower']), int(rec['peak_upper']), rec['peak_depth'], rec['peak_volume'])
+
+    def to_cell(self):
+        """a standalone LayerCell copy"""
+        return array2cells(self.store.records[self.pos:self.pos+1])[0]
+
+    __str__ = LayerCell.__dict__['__str__']
+    __repr__ = LayerCell.__dict__['__repr__']
+
+class LayerView(object):
+    """A LayerInfo-like view of one layer in a LayerStore, cells are CellViews."""
+    __slots__ = ('store', 'ID', 'beg', 'end')
+    def __init__(self, store, ID, beg, end):
+        self.store = store
+        self.ID = ID
+        self.beg = beg
+        self.end = end
+
+    @property
+    def records(self):
+        """structured array of cell_dtype of the layer's cells (a view into the store)"""
+        return self.store.records[self.beg:self.end]
+
+    @property
+    def cells(self):
+        return [CellView(self.store, pos) for pos in range(self.beg, self.end)]
+
+    @property
+    def beg_cell(self):
+        return CellView(self.store, self.beg) if len(self) > 0 else None
+
+    @property
+    def end_cell(self):
+        return CellView(self.store, self.end - 1) if len(self) > 0 else None
+
+    @property
+    def beg_index(self):
+        return int(self.store.records['index'][self.beg]) if len(self) > 0 else None
+
+    @property
+    def end_index(self):
+        return int(self.store.records['index'][self.end - 1]) if len(self) > 0 else None
+
+    def __len__(self):
+        return self.end - self.beg
+
+    def __iter__(self):
+        return iter(self.cells)
+
+    def between(self, beg_index, end_index):
+        """records of cells with beg_index <= index < end_index"""
+        lo, hi = np.clip([beg_index - self.beg_index, end_index - self.beg_index], 0, len(self))
+        return self.records[lo:max(lo, hi)]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            rel_index = slice(None if index.start is None else index.start - self.beg_index,
+                    None if index.stop is None else index.stop - self.beg_index,
+                    index.step)
+            return self.cells[rel_index]
+        rel_i = index - self.beg_index
+        if 0 <= rel_i < len(self):
+            return CellView(self.store, self.beg + rel_i)
+        else:
+            raise IndexError('Index %d out of layer range %d - %d' % \
+                (index, self.beg_index, self.end_index))
+
+    def to_layer(self):
+        """a standalone LayerInfo copy"""
+        layer = LayerInfo()
+        layer.ID = self.ID
+        layer.cells = array2cells(self.records)
+        return layer
+
+    show_layer = LayerInfo.__dict__['show_layer']
+    __str__ = LayerInfo.__dict__['__str__']
+    __repr__ = LayerInfo.__dict__['__repr__']
+
+class LayerStore(object):
+    """Struct-of-arrays store of layer cells, keyed by layer ID and time index.
+    records: structured array of cell_dtype, sorted by ID, then index.
+    layer_ids, layer_offsets: cells of layer layer_ids[i] are records[layer_offsets[i]:layer_offsets[i+1]].
+    indexs, index_order, index_offsets: cells at time index indexs[j] are records[index_order[index_offsets[j]:index_offsets[j+1]]].
+    The store works as a dict of ID: LayerView, e.g. store[ID][index] is a CellView.
+    """
+    def __init__(self, records):
+        records = np.asarray(records, dtype=cell_dtype)
+        self.records = records[np.lexsort((records['index'], records['ID']))]
+        ids = self.records['ID']
+        self.layer_ids, starts = np.unique(ids, return_index=True)
+        self.layer_offsets = np.append(starts, len(ids))
+        self.index_order = np.argsort(self.records['index'], kind='mergesort')
+        self.indexs, starts = np.unique(self.records['index'][self.index_order], return_index=True)
+        self.index_offsets = np.append(starts, len(ids))
+
+    @classmethod
+    def from_layers(cls, layers):
+        """build from seq of LayerInfo"""
+        return cls(cells2array([c for layer in layers for c in layer.cells]))
+
+    @classmethod
+    def from_cells(cls, cells_list):
+        """build from list of lists of LayerCell (as parse_cellfile returns)"""
+        return cls(cells2array([c for cells in cells_list for c in cells]))
+
+    @classmethod
+    def load(cls, fname):
+        """load from a file written by save_layers / save_cells"""
+        with CellFile(fname) as cf:
+            return cls(_read_columns(cf.f, cell_dtype))
+
+    def save(self, fname):
+        """save as layers, see save_layers"""
+        _write_cell_records(fname, self.records, self.layer_offsets, 'layers', keys=self.layer_ids)
+
+    def _layer_pos(self, ID):
+        i = np.searchsorted(self.layer_ids, ID)
+        if i >= len(self.layer_ids) or self.layer_ids[i] != ID:
+            raise KeyError(ID)
+        return i
+
+    def __getitem__(self, ID):
+        i = self._layer_pos(ID)
+        return LayerView(self, int(self.layer_ids[i]), int(self.layer_offsets[i]), int(self.layer_offsets[i+1]))
+
+    def __contains__(self, ID):
+        try:
+            self._layer_pos(ID)
+            return True
+        except KeyError:
+            return False
+
+    def __len__(self):
+        return len(self.layer_ids)
+
+    def keys(self):
+        return [int(ID) for ID in self.layer_ids]
+
+    def values(self):
+        return [self[ID] for ID in self.keys()]
+
+    def items(self):
+        return [(ID, self[ID]) for ID in self.keys()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def cells_at(self, index):
+        """CellViews of all cells at time index"""
+        j = np.searchsorted(self.indexs, index)
+        if j >= len(self.indexs) or self.indexs[j] != index:
+            return []
+        return [CellView(self, int(pos)) for pos in self.index_order[self.index_offsets[j]:self.index_offsets[j+1]]]
+
+    def records_at(self, index):
+        """records of all cells at time index"""
+        j = np.searchsorted(self.indexs, index)
+        if j >= len(self.indexs) or self.indexs[j] != index:
+            return self.records[:0]
+        return self.records[self.index_order[self.index_offsets[j]:self.index_offsets[j+1]]]
+
+    def to_layers(self):
+        """list of standalone LayerInfo"""
+        return [view.to_layer() for view in self.values()]
+
+    def segments(self, IDs, start_indexs, max_number):
+        """vectorized get_layer_segment for many layers.
+        IDs, start_indexs, max_number: arrays (or scalars) of the same length.
+        Returns offsets, positions: cells of the i-th segment are records[positions[offsets[i]:offsets[i+1]]].
+        """
+        IDs, start_indexs, max_number = np.broadcast_arrays(IDs, start_indexs, max_number)
+        lp = np.searchsorted(self.layer_ids, IDs)
+        if np.any(lp >= len(self.layer_ids)) or np.any(self.layer_ids[np.minimum(lp, len(self.layer_ids) - 1)] != IDs):
+            raise KeyError('Unknown layer IDs')
+        beg = self.layer_offsets[lp]
+        length = self.layer_offsets[lp + 1] - beg
+        lo, hi = _segment_bounds(self.records['index'][beg], length, start_indexs, max_number)
+        counts = hi - lo
+        offsets = np.zeros(len(counts) + 1, dtype='i8')
+        np.cumsum(counts, out=offsets[1:])
+        positions = np.repeat(beg + lo - offsets[:-1], counts) + np.arange(offsets[-1])
+        return offsets, positions
+
+def _segment_bounds(beg_index, length, start_index, max_number):
+    """relative [lo, hi) of segments of layers, see get_layer_segment, works on arrays"""
+    rel = np.asarray(start_index) - beg_index
+    forward = np.asarray(max_number) > 0
+    lo = np.clip(np.where(forward, rel, rel + max_number + 1), 0, length)
+    hi = np.clip(np.where(forward, rel + max_number, rel + 1), 0, length)
+    return lo, np.maximum(lo, hi)
+
 def cmp_layer(layer1, layer2):
-    l1_info = dict([(i, c) for (i, c) in layer1])
-    l2_info = dict([(i, c) for (i, c) in layer2])
-    common_indexs = set(l1_info.keys()) & set(l2_info.keys())
-    if len(common_indexs) == 0:
+    """compare centers of the 2 layers at their first common index, 0 if no common index"""
+    if len(layer1) == 0 or len(layer2) == 0:
         return 0
-    else:
-        sample_index = common_indexs.pop()
-        l1_cell = l1_info[sample_index]
-        l2_cell = l2_info[sample_index]
-        return cmp(l1_cell.center, l2_cell.center)
+    sample_index = max(layer1.beg_index, layer2.beg_index)
+    if sample_index > min(layer1.end_index, layer2.end_index):
+        return 0
+    return cmp(layer1[sample_index].center, layer2[sample_index].center)
 
 def get_layer_segment(layer, start_cell, max_number):
-    start_index = start_cell.index
-    last_index = start_index + max_number
-    if last_index < layer.beg_index - 1:
-        last_index = layer.beg_index -1
-    step = int(np.sign(max_number))
-    res = layer[start_index:last_index:step]
-    if step == -1:
-        res.reverse()
-    return res
+    """cells of layer (LayerInfo or LayerView) from start_cell on, max_number cells upwards in index if max_number > 0,
+    downwards if max_number < 0, returned in ascending index order.
+    """
+    lo, hi = _segment_bounds(layer.beg_index, len(layer), start_cell.index, max_number)
+    return layer.cells[lo:hi]
 
 def intersect_width(lower1, upper1, lower2, upper2):
-    if lower1 > upper2 or upper1 < lower2:
-        res = 0
-    else:
-        u = min(upper1, upper2)
-        l = max(lower1, lower2)
-        res = u - l
+    """width of the overlap of [lower1, upper1] and [lower2, upper2], 0 if not overlapped, works on arrays"""
+    res = np.maximum(np.minimum(upper1, upper2) - np.maximum(lower1, lower2), 0)
+    return res[()] if isinstance(res, np.ndarray) and res.ndim == 0 else res
+
+def save_layers(fname, layers):
+    """save seq of LayerInfo (or a LayerStore) in binary format, see CellFile. attr of layers are not saved."""
+    if isinstance(layers, LayerStore):
+        layers.save(fname)
+        return
+    layers = list(layers)
+    _write_cell_groups(fname, [layer.cells for layer in layers], 'layers',
+            keys=[-1 if layer.ID is None else layer.ID for layer in layers])
+
+def load_layers(fname):
+    """load list of LayerInfo saved by save_layers"""
+    res = []
+    with CellFile(fname) as cf:
+        for ID, cells in zip(cf.keys, cf):
+            layer = LayerInfo()
+            layer.ID = None if ID == -1 else int(ID)
+            layer.cells = cells
+            res.append(layer)
     return res
 
 class LayerMarker(object):
@@ -234,15 +613,26 @@ class LayerMarker(object):
         pass
 
 def save_layermarkers(fname, layermarkers):
-    with open(fname, 'w') as outf:
-        for m in sorted(layermarkers):
-            if m is None:
-                outf.write('Marker()')
-            else:
-                outf.write(repr(m))
-            outf.write('\n')
+    """save layermarkers in binary format, None markers are dropped"""
+    markers = sorted([m for m in layermarkers if m is not None])
+    arr = np.array([(m.ID, m.layerID1, m.layerID2, m.x, m.y, m.marker) for m in markers], dtype=marker_dtype)
+    f = Dataset(fname, 'w', format='NETCDF4')
+    try:
+        f.setncattr('content', 'markers')
+        _write_columns(f, 'marker', arr)
+    finally:
+        f.close()
 
 def load_layermarkers(fname):
+    """load set of LayerMarker, in text format or written by save_layermarkers"""
+    if _is_netcdf(fname):
+        f = Dataset(fname)
+        f.set_auto_mask(False)
+        try:
+            arr = _read_columns(f, marker_dtype)
+        finally:
+            f.close()
+        return set([LayerMarker(ID, ID1, ID2, x, y, marker) for ID, ID1, ID2, x, y, marker in arr.tolist()])
     res = set()
     with open(fname) as f:
         for line in f:
@@ -252,7 +642,28 @@ def load_layermarkers(fname):
             res.add(LayerMarker.parse(l))
     return res
 
-def markers2cells(guide_lc):
+def _layer_records(layer, beg_i, end_i):
+    if isinstance(layer, LayerView):
+        return layer.between(beg_i, end_i)
+    return cells2array(layer[beg_i:end_i])
+
+def _fill_records(x1, x2, y1, y2):
+    """records of unhealthy cells (ID -1) interpolated from (x1, y1) to (x2, y2), x2 excluded"""
+    res = np.zeros(max(x2 - x1, 0), dtype=cell_dtype)
+    res['ID'] = -1
+    res['index'] = np.arange(x1, x2)
+    res['center'] = np.round(np.interp(res['index'], [x1, x2], [y1, y2]))
+    res['lower'] = res['center']
+    res['upper'] = res['center']
+    res['sign'] = -1
+    res['fulllife'] = 10
+    return res
+
+def markers2cells(guide_lc, as_array=False):
+    """cells along the layers guided by markers of guide_lc, gaps between '{' and '}' are interpolated.
+    guide_lc.layers can be a dict of LayerInfo or a LayerStore.
+    as_array: if True, returns structured array of cell_dtype instead of list of LayerCell.
+    """
     markers = sorted(guide_lc.layermarkers)
     # add a leading '@' if not present.
     if len(markers) > 0 and markers[0].marker == '{' and markers[0].layerID1 != -1:
@@ -263,7 +674,7 @@ def markers2cells(guide_lc):
                 x=beg_cell.index, y=beg_cell.center, marker='@')
         markers.insert(0, new_marker)
     state = 'OFF'
-    res_cells = []
+    sections = []
     for i in range(len(markers)):
         m1 = markers[i]
         layerID = markers[i].layerID1
@@ -288,30 +699,20 @@ def markers2cells(guide_lc):
                     end_i = m2.x + 1
                 else:
                     end_i = m2.x
-            sec_cells = guide_lc.layers[layerID][beg_i:end_i]
+            sections.append(_layer_records(guide_lc.layers[layerID], beg_i, end_i))
         elif markers[i].marker == '{':
             m1 = markers[i]
             m2 = markers[i+1]
             assert m2.marker == '}'
-            # interp
-            fill_xs = range(m1.x, m2.x)
-            fill_centers = np.round(np.interp(fill_xs, [m1.x, m2.x], [m1.y, m2.y])).astype('i')
-            sec_cells = [LayerCell(ID=-1, center=c, lower=c, upper=c,
-                sign=-1, life=0, fulllife=10, healthy=False,
-                peak=None, index=idx) for idx, c in zip(fill_xs, fill_centers) ]
-            if m2.layerID1 == '-1':
+            sections.append(_fill_records(m1.x, m2.x, m1.y, m2.y))
+            if m2.layerID1 == -1:
                 state = 'OFF'
             else:
                 state = 'ON' 
-        res_cells.extend(sec_cells)
-    widths = [c.upper - c.lower for c in res_cells if c.ID != -1]
-    mean_half_width = np.ma.masked_invalid(widths).mean() / 2.0
-    if mean_half_width is np.ma.masked:
-        mean_half_width = 0.0
-    mean_half_width = np.round(mean_half_width).astype('i')
-    for c in res_cells:
-        if c.ID == -1:
-            c.lower -= mean_half_width
-            c.upper += mean_half_width
-    return res_cells
-
+    res = np.concatenate(sections) if sections else np.zeros(0, dtype=cell_dtype)
+    filled = res['ID'] == -1
+    widths = res['upper'][~filled] - res['lower'][~filled]
+    mean_half_width = np.round(widths.mean() / 2.0).astype('i') if len(widths) > 0 else 0
+    res['lower'][filled] -= mean_half_width
+    res['upper'][filled] += mean_half_width
+    return res if as_array else array2cells(res)
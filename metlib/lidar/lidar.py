@@ -8,11 +8,14 @@
 import os, sys
 from datetime import datetime, timedelta
 from copy import copy, deepcopy
+from multiprocessing import Pool
+from multiprocessing.sharedctypes import RawArray
 import numpy as np
-from netCDF4 import Dataset, date2num, num2date
+from netCDF4 import Dataset
 from metlib.datetime.datetime_bin import datetime_bin
 
-__all__ = ['LidarDataset']
+__all__ = ['LidarDataset', 'LazyNcVar', 'bin_reduce', 'concatenate_files',
+        'parse_std_datetime', 'format_std_datetime']
 _std_datetime_fmt = "%Y-%m-%d %H:%M:%S"
 _std_datetime_units = "seconds since 1970-01-01 00:00:00"
 _NO_DESC_STR = "No description available"
@@ -41,13 +44,390 @@ _important_vars = set([
     'datetime','distance',
     ])
 
+def _acc_dtype(dtype):
+    """dtype used for accumulating sums of dtype"""
+    if dtype.kind in ('b', 'i'):
+        return np.dtype('i8')
+    elif dtype.kind == 'u':
+        return np.dtype('u8')
+    return dtype
+
+def _segment_reduce(ufunc, x, begs, counts, dtype=None):
+    """ufunc.reduceat(x, begs, axis=0), for consecutive non-empty segments of length counts.
+    Short segments are reduced one position at a time across all segments,
+    since reduceat has a per segment and per column overhead.
+    """
+    max_count = counts.max()
+    if max_count > len(begs):
+        return ufunc.reduceat(x, begs, axis=0, dtype=dtype)
+    res = x[begs].astype(dtype if dtype is not None else x.dtype)
+    for j in range(1, max_count):
+        sel = np.where(counts > j)[0]
+        if len(sel) == len(begs):
+            ufunc(res, x[begs + j], out=res)
+        else:
+            res[sel] = ufunc(res[sel], x[begs[sel] + j])
+    return res
+
+def bin_reduce(arr, bin_begs, bin_ends, aver_method):
+    """Reduce arr in TIME dimension (axis 0) bin by bin.
+    arr: array in shape of (TIME, ...).
+    bin_begs, bin_ends: arrays of int, records of bin i are arr[bin_begs[i]:bin_ends[i]].
+        Bins should be consecutive, i.e. bin_begs[i+1] == bin_ends[i].
+    aver_method: 'sum', 'mean', 'first', 'sqr_mean_sqrt', 'min', 'max', 'positive_min', 'positive_max'.
+
+    Returns array in shape of (len(bin_begs), ...), with empty bins filled with nan (float) or 0 (others).
+    Invalid values (nan, inf) are ignored, except that inf is kept by 'sum' as np.nansum. For min/max, bins with no valid value use the first record.
+    All bins are reduced in one pass per variable instead of one call per bin.
+    """
+    bin_begs = np.asarray(bin_begs, dtype='i8')
+    bin_ends = np.asarray(bin_ends, dtype='i8')
+    new_shape = (len(bin_begs),) + arr.shape[1:]
+    res = np.zeros(new_shape, dtype=arr.dtype)
+    if arr.dtype.char in ('f', 'd', 'g'):
+        res[:] = np.nan
+    counts = bin_ends - bin_begs
+    full = np.where(counts > 0)[0]
+    if len(full) == 0:
+        return res
+    lo, hi = bin_begs[full[0]], bin_ends[full[-1]]
+    seled = np.asarray(arr[lo:hi])
+    idx = bin_begs[full] - lo
+    counts = counts[full]
+
+    if aver_method == 'first':
+        res[full] = seled[idx]
+        return res
+
+    is_float = seled.dtype.kind in ('f', 'c')
+    if aver_method in ('positive_min', 'positive_max'):
+        valid = seled >= 0 if aver_method == 'positive_min' else seled <= 0
+    elif is_float and aver_method == 'sum':
+        # # as np.nansum, inf is kept
+        valid = ~np.isnan(seled)
+    elif is_float:
+        valid = np.isfinite(seled)
+    else:
+        valid = None
+
+    if aver_method in ('sum', 'mean', 'sqr_mean_sqrt'):
+        x = seled ** 2 if aver_method == 'sqr_mean_sqrt' else seled
+        if valid is not None:
+            x = np.where(valid, x, 0)
+        total = _segment_reduce(np.add, x, idx, counts, dtype=_acc_dtype(x.dtype))
+        if aver_method == 'sum':
+            res[full] = total
+            return res
+        if valid is None:
+            n = counts.reshape((-1,) + (1,) * (seled.ndim - 1))
+        else:
+            n = _segment_reduce(np.add, valid, idx, counts, dtype='i8')
+        with np.errstate(invalid='ignore', divide='ignore'):
+            aver = total / n.astype('f8')
+        if aver_method == 'sqr_mean_sqrt':
+            aver = np.sqrt(aver)
+        res[full] = aver
+        return res
+
+    if aver_method in ('min', 'positive_min'):
+        ufunc = np.minimum
+        fill = np.inf if is_float else np.iinfo(seled.dtype).max
+    elif aver_method in ('max', 'positive_max'):
+        ufunc = np.maximum
+        fill = -np.inf if is_float else np.iinfo(seled.dtype).min
+    else:
+        raise ValueError("Unknown aver_method: %s" % aver_method)
+    if valid is None:
+        res[full] = _segment_reduce(ufunc, seled, idx, counts)
+        return res
+    extreme = _segment_reduce(ufunc, np.where(valid, seled, fill), idx, counts)
+    has_valid = _segment_reduce(np.logical_or, valid, idx, counts)
+    res[full] = np.where(has_valid, extreme, seled[idx])
+    return res
+
+def _as_nc_index(idx):
+    """convert a sorted index array into a slice when possible, for reading netCDF hyperslabs"""
+    if len(idx) == 1:
+        return slice(idx[0], idx[0] + 1)
+    steps = np.diff(idx)
+    if len(idx) > 0 and steps[0] > 0 and np.all(steps == steps[0]):
+        return slice(idx[0], idx[-1] + 1, steps[0])
+    return idx
+
+def _lazy_op(name):
+    def op(self, *args):
+        args = [np.asarray(a) if isinstance(a, LazyNcVar) else a for a in args]
+        return getattr(np.asarray(self), name)(*args)
+    op.__name__ = name
+    return op
+
+class LazyNcVar(object):
+    """Read-only proxy of a netCDF variable (possibly split into several files along TIME).
+    Slicing with slices or index arrays returns a new proxy, nothing is read until
+    the proxy is converted into an array (np.asarray(v), v.read(), or integer indexing).
+    Only the selected hyperslab is read from disk.
+    """
+    __array_priority__ = 10.0
+
+    def __init__(self, fname, vname, shape, dtype):
+        self.parts = [(fname, vname, shape[0])]
+        self.sels = [np.arange(n) for n in shape]
+        self.dtype = np.dtype(dtype)
+
+    @property
+    def shape(self):
+        return tuple([len(sel) for sel in self.sels])
+
+    @property
+    def ndim(self):
+        return len(self.sels)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    def __len__(self):
+        return len(self.sels[0])
+
+    def __repr__(self):
+        return "LazyNcVar<%s, %s, %s>" % (self.parts[0][1], self.shape, self.dtype)
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        ell = [i for i, k in enumerate(key) if k is Ellipsis]
+        if len(ell) == 1:
+            i = ell[0]
+            n_real = len([k for k in key if k is not None and k is not Ellipsis])
+            key = key[:i] + (slice(None),) * (self.ndim - n_real) + key[i+1:]
+        n_arrays = len([k for k in key if isinstance(k, (list, np.ndarray))])
+        if len(ell) > 1 or len(key) > self.ndim or n_arrays > 1 or np.newaxis in [k for k in key if not isinstance(k, (list, np.ndarray))]:
+            return np.asarray(self)[key]
+        new = copy(self)
+        new.sels = list(self.sels)
+        int_axes = []
+        for axis, k in enumerate(key):
+            if isinstance(k, (int, long, np.integer)):
+                k = np.array([k])
+                int_axes.append(axis)
+            elif isinstance(k, (list, np.ndarray)):
+                k = np.asarray(k)
+                if k.dtype.kind != 'b':
+                    k = k.astype('i8')
+            elif not isinstance(k, slice):
+                return np.asarray(self)[key]
+            new.sels[axis] = self.sels[axis][k]
+        if int_axes:
+            return new.read()[tuple([0 if axis in int_axes else slice(None) for axis in range(new.ndim)])]
+        return new
+
+    def __setitem__(self, key, value):
+        raise TypeError("LazyNcVar is read-only, load it into memory first, e.g. LidarDataset.load() or LidarDataset.load_var(vname)")
+
+    def __array__(self, dtype=None):
+        arr = self.read()
+        if dtype is not None:
+            arr = arr.astype(dtype)
+        return arr
+
+    def read(self):
+        """read the selected hyperslab into memory"""
+        if 0 in self.shape:
+            return np.zeros(self.shape, dtype=self.dtype)
+        tsel = self.sels[0]
+        other = tuple([_as_nc_index(sel) for sel in self.sels[1:]])
+        uniq, inv = np.unique(tsel, return_inverse=True)
+        pieces = []
+        beg = 0
+        for fname, vname, n in self.parts:
+            w = uniq[(uniq >= beg) & (uniq < beg + n)] - beg
+            beg += n
+            if len(w) == 0:
+                continue
+            f = Dataset(fname)
+            pieces.append(f.variables[vname][(_as_nc_index(w),) + other])
+            f.close()
+        arr = pieces[0] if len(pieces) == 1 else np.concatenate(pieces)
+        if len(uniq) != len(tsel) or np.any(uniq != tsel):
+            arr = arr[inv]
+        return arr
+
+    @classmethod
+    def concatenate(cls, lazy_vars):
+        """concatenate LazyNcVars along TIME without reading them.
+        Returns None if they have different selections in other dimensions.
+        """
+        first = lazy_vars[0]
+        for v in lazy_vars[1:]:
+            if v.ndim != first.ndim or any(len(a) != len(b) or np.any(a != b) for a, b in zip(v.sels[1:], first.sels[1:])):
+                return None
+        new = copy(first)
+        new.parts = []
+        tsels = []
+        for v in lazy_vars:
+            offset = sum([n for fname, vname, n in new.parts])
+            tsels.append(v.sels[0] + offset)
+            new.parts.extend(v.parts)
+        new.sels = [np.concatenate(tsels)] + list(first.sels[1:])
+        return new
+
+for _name in ('__add__', '__radd__', '__sub__', '__rsub__', '__mul__', '__rmul__',
+        '__div__', '__rdiv__', '__truediv__', '__rtruediv__', '__pow__', '__rpow__',
+        '__neg__', '__abs__', '__lt__', '__le__', '__gt__', '__ge__', '__eq__', '__ne__'):
+    setattr(LazyNcVar, _name, _lazy_op(_name))
+
+# # byte positions of separators in _std_datetime_fmt strings, all other bytes are digits
+_std_datetime_seps = {4:'-', 7:'-', 10:' ', 13:':', 16:':'}
+_std_datetime_len = 19
+
+def parse_std_datetime(strs):
+    """parse an array of strings in _std_datetime_fmt ("%Y-%m-%d %H:%M:%S") into datetime64[s] array.
+    The whole byte array is checked at once, and parsed by numpy.
+    Falls back to datetime.strptime when some string does not match the format exactly.
+    """
+    arr = np.asarray(strs)
+    if arr.dtype.kind in ('O', 'U'):
+        arr = arr.astype('S')
+    if arr.dtype.kind == 'S' and arr.dtype.itemsize == _std_datetime_len and arr.ndim == 1:
+        b = arr.view('u1').reshape(-1, _std_datetime_len)
+        is_sep = np.zeros(_std_datetime_len, dtype=bool)
+        seps = np.zeros(_std_datetime_len, dtype='u1')
+        for i, c in _std_datetime_seps.items():
+            is_sep[i] = True
+            seps[i] = ord(c)
+        ok = np.all(b[:, is_sep] == seps[is_sep]) and \
+                np.all((b[:, ~is_sep] >= ord('0')) & (b[:, ~is_sep] <= ord('9')))
+        if ok:
+            try:
+                return arr.astype('M8[s]')
+            except ValueError:
+                pass
+    return np.array([datetime.strptime(datestr, _std_datetime_fmt) for datestr in strs], dtype='M8[s]')
+
+def format_std_datetime(dts):
+    """format datetime64 (or datetime objects) array into object array of strings in _std_datetime_fmt,
+    in one pass.
+    """
+    dts = np.asarray(dts).astype('M8[s]')
+    strs = np.datetime_as_string(dts, unit='s').astype('S%d' % _std_datetime_len)
+    strs.view('u1').reshape(-1, _std_datetime_len)[:, 10] = ord(' ')
+    return strs.astype(object)
+
+def _decode_datetime(v_arr):
+    """convert datetime var read from file into datetime64[s] array,
+    or datetime64[us] array for float seconds, which keeps fractional seconds as num2date did"""
+    datetime_type = type(v_arr[0])
+    if datetime_type in (np.string_ , str, unicode):
+        return parse_std_datetime(v_arr)
+    else:
+        # # _std_datetime_units is seconds since epoch
+        v_arr = np.asarray(v_arr)
+        if v_arr.dtype.kind == 'f':
+            return np.round(v_arr.astype('f8') * 1e6).astype('i8').astype('M8[us]')
+        return v_arr.astype('i8').astype('M8[s]')
+
+def _scan_files(fnames, **kwargs):
+    """read headers of lidar files.
+    Returns a list of (fname, number of records, {vname: dtype}).
+    Files which cannot be opened or contain no data are left out.
+    """
+    headers = []
+    for fn in fnames:
+        try:
+            f = Dataset(fn, **kwargs)
+        except (RuntimeError, IOError):
+            continue
+        if 'TIME' in f.dimensions and len(f.dimensions['TIME']) > 0:
+            dtypes = dict([(str(v), f.variables[v].dtype) for v in f.variables])
+            headers.append((fn, len(f.dimensions['TIME']), dtypes))
+        f.close()
+    return headers
+
+def _shared_empty(shape, dtype):
+    """like np.empty, but in shared memory, which forked worker processes can write into"""
+    dtype = np.dtype(dtype)
+    count = int(np.prod(shape))
+    raw = RawArray('b', max(count * dtype.itemsize, 1))
+    return np.frombuffer(raw, dtype=dtype, count=count).reshape(shape)
+
+# # (bufs, Dataset kwargs) of _fill_one_file, set before forking workers
+_fill_state = None
+
+def _fill_one_file(job):
+    """read TIME vars of file fname into bufs[vname][offset:offset+n] .
+    Returns False if the file fails to be read or lacks some var.
+    """
+    fname, offset, n = job
+    bufs, kwargs = _fill_state
+    try:
+        f = Dataset(fname, **kwargs)
+        try:
+            for vname, buf in bufs.items():
+                v_arr = f.variables[vname][:]
+                if vname == 'datetime':
+                    v_arr = _decode_datetime(v_arr)
+                buf[offset:offset+n] = v_arr
+        finally:
+            f.close()
+    except (RuntimeError, IOError, KeyError):
+        return False
+    return True
+
+def concatenate_files(fnames, out_fname, **kwargs):
+    """concatenate lidar files in TIME dimension into out_fname, one file at a time,
+    so that only one input file is held in memory.
+    fnames: a seq of filenames or a str of filenames seperated with comma.
+    out_fname: the output netCDF4 file, with an unlimited TIME dimension.
+    Files which cannot be opened or contain no data are skipped.
+    The result can be loaded with LidarDataset(out_fname), or LidarDataset(out_fname, lazy=True).
+    Returns number of records written.
+    """
+    if isinstance(fnames, (str, unicode)):
+        fnames = fnames.split(',')
+    headers = _scan_files(fnames, **kwargs)
+    if len(headers) == 0:
+        raise RuntimeError("No data in %s" % fnames)
+    if os.path.exists(out_fname):
+        if os.path.islink(out_fname):
+            os.unlink(out_fname)
+        else:
+            os.remove(out_fname)
+    outf = Dataset(out_fname, 'w', format='NETCDF4')
+    offset = 0
+    for fn, n, dtypes in headers:
+        f = Dataset(fn, **kwargs)
+        if offset == 0:
+            for dname, dim in f.dimensions.items():
+                outf.createDimension(str(dname), None if dname == 'TIME' else len(dim))
+            for a in f.ncattrs():
+                outf.setncattr(str(a), f.getncattr(a))
+            for v, ncv in f.variables.items():
+                t = ncv.dtype if isinstance(ncv.dtype, np.dtype) else str
+                outv = outf.createVariable(str(v), t, ncv.dimensions)
+                for a in ncv.ncattrs():
+                    if a != '_FillValue':
+                        outv.setncattr(str(a), ncv.getncattr(a))
+                if 'TIME' not in ncv.dimensions:
+                    outv[:] = ncv[:]
+        for v, ncv in f.variables.items():
+            if 'TIME' in ncv.dimensions:
+                outf.variables[v][offset:offset+n] = ncv[:]
+        f.close()
+        offset += n
+    outf.setncattr('number_records', offset)
+    outf.close()
+    return offset
+
 class LidarDataset(object):
     """Representing Lidar's Dataset"""
-    def __init__(self, fnames, bin_num=None, **kwargs):
+    def __init__(self, fnames, bin_num=None, lazy=False, workers=1, **kwargs):
         """doc
         kwargs:
             fnames: a seq of filenames or a single filename or a str of filenames seperated with comma.
             bin_num: clipping in BIN dimesion when loading files.
+            lazy: if True, TIME dimensioned vars (except datetime) are LazyNcVar proxies,
+                which read only the needed part from files after trimming/slicing. Call .load() to read them all.
+            workers: number of processes for reading files, see append_files.
         """
         self.init_clean()
         if isinstance(fnames, np.string_):
@@ -55,15 +435,15 @@ class LidarDataset(object):
         if isinstance(fnames, (str, unicode)):
             fnames = fnames.split(',')
         try:
-            self.read_one_file(fnames[0], **kwargs)
-        except RuntimeError:
+            self.read_one_file(fnames[0], lazy=lazy, **kwargs)
+        except (RuntimeError, IOError):
             if len(fnames) == 1:
                 raise
             else:
-                self.__init__(fnames[1:], bin_num=bin_num, **kwargs)
+                self.__init__(fnames[1:], bin_num=bin_num, lazy=lazy, workers=workers, **kwargs)
                 return
         if len(fnames) > 1:
-            self.append_files(fnames[1:], **kwargs)
+            self.append_files(fnames[1:], lazy=lazy, workers=workers, **kwargs)
 
         if bin_num is not None:
             self.resize_bin(0,bin_num)
@@ -78,8 +458,14 @@ class LidarDataset(object):
         for vname in self.vars:
             dims = self.var_dims[vname]
             if 'TIME' in dims:
+                to_stack = [self[vname]] + [d[vname] for d in datasets]
+                if all(isinstance(v, LazyNcVar) for v in to_stack):
+                    stacked = LazyNcVar.concatenate(to_stack)
+                    if stacked is not None:
+                        self.vars[vname] = stacked
+                        continue
                 stack_func = np.hstack if len(dims) == 1 else np.vstack
-                self.vars[vname] = stack_func(tuple([self[vname]] + [d[vname] for d in datasets]))
+                self.vars[vname] = stack_func(tuple(to_stack))
         self.recheck_time()
         del datasets
 
@@ -90,9 +476,12 @@ class LidarDataset(object):
         self.attrs = {}
         self.var_dims = {}
         self.var_aver_methods = {}
+        self._datetimes_cache = None
 
-    def read_one_file(self, fname, **kwargs):
-        """read one file for initing self"""
+    def read_one_file(self, fname, lazy=False, **kwargs):
+        """read one file for initing self.
+        lazy: if True, use LazyNcVar for TIME dimensioned numeric vars except datetime.
+        """
         self.init_clean()
         f = Dataset(fname, **kwargs)
         for d in f.dimensions:
@@ -102,14 +491,13 @@ class LidarDataset(object):
         for v in f.variables:
             strv = str(v)
             ncv = f.variables[v]
-            v_arr = ncv[:]
+            if lazy and 'TIME' in ncv.dimensions and v != 'datetime' and isinstance(ncv.dtype, np.dtype):
+                v_arr = LazyNcVar(fname, v, ncv.shape, ncv.dtype)
+            else:
+                v_arr = ncv[:]
             # datetime handling
             if v == 'datetime':
-                datetime_type = type(v_arr[0])
-                if datetime_type in (np.string_ , str, unicode):
-                    v_arr = np.array([datetime.strptime(datestr, _std_datetime_fmt) for datestr in v_arr])
-                else:
-                    v_arr = num2date(v_arr, units=_std_datetime_units)
+                v_arr = _decode_datetime(v_arr)
             self.vars[strv] = v_arr
             self.var_dims[strv] = tuple([str(dimname) for dimname in ncv.dimensions])
             # aver_method
@@ -124,22 +512,81 @@ class LidarDataset(object):
         self.recheck_time()
         f.close()
     
-    def append_files(self, fnames):
+    def append_files(self, fnames, lazy=False, workers=1, **kwargs):
         """append one or more files to the dataset
-        fnames: a seq of filenames or a single filename or a str of filenames seperated with comma."""
+        fnames: a seq of filenames or a single filename or a str of filenames seperated with comma.
+        lazy: see LidarDataset.__init__ .
+        workers: if > 1, files are decoded by a pool of this many processes, which write into
+            shared memory arrays (needs fork, i.e. posix). Files failing to be read are skipped.
+        """
         if isinstance(fnames, np.string_):
             fnames = str(fnames)
         if isinstance(fnames, (str, unicode)):
             fnames = fnames.split(',')
-        tmpd = []
-        for fn in fnames:
-            try:
-                d = LidarDataset(fn)
-                tmpd.append(d)
-            except RuntimeError:
-                pass
-        self.append_datasets(tmpd)
-        del tmpd
+        if lazy:
+            tmpd = []
+            for fn in fnames:
+                try:
+                    d = LidarDataset(fn, lazy=lazy, **kwargs)
+                    tmpd.append(d)
+                except (RuntimeError, IOError):
+                    # # same files as _scan_files skips
+                    pass
+            self.append_datasets(tmpd)
+            del tmpd
+            return
+
+        # # scan headers first, then fill each file's records into preallocated arrays
+        headers = _scan_files(fnames, **kwargs)
+        if len(headers) == 0:
+            return
+        offset = len(self)
+        total = offset + sum([n for fn, n, dtypes in headers])
+        time_vnames = [vname for vname in self.vars if 'TIME' in self.var_dims[vname]]
+        if any([np.asarray(self.vars[vname]).dtype.kind == 'O' for vname in time_vnames if vname != 'datetime']):
+            # # object arrays cannot be put into shared memory
+            workers = 1
+        bufs = dict()
+        for vname in time_vnames:
+            old = np.asarray(self.vars[vname])
+            dtype = old.dtype
+            for fn, n, dtypes in headers:
+                if vname != 'datetime' and isinstance(dtypes.get(vname), np.dtype):
+                    dtype = np.promote_types(dtype, dtypes[vname])
+            if workers > 1:
+                bufs[vname] = _shared_empty((total,) + old.shape[1:], dtype)
+            else:
+                bufs[vname] = np.empty((total,) + old.shape[1:], dtype=dtype)
+            bufs[vname][:len(old)] = old
+        jobs = []
+        for fn, n, dtypes in headers:
+            jobs.append((fn, offset, n))
+            offset += n
+
+        global _fill_state
+        _fill_state = (bufs, kwargs)
+        try:
+            if workers > 1:
+                pool = Pool(min(workers, len(jobs)))
+                try:
+                    oks = pool.map(_fill_one_file, jobs)
+                finally:
+                    pool.close()
+                    pool.join()
+            else:
+                oks = map(_fill_one_file, jobs)
+        finally:
+            _fill_state = None
+        # # vars are only replaced after every file is filled, so a failure leaves the dataset as it was
+        self.vars.update(bufs)
+        if not all(oks):
+            keep = np.ones(total, dtype=bool)
+            for (fn, beg, n), ok in zip(jobs, oks):
+                if not ok:
+                    keep[beg:beg+n] = False
+            self.keep_indice(np.where(keep)[0])
+        else:
+            self.recheck_time()
 
     def save(self, fname, use_datetime_str=True):
         """Save into a netCDF4 file"""
@@ -149,6 +596,13 @@ class LidarDataset(object):
             else:
                 os.remove(fname)
         f = Dataset(fname, 'w', format='NETCDF4')
+        self.nc_create_vars(f, use_datetime_str)
+        self.nc_write_vars(f, 0, use_datetime_str)
+        self.nc_write_attrs(f)
+        f.close()
+
+    def nc_create_vars(self, f, use_datetime_str=True):
+        """create dims and vars of self in an opened netCDF4 Dataset f, with an unlimited TIME dim"""
         for dname, length in self.dims.items():
             if dname == 'TIME':
                 f.createDimension(dname)
@@ -162,19 +616,37 @@ class LidarDataset(object):
             if vname == 'datetime':
                 if use_datetime_str:
                     f.createVariable(vname, str, dimnames)
-                    for i, dt in enumerate(self.vars[vname]):
-                        f.variables[vname][i] = self.vars[vname][i].strftime(_std_datetime_fmt)
                 else:
                     f.createVariable(vname, 'i4', dimnames)
                     f.variables[vname].setncattr('units', _std_datetime_units)
-                    f.variables[vname][:] = date2num(self.vars[vname], _std_datetime_units)
             else:
                 if t.startswith('O'):
                     t = str
                 f.createVariable(vname, t, dimnames)
-                f.variables[vname][:] = self.vars[vname]
             f.variables[vname].setncattr('aver_method', self.var_aver_methods[vname])
-    
+
+    def nc_write_vars(self, f, offset=0, use_datetime_str=True, time_only=False):
+        """write vars of self into f (see nc_create_vars), TIME dimensioned vars at records [offset:offset+len(self)].
+        time_only: if True, skip vars without TIME dim.
+        """
+        for vname in self.vars:
+            has_time = 'TIME' in self.var_dims[vname]
+            if time_only and not has_time:
+                continue
+            if has_time:
+                where = slice(offset, offset + len(self))
+            else:
+                where = slice(None)
+            if vname == 'datetime':
+                if use_datetime_str:
+                    f.variables[str(vname)][where] = format_std_datetime(self.vars[vname])
+                else:
+                    f.variables[str(vname)][where] = self.vars[vname].astype('M8[s]').astype('i8')
+            else:
+                f.variables[str(vname)][where] = np.asarray(self.vars[vname])
+
+    def nc_write_attrs(self, f):
+        """write attrs of self into f"""
         for attr in self.attrs:
             if type(attr) is unicode:
                 attr = str(attr)
@@ -183,7 +655,6 @@ class LidarDataset(object):
             else:
                 a = str(self.attrs[attr]) if type(self.attrs[attr]) is unicode else self.attrs[attr]
                 f.setncattr(attr, a)
-        f.close()
 
     def time_average(self, tdelta, starttime=None, endtime=None):
         """Averaging in TIME dimesion.
@@ -196,74 +667,27 @@ class LidarDataset(object):
         if type(tdelta) is not timedelta:
             tdelta = timedelta(minutes=tdelta)
         dts = self.vars['datetime']
-        tbins, info = datetime_bin(dts, tdelta, starttime=starttime, endtime=endtime, return_bin_info=True)
-        new_time_steps = len(tbins)
+        tbins = datetime_bin(dts, tdelta, starttime=starttime, endtime=endtime)
+        # # records of bin i are dts[indices[offsets[i]:offsets[i+1]]], consecutive if dts is sorted
+        is_sorted = np.all(dts[1:] >= dts[:-1])
+        bin_begs = tbins.offsets[:-1]
+        bin_ends = tbins.offsets[1:]
+        # # bin starts in full precision, in the unit of dts if nothing is lost
+        labels = tbins.edges[:-1]
+        if np.all(labels.astype(dts.dtype) == labels):
+            labels = labels.astype(dts.dtype)
         tmp = dict()
 
         for vname in self.vars:
             dimnames = self.var_dims[vname]
-            if 'TIME' in dimnames:
-                new_shape = list(self.vars[vname].shape)
-                new_shape[0] = new_time_steps
-                tmp[vname] = np.zeros(tuple(new_shape), dtype=self.vars[vname].dtype)
-
-        for i, w in enumerate(tbins):
-            for vname in self.vars:
-                dimnames = self.var_dims[vname]
-                aver_method = self.var_aver_methods[vname]
-                t = self.vars[vname].dtype.char
-                if 'TIME' not in dimnames:
-                    continue
-                if vname == 'datetime':
-                    # # using each tbins' starttime as datetime
-                    tmp[vname][i] = info[i][0]
-                elif len(w[0]) == 0:
-                    # # filling with nan or 0
-                    if t not in ('f', 'd', 'g'):
-                        tmp[vname][i] = 0
-                    else:
-                        tmp[vname][i] = np.nan
-                else:
-                    if aver_method == 'sum':
-                        tmp[vname][i] = np.nansum(self.vars[vname][w], axis=0)
-                    elif aver_method == 'mean':
-                        tmp[vname][i] = np.ma.masked_invalid(self.vars[vname][w]).mean(axis=0)
-                    elif aver_method == 'first':
-                        tmp[vname][i] = self.vars[vname][w][0]
-                    elif aver_method == 'sqr_mean_sqrt':
-                        # # for std_dev 
-                        tmp[vname][i] = np.sqrt(np.mean(np.ma.masked_invalid(self.vars[vname][w]) ** 2, axis=0))
-                    elif aver_method == 'min':
-                        seled = self.vars[vname][w]
-                        maskarr = np.ma.masked_invalid(seled)
-                        if maskarr.count() == 0:
-                            the_min = seled[0]
-                        else:
-                            the_min = maskarr.min(axis=0)
-                    elif aver_method == 'max':
-                        seled = self.vars[vname][w]
-                        maskarr = np.ma.masked_invalid(seled)
-                        if maskarr.count() == 0:
-                            the_max = seled[0]
-                        else:
-                            the_max = maskarr.max(axis=0)
-                        tmp[vname][i] = the_max
-                    elif aver_method == 'positive_min':
-                        seled = self.vars[vname][w]
-                        maskarr = np.ma.masked_where(-(seled >= 0), seled)
-                        if maskarr.count() == 0:
-                            the_min = seled[0]
-                        else:
-                            the_min = maskarr.min(axis=0)
-                        tmp[vname][i] = the_min
-                    elif aver_method == 'positive_max':
-                        seled = self.vars[vname][w]
-                        maskarr = np.ma.masked_where(-(seled <= 0), seled)
-                        if maskarr.count() == 0:
-                            the_max = seled[0]
-                        else:
-                            the_max = maskarr.max(axis=0)
-                        tmp[vname][i] = the_max
+            if 'TIME' not in dimnames:
+                continue
+            if vname == 'datetime':
+                # # using each tbins' starttime as datetime
+                tmp[vname] = labels
+            else:
+                arr = self.vars[vname] if is_sorted else np.asarray(self.vars[vname])[tbins.indices]
+                tmp[vname] = bin_reduce(arr, bin_begs, bin_ends, self.var_aver_methods[vname])
 
         self.vars.update(tmp)
         self.recheck_time()
@@ -274,15 +698,31 @@ class LidarDataset(object):
 
     def recheck_time(self):
         """recheck stuffs about time dimension"""
-        n_tbins = len(self.vars['datetime'])
-        self.attrs['start_datetime'] = self.vars['datetime'][0]
+        dts = self.vars['datetime']
+        if dts.dtype.kind != 'M':
+            dts = self.vars['datetime'] = np.asarray(dts).astype('M8[s]')
+        n_tbins = len(dts)
+        self.attrs['start_datetime'] = dts[0].item()
         if len(self) >= 2:
-            self.attrs['end_datetime'] = self.vars['datetime'][-1] + (self.vars['datetime'][-1] - self.vars['datetime'][-2])
+            self.attrs['end_datetime'] = (dts[-1] + (dts[-1] - dts[-2])).item()
         elif self.vars['trigger_frequency'][-1] != 0:
-            self.attrs['end_datetime'] = self.vars['datetime'][-1] + timedelta(seconds = int(self.vars['shots_sum'][-1] / self.vars['trigger_frequency'][-1]))
+            self.attrs['end_datetime'] = dts[-1].item() + timedelta(seconds = int(self.vars['shots_sum'][-1] / self.vars['trigger_frequency'][-1]))
         self.attrs['number_records'] = n_tbins
         self.dims['TIME'] = n_tbins
 
+    @property
+    def datetimes(self):
+        """datetime objects of records, derived from self.vars['datetime'] (datetime64) and cached.
+        The array is read-only, set d['datetime'] = ... to change datetimes.
+        """
+        dts = self.vars['datetime']
+        cache = getattr(self, '_datetimes_cache', None)
+        if cache is None or cache[0] is not dts:
+            objs = dts.astype(object)
+            objs.setflags(write=False)
+            self._datetimes_cache = (dts, objs)
+        return self._datetimes_cache[1]
+
     def get_timedeltas(self, return_seconds=True):
         """Get array of each record's time span. 
         if return_seconds is True: return in seconds
@@ -300,12 +740,12 @@ class LidarDataset(object):
     def get_end_datetimes(self):
         """Get array of each record's end datetimes"""
         tds = self.get_timedeltas(return_seconds=False)
-        return self.vars['datetime'] + tds
+        return self.datetimes + tds
 
     def get_mid_datetimes(self):
         """Get array of each record's mid datetimes"""
         tds = self.get_timedeltas(return_seconds=False)
-        return self.vars['datetime'] + tds / 2
+        return self.datetimes + tds / 2
 
     def keep_indice(self, indice):
         """Keep only data in the indice (Time dimension)"""
@@ -335,7 +775,7 @@ class LidarDataset(object):
         to_drop = []
         dts = self.vars['datetime']
         for (beg, end) in periods:
-            w = np.where((dts>=beg) & (dts<end))
+            w = np.where((dts>=np.datetime64(beg)) & (dts<np.datetime64(end)))
             to_drop.extend(list(w[0]))
         self.drop_indice(to_drop)
 
@@ -347,7 +787,7 @@ class LidarDataset(object):
         to_keep = []
         dts = self.vars['datetime']
         for (beg, end) in periods:
-            w = np.where((dts>=beg) & (dts<end))
+            w = np.where((dts>=np.datetime64(beg)) & (dts<np.datetime64(end)))
             to_keep.extend(list(w[0]))
         self.keep_indice(to_keep)
 
@@ -361,13 +801,7 @@ class LidarDataset(object):
         return corresponding data if key is str
         """
         if isinstance(key, slice):
-            new_data = self.copy()
-            for vname in self.vars:
-                if 'TIME' not in self.var_dims[vname]:
-                    continue
-                new_data.vars[vname] = new_data.vars[vname][key]
-            new_data.recheck_time()
-            return new_data
+            return self._time_slice(key)
         elif isinstance(key, (int, long, np.integer)):
             new_data = self.copy()
             for vname in self.vars:
@@ -377,7 +811,9 @@ class LidarDataset(object):
             new_data.recheck_time()
             return new_data
         elif isinstance(key, (str, unicode)):
-            if key in self.vars:
+            if key == 'datetime':
+                return self.datetimes
+            elif key in self.vars:
                 return self.vars[key]
             elif key in self.attrs:
                 return self.attrs[key]
@@ -385,7 +821,11 @@ class LidarDataset(object):
     def __setitem__(self, key, value):
         if isinstance(key, (str, unicode)):
             if key in self.vars:
+                if isinstance(self.vars[key], LazyNcVar):
+                    self.vars[key] = self.vars[key].read()
                 self.vars[key][:] = value
+                if key == 'datetime':
+                    self._datetimes_cache = None
             else:
                 self.attrs[key] = value
         else:
@@ -445,8 +885,38 @@ class LidarDataset(object):
 
             self.dims['BIN'] = self.attrs['number_bins']
     
+    def load(self):
+        """read all LazyNcVar vars into memory"""
+        for vname in self.vars:
+            if isinstance(self.vars[vname], LazyNcVar):
+                self.vars[vname] = self.vars[vname].read()
+
+    def load_var(self, vname):
+        """read var vname into memory if it is a LazyNcVar, returns the in-memory array, which can be modified in place"""
+        if isinstance(self.vars[vname], LazyNcVar):
+            self.vars[vname] = self.vars[vname].read()
+        return self.vars[vname]
+
     def copy(self):
         return deepcopy(self)
+
+    def _time_slice(self, key):
+        """a new LidarDataset of the TIME slice key, copying only the sliced part of TIME vars
+        (LazyNcVar vars stay lazy), and deep copying everything else, which is small"""
+        new_data = copy(self)
+        for name, value in self.__dict__.items():
+            if name not in ('vars', '_datetimes_cache'):
+                setattr(new_data, name, deepcopy(value))
+        new_data.vars = {}
+        new_data._datetimes_cache = None
+        for vname, v in self.vars.items():
+            if 'TIME' in self.var_dims[vname]:
+                v = v[key]
+                new_data.vars[vname] = v if isinstance(v, LazyNcVar) else np.array(v)
+            else:
+                new_data.vars[vname] = deepcopy(v)
+        new_data.recheck_time()
+        return new_data
    
     def __add__(self, other):
         res = self.copy()
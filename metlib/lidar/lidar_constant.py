@@ -4,7 +4,7 @@
 
 import os, sys
 #import re
-#from datetime import datetime, timedelta
+from datetime import timedelta
 import numpy as np
 import numpy.ma as ma
 #import scipy as sp
@@ -13,18 +13,13 @@ import numpy.ma as ma
 #from matplotlib import mlab
 from .constant import lidar_sm
 from .lidarutil import height_to_index
+from metlib.datetime.dt64 import to_datetime64, to_timedelta64
 
-__all__ = ['get_lidar_constant']
+__all__ = ['get_lidar_constant', 'get_lidar_constant_batch']
 
-def get_lidar_constant(data, aod, height_range, betam, elev_angle, aod_ratio=1.0, return_detail=False):
-    """get lidar constant with aod observation.
-    data: a LidarDataset object.
-    aod: AOD value
-    height_range: 2-tuple, low and high height range of lidar data for calculating lidar constant.
-    betam: betam array.
-    elev_angle: lidar elevation angle in degrees.
-    aod_ratio: the ratio of (aod below that height) / (total aod).
-    return_detail: return LC(avered), LC(detail), heights
+def _lidar_constant_pool(data, height_range, betam, elev_angle, aod_trans=1.0):
+    """lidar constants of every bin in height_range, with aerosol transmittance aod_trans.
+    Returns C_pool, low_index, high_index, sin_elev
     """
     start_i = data['first_data_bin']
     dz = data['bin_size'] / 1000.0   # convert to km
@@ -37,17 +32,126 @@ def get_lidar_constant(data, aod, height_range, betam, elev_angle, aod_ratio=1.0
 #    print expIntSigmam
     low_index, high_index = height_to_index(height_range, data, elev_angle)
 #    print low_index, high_index
-    CE_pool = d[:,:,low_index:high_index] / (betam[low_index:high_index] * expIntSigmam[low_index:high_index] * np.exp(-2.0 * aod * aod_ratio / sin_elev) ) 
+    CE_pool = d[:,:,low_index:high_index] / (betam[low_index:high_index] * expIntSigmam[low_index:high_index] * aod_trans) 
 #    print CE_pool
     C_pool = CE_pool / data['energy'][..., np.newaxis]
+    return C_pool, low_index, high_index, sin_elev
+
+def get_lidar_constant(data, aod, height_range, betam, elev_angle, aod_ratio=1.0, return_detail=False):
+    """get lidar constant with aod observation.
+    data: a LidarDataset object.
+    aod: AOD value
+    height_range: 2-tuple, low and high height range of lidar data for calculating lidar constant.
+    betam: betam array.
+    elev_angle: lidar elevation angle in degrees.
+    aod_ratio: the ratio of (aod below that height) / (total aod).
+    return_detail: return LC(avered), LC(detail), heights
+    """
+    sin_elev = np.sin(np.deg2rad(elev_angle))
+    C_pool, low_index, high_index, sin_elev = _lidar_constant_pool(data, height_range, betam, elev_angle,
+            np.exp(-2.0 * aod * aod_ratio / sin_elev))
     lc_lines = np.array(ma.masked_invalid(C_pool).mean(axis=-1)) 
 #    print lc_lines
     if return_detail:
         return lc_lines, C_pool, data['distance'][low_index:high_index] * sin_elev
     else:
         return lc_lines
-    
 
+def _match_windows(rec_times, obs_times, window):
+    """match records to observations within +-window/2 (both datetime64 in the same unit).
+    Returns obs_index, rec_index of all matches, grouped by observation.
+    """
+    order = None
+    if np.any(rec_times[1:] < rec_times[:-1]):
+        order = np.argsort(rec_times, kind='mergesort')
+        rec_times = rec_times[order]
+    half = window / 2
+    begs = np.searchsorted(rec_times, obs_times - half, side='left')
+    ends = np.searchsorted(rec_times, obs_times + half, side='right')
+    counts = ends - begs
+    offsets = np.zeros(len(counts) + 1, dtype='i8')
+    np.cumsum(counts, out=offsets[1:])
+    obs_index = np.repeat(np.arange(len(counts)), counts)
+    rec_index = np.repeat(begs - offsets[:-1], counts) + np.arange(offsets[-1])
+    if order is not None:
+        rec_index = order[rec_index]
+    return obs_index, rec_index
+
+def _robust_aggregate(pool, method='median', trim=0.1):
+    """aggregate pool[obs, match, ...] (nan padded) along the match axis.
+    method: 'median' (spread is 1.4826 * median absolute deviation) or 'trimmed_mean' (spread is std of the kept values).
+    trim: proportion cut off at each end for 'trimmed_mean'.
+    Returns values, spreads, numbers of valid values
+    """
+    counts = np.sum(np.isfinite(pool), axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if method == 'median':
+            # nanmedian warns on all nan slices
+            filled = np.sort(pool, axis=1)
+            center = _sorted_nanmedian(filled, counts)
+            spread = 1.4826 * _sorted_nanmedian(np.sort(np.abs(pool - center[:, np.newaxis]), axis=1), counts)
+        elif method == 'trimmed_mean':
+            filled = np.sort(pool, axis=1)
+            cut = np.floor(counts * trim).astype('i8')
+            pos = np.arange(pool.shape[1]).reshape((1, -1) + (1,) * (pool.ndim - 2))
+            kept = (pos >= cut[:, np.newaxis]) & (pos < (counts - cut)[:, np.newaxis])
+            n = np.sum(kept, axis=1)
+            center = np.sum(np.where(kept, filled, 0.0), axis=1) / n
+            spread = np.sqrt(np.sum(np.where(kept, filled - center[:, np.newaxis], 0.0) ** 2, axis=1) / n)
+        else:
+            raise ValueError("Unknown method: %s" % method)
+    return center, spread, counts
+
+def _sorted_nanmedian(sorted_pool, counts):
+    """median along axis 1 of an ascending sorted, nan (at the end) padded array, with counts valid values"""
+    lo = np.maximum((counts - 1) // 2, 0)[:, np.newaxis]
+    hi = np.maximum(counts // 2, 0)[:, np.newaxis]
+    res = (np.take_along_axis(sorted_pool, lo, axis=1)[:, 0] + np.take_along_axis(sorted_pool, hi, axis=1)[:, 0]) / 2.0
+    res[counts == 0] = np.nan
+    return res
+
+def get_lidar_constant_batch(data, aod_times, aods, height_range, betam, elev_angle, aod_ratio=1.0, window=timedelta(minutes=30), method='median', trim=0.1, return_detail=False):
+    """get lidar constants with a series of aod observations, each one matched to lidar records within the time window around it.
+    data: a LidarDataset object.
+    aod_times: seq of datetime (or anything to_datetime64 accepts) of aod observations.
+    aods: seq of AOD values.
+    height_range: 2-tuple, low and high height range of lidar data for calculating lidar constant.
+    betam: betam array.
+    elev_angle: lidar elevation angle in degrees.
+    aod_ratio: the ratio of (aod below that height) / (total aod), scalar or one for each observation.
+    window: timedelta (or seconds), records within +-window/2 of an observation are matched to it.
+    method: 'median' or 'trimmed_mean', to aggregate the lidar constants of all records matched to an observation.
+    trim: proportion cut off at each end for 'trimmed_mean'.
+    return_detail: also return obs_index, rec_index and lidar constants of all the matches.
+    Returns LC[obs, CHANNEL], LC_spread[obs, CHANNEL], numbers of valid matches [obs, CHANNEL], 
+        nan for observations without matched records.
+        LC_spread is 1.4826 * MAD for 'median', std of the kept values for 'trimmed_mean'.
+    """
+    if not isinstance(window, (timedelta, np.timedelta64)):
+        window = timedelta(seconds=window)
+    rec_times = to_datetime64(data['datetime'], 'us')
+    obs_times = to_datetime64(np.asarray(aod_times).ravel(), 'us')
+    aods = np.asarray(aods, dtype='f8').ravel()
+    aod_ratio = np.broadcast_to(np.asarray(aod_ratio, dtype='f8'), aods.shape)
+    obs_index, rec_index = _match_windows(rec_times, obs_times, to_timedelta64(window, 'us'))
+
+    # lidar constants without aerosol, then all the matches at once
+    C_pool, low_index, high_index, sin_elev = _lidar_constant_pool(data, height_range, betam, elev_angle)
+    lc_lines = np.array(ma.masked_invalid(C_pool).mean(axis=-1).filled(np.nan))
+    lc_all = lc_lines[rec_index] * np.exp(2.0 * aods[obs_index] * aod_ratio[obs_index] / sin_elev)[:, np.newaxis]
+
+    # pad into [obs, match, CHANNEL]
+    counts = np.bincount(obs_index, minlength=len(aods))
+    max_count = counts.max() if len(counts) > 0 else 0
+    pos = np.arange(len(obs_index)) - np.repeat(np.cumsum(counts) - counts, counts)
+    pool = np.empty((len(aods), max(max_count, 1)) + lc_all.shape[1:], dtype='f8')
+    pool.fill(np.nan)
+    pool[obs_index, pos] = lc_all
+    lc, spread, numbers = _robust_aggregate(pool, method, trim)
+    if return_detail:
+        return lc, spread, numbers, obs_index, rec_index, lc_all
+    else:
+        return lc, spread, numbers
 
 if __name__ == '__main__':
     pass
@@ -10,24 +10,40 @@ import numpy as np
 #import matplotlib.pyplot as plt
 #from mpl_toolkits.basemap import Basemap
 #from matplotlib import mlab
-from .fernald import fernald
+from .fernald import fernald, fernald_batch
 from .lidarutil import height_to_index
 
 __all__ = ['get_lidar_ratio']
 
-def get_lidar_ratio(data, aod, lidar_constant, betam, fill_index=0, fill_aver_num=1, C_contains_E=False, search_range=(10.0, 100.0, 0.1), maxheight=5000.0, elev_angle=90.0):
+def _profile_aod(aod):
+    """aod in shape broadcastable to (TIME, CHANNEL)"""
+    aod = np.asarray(aod, dtype='f8')
+    if aod.ndim == 1:
+        aod = aod[:, np.newaxis]
+    elif aod.ndim == 3:
+        aod = aod[..., 0]
+    return aod
+
+def get_lidar_ratio(data, aod, lidar_constant, betam, fill_index=0, fill_aver_num=1, C_contains_E=False, search_range=(10.0, 100.0, 0.1), maxheight=5000.0, elev_angle=90.0, method='grid', bisect_coarse_num=16, max_bytes=256*1024**2):
     """calculate lidar_ratio from aod data.
     data: a LidarDataset object
-    aod: aod
+    aod: aod, scalar or in shape of (TIME,) or (TIME, CHANNEL)
     lidar_constant: lidar constant
     betam: molecular backscatter
     fill_index, fill_aver_num: data below this index will be filled with fill_aver_num samples above
     search_range: tuple of start, end, step of lidar ratio value to be tried.
+    method: 
+        'grid': try every lidar ratio in search_range, with batched fernald retrievals. 
+            A lidar ratio is dropped if any profile retrieved with it is out of (0, 0.8] at 200-300m.
+        'bisect': a coarse scan of bisect_coarse_num lidar ratios in search_range brackets each profile's 
+            first crossing of aod, which is then bisected until the interval is shorter than step.
+            It needs about bisect_coarse_num + log2((end - start) / step / bisect_coarse_num) retrievals,
+            assuming that retrieved aod increases with lidar ratio within the bracket.
+            Each profile is checked at 200-300m on its own.
+    max_bytes: memory budget of a chunk of batched retrievals.
 
     returns an array of lidar_ratios with the same length of data.
     """
-    test_sa = np.arange(*search_range)
-    test_res = np.zeros( (data.dims['TIME'], data.dims['CHANNEL'], len(test_sa) ) )
     try:
         start_i = data['first_data_bin']
     except:
@@ -36,33 +52,60 @@ def get_lidar_ratio(data, aod, lidar_constant, betam, fill_index=0, fill_aver_nu
     max_index = np.min((max_index, data.dims['BIN'] - 1))
     check_i_beg = height_to_index(200.0, data, elev_angle)
     check_i_end = height_to_index(300.0, data, elev_angle)
-#    print check_i_beg, check_i_end
-    #print max_index
     dz = data['bin_size'] * 1E-3 * np.sin(np.deg2rad(elev_angle))
-    for i in range(len(test_sa)):
-        sigma_a = fernald(data, lidar_constant, test_sa[i], betam, fill_index, fill_aver_num, C_contains_E=C_contains_E, apply_on_data=False)
-        to_check = sigma_a[..., check_i_beg:check_i_end]
-        if np.any(to_check <= 0.0) or np.any(to_check > 0.8):
-#            print "Warning: %s " % ( test_sa[i] ,)
-            test_res[:,:,i] = np.nan
-        else:
-            test_res[:,:,i] = np.nansum(sigma_a[..., start_i:max_index+1], axis=-1) * dz
-    res_dist = np.abs(test_res - aod)
-#    print res_dist.shape
-    min_indice = np.nanargmin(res_dist, axis=-1)
-#    print min_indice
-#    plt.plot(res_dist[0,0,:])
-#    plt.show()
-    final_res = np.zeros( (data.dims['TIME'], data.dims['CHANNEL']) )
-    final_res[:] = np.nan
-
-    for t in range(data.dims['TIME']):
-        for c in range(data.dims['CHANNEL']):
-            the_i = min_indice[t,c]
-            if np.isnan(the_i) or res_dist[t, c, the_i] >= 0.2:
-                final_res[t,c] = np.nan
-            else:
-                final_res[t, c] = test_sa[ min_indice[t, c] ]
+    aod = _profile_aod(aod)
+    if method == 'grid':
+        test_sa = np.arange(*search_range)
+        def reduce_func(sigma_a, ratios):
+            to_check = sigma_a[..., check_i_beg:check_i_end].reshape(len(ratios), -1)
+            bad = np.any(to_check <= 0.0, axis=-1) | np.any(to_check > 0.8, axis=-1)
+            test_res = np.nansum(sigma_a[..., start_i:max_index+1], axis=-1) * dz
+            test_res[bad] = np.nan
+            return test_res
+        test_res = fernald_batch(data, lidar_constant, test_sa, betam, fill_index, fill_aver_num, C_contains_E=C_contains_E, reduce_func=reduce_func, max_bytes=max_bytes)
+        test_res = np.rollaxis(test_res, 0, test_res.ndim)
+        res_dist = np.abs(test_res - aod[..., np.newaxis])
+        res_dist[np.isnan(res_dist)] = np.inf
+        min_indice = np.argmin(res_dist, axis=-1)
+        min_dist = np.min(res_dist, axis=-1)
+        final_res = np.where(min_dist < 0.2, test_sa[min_indice], np.nan)
+    elif method == 'bisect':
+        start, end, step = search_range
+        def profile_dist(sigma_a):
+            to_check = sigma_a[..., check_i_beg:check_i_end]
+            bad = np.any(to_check <= 0.0, axis=-1) | np.any(to_check > 0.8, axis=-1)
+            dist = np.nansum(sigma_a[..., start_i:max_index+1], axis=-1) * dz - aod
+            # # rejected retrievals are treated as too big
+            dist[bad] = np.inf
+            return dist
+        # # coarse scan, to bracket the first crossing of aod before the singularity of retrieval
+        coarse_sa = np.linspace(start, end, bisect_coarse_num)
+        coarse_dist = fernald_batch(data, lidar_constant, coarse_sa, betam, fill_index, fill_aver_num, C_contains_E=C_contains_E, 
+                reduce_func=lambda sigma_a, ratios: profile_dist(sigma_a), max_bytes=max_bytes)
+        crossing = (coarse_dist[:-1] < 0.0) & (coarse_dist[1:] >= 0.0)
+        bracketed = np.any(crossing, axis=0)
+        k = np.where(bracketed, np.argmax(crossing, axis=0), np.argmin(np.abs(coarse_dist), axis=0))
+        k1 = np.where(bracketed, k + 1, k)
+        lo, hi = coarse_sa[k], coarse_sa[k1]
+        profile_i = tuple(np.indices(k.shape))
+        dist_lo = coarse_dist[(k,) + profile_i]
+        dist_hi = coarse_dist[(k1,) + profile_i]
+        workspace = dict()
+        sigma_a = None
+        while np.any(bracketed) and np.max((hi - lo)[bracketed]) > step:
+            mid = np.where(bracketed, (lo + hi) / 2.0, lo)
+            sigma_a = fernald(data, lidar_constant, mid[..., np.newaxis], betam, fill_index, fill_aver_num, C_contains_E=C_contains_E, apply_on_data=False, out=sigma_a, workspace=workspace)
+            dist_mid = profile_dist(sigma_a)
+            to_lo = bracketed & (dist_mid < 0.0)
+            to_hi = bracketed & ~to_lo
+            lo[to_lo] = mid[to_lo]
+            dist_lo[to_lo] = dist_mid[to_lo]
+            hi[to_hi] = mid[to_hi]
+            dist_hi[to_hi] = dist_mid[to_hi]
+        final_res = np.where(np.abs(dist_lo) <= np.abs(dist_hi), lo, hi)
+        final_res[np.minimum(np.abs(dist_lo), np.abs(dist_hi)) >= 0.2] = np.nan
+    else:
+        raise ValueError("Unknown method: %s" % method)
     return final_res
 
 if __name__ == '__main__':
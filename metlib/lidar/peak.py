@@ -13,9 +13,9 @@ import numpy as np
 #from mpl_toolkits.basemap import Basemap
 #from matplotlib import mlab
 #from netCDF4 import Dataset
-from metlib.misc.maths import int_sign, second_derivate
+from metlib.data.maths import int_sign, second_derivate
 
-__all__ = ['Peak', 'locate_peak', 'measure_peak', 'peak_pattern', 'parse_peak', 'parse_peaks', 'load_peaks_list', 'save_peaks_list' , 'peak2str']
+__all__ = ['Peak', 'PeakTable', 'peak_dtype', 'locate_peak', 'measure_peak', 'peak_pattern', 'parse_peak', 'parse_peaks', 'load_peaks_list', 'save_peaks_list' , 'peak2str']
 
 class Peak(object):
     def __init__(self, center, lower=None, upper=None, depth=0.0, volume=0.0):
@@ -29,6 +29,82 @@ class Peak(object):
     def __repr__(self):
         return "Peak<%d,%d,%d,%E,%E>" % (self.center, self.lower, self.upper, self.depth, self.volume)
 
+peak_dtype = np.dtype([('center', 'i4'), ('lower', 'i4'), ('upper', 'i4'), ('depth', 'f8'), ('volume', 'f8')])
+
+class PeakTable(object):
+    """Columnar peaks of a 2D signal.
+    peaks: structured array of peak_dtype, peaks of all columns, column by column.
+    offsets: int array, peaks of column i are peaks[offsets[i]:offsets[i+1]].
+    Indexing/iterating gives lists of Peak objects of columns, which are only built then.
+    """
+    def __init__(self, peaks, offsets):
+        self.peaks = np.asarray(peaks, dtype=peak_dtype)
+        self.offsets = np.asarray(offsets, dtype='i8')
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def column(self, i):
+        """structured array of peaks in column i"""
+        return self.peaks[self.offsets[i]:self.offsets[i+1]]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError("column index out of range")
+        return [Peak(int(p['center']), int(p['lower']), int(p['upper']), p['depth'], p['volume']) for p in self.column(i)]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __repr__(self):
+        return "PeakTable<%d columns, %d peaks>" % (len(self), len(self.peaks))
+
+    @property
+    def counts(self):
+        """number of peaks in each column"""
+        return np.diff(self.offsets)
+
+    @property
+    def columns(self):
+        """column index of each peak"""
+        return np.repeat(np.arange(len(self)), self.counts)
+
+    def to_list(self):
+        """list of lists of Peak objects, as measure_peak returns"""
+        return list(self)
+
+    @classmethod
+    def from_list(cls, peaks_list):
+        """build from list of lists of Peak objects, None peaks are dropped"""
+        peaks_list = [[p for p in peaks if p is not None] for peaks in peaks_list]
+        counts = [len(peaks) for peaks in peaks_list]
+        offsets = np.zeros(len(peaks_list) + 1, dtype='i8')
+        np.cumsum(counts, out=offsets[1:])
+        peaks = np.array([(p.center, p.lower, p.upper, p.depth, p.volume) for peaks in peaks_list for p in peaks], dtype=peak_dtype)
+        return cls(peaks, offsets)
+
+    def save(self, fname):
+        """save into fname as a binary npz file"""
+        f = open(fname, 'wb')
+        try:
+            np.savez(f, peaks=self.peaks, offsets=self.offsets)
+        finally:
+            f.close()
+
+    @classmethod
+    def load(cls, fname):
+        """load from a file written by save"""
+        npz = np.load(fname)
+        try:
+            return cls(npz['peaks'], npz['offsets'])
+        finally:
+            npz.close()
+
 peak_pattern = r'Peak<([^<>\s]*)[,;\s]+([^<>\s]*)[,;\s]+([^<>\s]*)[,;\s]([^<>\s]*)[,;\s]+([^<>\s]*)>|Peak<>'
 peak_re = re.compile(peak_pattern)
 
@@ -68,15 +144,21 @@ def parse_peaks(s):
     return res
 
 def save_peaks_list(fname, peaks_list):
-    f = open(fname, 'w')
-    for peaks in peaks_list:
-        for p in peaks:
-            f.write(peak2str(p))
-            f.write(' ')
-        f.write('\n')
-    f.close()
+    """save peaks_list (list of lists of Peak, or a PeakTable) into fname in binary format, see PeakTable.save"""
+    if not isinstance(peaks_list, PeakTable):
+        peaks_list = PeakTable.from_list(peaks_list)
+    peaks_list.save(fname)
 
-def load_peaks_list(fname):
+def load_peaks_list(fname, columnar=False):
+    """load peaks list saved by save_peaks_list, old text files (lines of Peak<...>) are also accepted.
+    columnar: if True, returns a PeakTable, else list of lists of Peak.
+    """
+    f = open(fname, 'rb')
+    magic = f.read(2)
+    f.close()
+    if magic == 'PK':
+        table = PeakTable.load(fname)
+        return table if columnar else table.to_list()
     peaks_list = []
     f = open(fname)
     for line in f:
@@ -85,7 +167,7 @@ def load_peaks_list(fname):
         peaks = parse_peaks(line)
         peaks_list.append(peaks)
     f.close()
-    return peaks_list
+    return PeakTable.from_list(peaks_list) if columnar else peaks_list
 
 def locate_peak(sig):
     """
@@ -109,7 +191,7 @@ def locate_peak(sig):
     cr *= sigsign
     return cr
 
-def measure_peak(sig, use_inflection=True, return_allinfo=False):
+def measure_peak(sig, use_inflection=True, return_allinfo=False, columnar=False):
     """measure_peak measures peaks from 1D/2D signal (2D signal are regarded as columns of individual signal lines), with all the information for the Peak class, e.g., peak center position (indices), peak size (lower/upper position), peak depth and peak volume.
     
     Parameters
@@ -117,10 +199,11 @@ def measure_peak(sig, use_inflection=True, return_allinfo=False):
     sig:
     use_inflection: whether to use inflection points to split peaks.
     return_allinfo: whether to return raw peak array, crossing zero point array and inflection point array. 
+    columnar: whether to return a PeakTable (with one column for 1D signal) instead of Peak objects.
 
     Return
     ------
-    list/lists of Peak. And if return_allinfo is True, also returns 3 more arrays: raw peaks, crossing zero points and inflection points.
+    list/lists of Peak, or a PeakTable if columnar. And if return_allinfo is True, also returns 3 more arrays: raw peaks, crossing zero points and inflection points.
     
     For all the arrays:
         0: not anything.
@@ -160,41 +243,54 @@ def measure_peak(sig, use_inflection=True, return_allinfo=False):
     if len(np.shape(sig)) == 1:
         oned = True
         sig = sig[:, np.newaxis]
-   
-    peaks_list = []
-    for i in range(np.shape(sig)[1]):
-        pvs = np.where(np.abs(cr[:,i]) == 1)[0]
-        lims = np.where(np.abs(cr_combine[:,i]) >= 2)[0]
-        if len(pvs) == 0 :
-            peaks_list.append([])
+        cr2d = cr[:, np.newaxis]
+        cr_combine = cr_combine[:, np.newaxis]
+    else:
+        cr2d = cr
+    length, col_num = np.shape(sig)
+
+    # flat positions column by column, so that positions of one column are contiguous and sorted
+    pkeys = np.nonzero(np.abs(cr2d.T) == 1)
+    pcols, centers = pkeys
+    pflat = pcols * length + centers
+    lflat = np.flatnonzero(np.abs(cr_combine.T) >= 2)
+    # a sentinel limit after all columns, so that index lflat with searchsorted results directly
+    lflat = np.append(lflat, length * col_num)
+    lrows = lflat % length
+    # upper: the first limit after center in the column, or center itself
+    ui = np.searchsorted(lflat, pflat, side='right')
+    uppers = np.where(lflat[ui] < (pcols + 1) * length, lrows[ui], centers)
+    # lower: the last limit before center in the column, or 0
+    li = np.searchsorted(lflat, pflat, side='left') - 1
+    lowers = np.where((li >= 0) & (lflat[li] >= pcols * length), lrows[li], 0)
+
+    sigT = sig.T.astype('f8')
+    depths = sigT[pkeys]
+    # volume: sum of values with the sign of depth within [lower, upper], segment by segment with reduceat
+    # # (begin, end) pairs interleaved, the even results are the segment sums, a 0 is padded for ends at the last value
+    vol_beg = pcols * length + lowers
+    vol_end = pcols * length + uppers + 1
+    volumes = np.zeros(len(depths), dtype='f8')
+    signed = np.zeros(sigT.size + 1, dtype='f8')
+    for sign in (1, -1):
+        w = int_sign(depths) == sign
+        if not np.any(w):
             continue
-        if np.shape(lims)[0] == 0:
-            lower_pos = pvs
-            upper_pos = pvs
-        else:
-            lower_arr = (pvs > lims[:, np.newaxis])
-            upper_arr = (pvs < lims[:, np.newaxis])
-            lower_arr_r = np.flipud(lower_arr)
-            upper_pos_i = np.argmax(upper_arr, axis=0)
-            upper_pos = lims[(upper_pos_i, )]
-            w_upper_none = np.where(upper_arr[-1,:] == False)
-            upper_pos[w_upper_none] = pvs[w_upper_none]
-            lower_pos_r_i = np.argmax(lower_arr_r, axis=0)
-            lower_pos_i = len(lims) - 1 - lower_pos_r_i
-            lower_pos = lims[(lower_pos_i, )]
-            w_lower_none = np.where(lower_arr[0, :] == False)
-            lower_pos[w_lower_none] = 0
-
-        peaks = []
-        for center, lower, upper in zip(pvs, lower_pos, upper_pos):
-            depth = sig[center, i]
-            sig_range = sig[lower:upper+1, i]
-            sig_range[np.where(int_sign(sig_range) != int_sign(depth))] = 0.0
-            volume = np.sum(sig_range)
-            peaks.append(Peak(center=center, lower=lower, upper=upper, depth=depth, volume=volume))
-        peaks_list.append(peaks)
-    if oned:
-        peaks_list = peaks_list[0]
+        signed[:-1] = np.where(int_sign(sigT) == sign, sigT, 0.0).ravel()
+        volumes[w] = np.add.reduceat(signed, np.column_stack((vol_beg[w], vol_end[w])).ravel())[::2]
+
+    table = PeakTable(np.empty(len(centers), dtype=peak_dtype), np.searchsorted(pcols, np.arange(col_num + 1)))
+    table.peaks['center'] = centers
+    table.peaks['lower'] = lowers
+    table.peaks['upper'] = uppers
+    table.peaks['depth'] = depths
+    table.peaks['volume'] = volumes
+    if columnar:
+        peaks_list = table
+    else:
+        peaks_list = table.to_list()
+        if oned:
+            peaks_list = peaks_list[0]
     
     if return_allinfo:
         return peaks_list, cr, cr_crosszero, cr_inflection 
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+
+# pipeline.py
+"""Chunked lidar processing.
+A LidarPipeline is a declared chain of processing steps (the functions in process.py, fernald, filter_cloud,
+or any function taking a LidarDataset as the first argument), which can be run on a LidarDataset in memory,
+or streamed over TIME chunks from netCDF files into an output netCDF file, never holding the full data cube.
+e.g.:
+    pipe = LidarPipeline()
+    pipe.add('correct_background', sample_number=100)
+    pipe.add('correct_afterpulse', ap_data)
+    pipe.add('correct_distance')
+    pipe.add('correct_energy')
+    pipe.add('fernald', per_record(lidar_constants[..., np.newaxis]), 50.0, betam, fill_index=10)
+    pipe.run('2014-01-*.nc', 'retrieved.nc', time_chunk=1000)
+"""
+
+import os
+from glob import glob
+import numpy as np
+from netCDF4 import Dataset
+from .lidar import LidarDataset
+from .process import *
+from .fernald import fernald
+from .filter_cloud import filter_cloud
+
+__all__ = ['LidarPipeline', 'per_record']
+
+class per_record(object):
+    """Marks a step argument as per record (TIME as the first axis),
+    so that each chunk gets its own part of it.
+    """
+    def __init__(self, arr):
+        self.arr = np.asarray(arr)
+
+    def chunk(self, beg, end):
+        return self.arr[beg:end]
+
+def _fernald_step(data, *args, **kwargs):
+    """fernald, with the result applied on data"""
+    kwargs['apply_on_data'] = True
+    fernald(data, *args, **kwargs)
+
+def _filter_cloud_step(data, *args, **kwargs):
+    """filter_cloud, with the result applied on data, and cloud index kept in var 'cloud_index'"""
+    newdata, indexs = filter_cloud(data, *args, **kwargs)
+    data['data'] = newdata
+    data.vars['cloud_index'] = indexs
+    data.var_dims['cloud_index'] = ('TIME',)
+    data.var_aver_methods['cloud_index'] = 'first'
+    data.desc += ',cloud filtered'
+
+_step_funcs = {
+        'correct_background': correct_background,
+        'correct_afterpulse': correct_afterpulse,
+        'correct_overlap': correct_overlap,
+        'correct_distance': correct_distance,
+        'correct_energy': correct_energy,
+        'fill_lower_part': fill_lower_part,
+        'zero_blind_range': zero_blind_range,
+        'brutal_denoise': brutal_denoise,
+        'gentle_denoise': gentle_denoise,
+        'fernald': _fernald_step,
+        'filter_cloud': _filter_cloud_step,
+        }
+
+class LidarPipeline(object):
+    """A chain of lidar processing steps, each one is func(data, *args, **kwargs) working on data in place."""
+    def __init__(self, steps=()):
+        """steps: seq of (func, args, kwargs) or (func, args) or (func,) tuples, see add()."""
+        self.steps = []
+        self.names = []
+        for step in steps:
+            step = tuple(step)
+            func = step[0]
+            args = step[1] if len(step) > 1 else ()
+            kwargs = step[2] if len(step) > 2 else {}
+            self.add(func, *args, **kwargs)
+
+    def add(self, func, *args, **kwargs):
+        """add a step.
+        func: name of a step ('correct_background', 'correct_afterpulse', 'correct_overlap', 'correct_distance',
+            'correct_energy', 'fill_lower_part', 'zero_blind_range', 'brutal_denoise', 'gentle_denoise',
+            'fernald', 'filter_cloud'), or a function taking a LidarDataset as the first argument and working in place.
+            'fernald' and 'filter_cloud' put their results into data['data'].
+        args, kwargs: extra arguments of func. Wrap per record arguments with per_record().
+        Returns self, so that adds can be chained.
+        """
+        if isinstance(func, (str, unicode)):
+            if func not in _step_funcs:
+                raise ValueError("Unknown step: %s" % func)
+            name = func
+            func = _step_funcs[func]
+        else:
+            name = getattr(func, '__name__', repr(func))
+        self.steps.append((func, args, kwargs))
+        self.names.append(name)
+        return self
+
+    def __len__(self):
+        return len(self.steps)
+
+    def __repr__(self):
+        return "LidarPipeline<%s>" % ', '.join(self.names)
+
+    def process(self, data, beg=0, end=None):
+        """apply all the steps on data (a LidarDataset) in place.
+        beg, end: records of the whole dataset data is, used to cut per_record arguments.
+        """
+        if end is None:
+            end = beg + len(data)
+        for func, args, kwargs in self.steps:
+            args = [a.chunk(beg, end) if isinstance(a, per_record) else a for a in args]
+            kwargs = dict([(k, v.chunk(beg, end) if isinstance(v, per_record) else v) for k, v in kwargs.items()])
+            func(data, *args, **kwargs)
+        return data
+
+    __call__ = process
+
+    def iter_chunks(self, src, time_chunk=1024, **kwargs):
+        """process src in TIME chunks, yielding (beg, end, processed chunk LidarDataset).
+        src: a LidarDataset (lazy ones are read chunk by chunk), or filenames (a seq, a str seperated with comma, or a glob pattern).
+        kwargs: passed to LidarDataset when reading files.
+        """
+        if isinstance(src, LidarDataset):
+            dataset = src
+        else:
+            if isinstance(src, (str, unicode)) and ',' not in src and not os.path.exists(src):
+                src = sorted(glob(src))
+            dataset = LidarDataset(src, lazy=True, **kwargs)
+        total = len(dataset)
+        for beg in range(0, total, time_chunk):
+            end = min(beg + time_chunk, total)
+            chunk = dataset[beg:end]
+            chunk.load()
+            yield beg, end, self.process(chunk, beg, end)
+
+    def run(self, src, out_fname, time_chunk=1024, use_datetime_str=True, **kwargs):
+        """process src in TIME chunks, writing each processed chunk into out_fname (netCDF4) as it goes.
+        src, time_chunk, kwargs: see iter_chunks.
+        Returns number of records written.
+        """
+        if os.path.exists(out_fname):
+            if os.path.islink(out_fname):
+                os.unlink(out_fname)
+            else:
+                os.remove(out_fname)
+        f = None
+        first = last = None
+        written = 0
+        try:
+            for beg, end, chunk in self.iter_chunks(src, time_chunk, **kwargs):
+                if f is None:
+                    f = Dataset(out_fname, 'w', format='NETCDF4')
+                    chunk.nc_create_vars(f, use_datetime_str)
+                    chunk.nc_write_vars(f, 0, use_datetime_str)
+                    first = chunk
+                else:
+                    chunk.nc_write_vars(f, written, use_datetime_str, time_only=True)
+                written += len(chunk)
+                last = chunk
+            if f is not None:
+                first.attrs['end_datetime'] = last.attrs['end_datetime']
+                first.attrs['number_records'] = written
+                first.nc_write_attrs(f)
+        finally:
+            if f is not None:
+                f.close()
+        return written
+
+if __name__ == '__main__':
+    pass
@@ -10,7 +10,7 @@ import numpy as np
 #import matplotlib.pyplot as plt
 #from mpl_toolkits.basemap import Basemap
 #from matplotlib import mlab
-from lidar import LidarDataset
+from lidar import LidarDataset, LazyNcVar
 __all__ = ['correct_background', 'correct_afterpulse',
         'correct_overlap', 'correct_distance',
         'correct_energy',
@@ -24,14 +24,15 @@ def correct_background(data, sample_number=None):
     sample_number: use the last sample_number bins as background.
         if sample_number is None, use lidar data's prvided background.
     """
-    if sample_number is None:
-        bg = data['background']
-    elif sample_number == 0:
+    if sample_number == 0:
         return
+    d = data.load_var('data')
+    if sample_number is None:
+        bg = np.asarray(data['background'])
     else:
-        bg = data['data'][:,:,-sample_number:].mean(axis=-1)
+        bg = d[:,:,-sample_number:].mean(axis=-1)
     bg = bg[..., np.newaxis]
-    data['data'] -= bg
+    d -= bg
     data.desc += ',background corrected'
 
 def correct_afterpulse(data, ap_data, zero_check_max_index=30):
@@ -42,7 +43,7 @@ def correct_afterpulse(data, ap_data, zero_check_max_index=30):
     """
     min_len = np.min((data.dims['BIN'], ap_data.shape[-1]))
     zcmi = np.min((min_len, zero_check_max_index))
-    d = data['data']
+    d = data.load_var('data')
     d[...,:min_len] -= ap_data[..., :min_len] * data['energy'][..., np.newaxis]
     d[...,:zcmi][np.where(d[...,:zcmi] < 0.0)] = 0.0
     
@@ -54,21 +55,23 @@ def correct_overlap(data, ol_data):
     ol_data: overlap data (values > 1 in the near range). 
     """
     min_len = np.min((data.dims['BIN'], ol_data.shape[-1]))
-    data['data'][...,:min_len] *= ol_data[..., :min_len]
+    data.load_var('data')[...,:min_len] *= ol_data[..., :min_len]
     data.desc += ',overlap corrected'
 
 def correct_distance(data):
     """correct distance.
     data: a LidarDataset object.
     """
-    data['data'] *= (data['distance'] ** 2 * 1E-6)
+    d = data.load_var('data')
+    d *= (data['distance'] ** 2 * 1E-6)
     data.desc += ',distance corrected'
 
 def correct_energy(data):
     """correct energy.
     data: a LidarDataset object.
     """
-    data['data'] /= data['energy'][..., np.newaxis]
+    d = data.load_var('data')
+    d /= data['energy'][..., np.newaxis]
     data.var_aver_methods['data'] = 'mean'
     data.desc += ',energy corrected'
 
@@ -79,10 +82,13 @@ def fill_lower_part(data, index, aver_num=3):
     aver_num: use data[..., index:index+aver_num].mean as fill value.
     """
     if type(data) is LidarDataset:
-        d = data['data']
+        d = data.load_var('data')
     else:
         d = data
     to_fill = np.ma.masked_invalid(d[..., index:index+aver_num]).mean(axis=-1)[..., np.newaxis]
+    if not isinstance(d, np.ma.MaskedArray):
+        # # no valid value to average, nan instead of the masked mean's underlying 0.0
+        to_fill = np.ma.filled(to_fill, np.nan)
     d[..., :index] = to_fill
 
 
@@ -94,47 +100,86 @@ def zero_blind_range(data):
         start_i = data['first_data_bin']
     except:
         start_i = 0
-    data['data'][...,:start_i] = 0.0
+    data.load_var('data')[...,:start_i] = 0.0
 
-def brutal_denoise(data, gate, **kwargs):
+def _denoise_target(data, out):
+    """returns (array to read, array to write).
+    Lazy data of a LidarDataset is loaded first, so that it is written in place.
+    """
     if isinstance(data, LidarDataset):
-        data = data['data']
+        data = data.load_var('data')
+    elif isinstance(data, LazyNcVar) and out is None:
+        raise TypeError("cannot denoise a LazyNcVar in place, load it first or give out")
+    data = np.asarray(data)
+    if out is None:
+        out = data
+    elif out is not data:
+        out[...] = data
+    return data, out
+
+def _tail_mask(indice, bin_num):
+    """True for bins from indice on, indice of -1 selects nothing.
+    indice: array[TIME, CHANNEL] or array[TIME].
+    Returns bool array[TIME, CHANNEL, BIN] or array[TIME, BIN].
+    """
+    first = np.where(indice < 0, bin_num, indice)[..., np.newaxis]
+    return np.arange(bin_num) >= first
+
+def _tail_means(data, indice):
+    """means of valid values in data[..., i:] for each i in indice, using reversed cumulative sums and counts.
+    Returns means (nan where no valid value in the tail) and counts of valid values.
+    """
+    # bins before the smallest index are never needed
+    used = indice[indice >= 0]
+    lo = used.min() if used.size else data.shape[-1] - 1
+    data = data[..., lo:]
+    valid = np.isfinite(data)
+    sums = np.where(valid, data, 0.0).astype('f8')
+    counts = valid.astype('i4')
+    np.cumsum(sums[..., ::-1], axis=-1, out=sums[..., ::-1])
+    np.cumsum(counts[..., ::-1], axis=-1, out=counts[..., ::-1])
+    where = np.maximum(indice - lo, 0)[..., np.newaxis]
+    tail_sum = np.take_along_axis(sums, where, axis=-1)[..., 0]
+    tail_count = np.take_along_axis(counts, where, axis=-1)[..., 0]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = tail_sum / tail_count
+    return means, tail_count
+
+def brutal_denoise(data, gate, out=None, **kwargs):
+    """set the data from the first value below gate on (see find_first_index_below_gate) to gate.
+    data: a LidarDataset object, array[TIME, CHANNEL, BIN] or array[TIME, BIN], changed in place if out is None.
+    gate: the threshold, scalar or broadcastable to data.
+    out: array to hold the result.
+    kwargs: passed to find_first_index_below_gate.
+    Returns the denoised array.
+    """
+    data, out = _denoise_target(data, out)
     indice = find_first_index_below_gate(data, gate, **kwargs)
-    if len(np.shape(indice)) == 2:
-        for t in range(data.shape[0]):
-            for c in range(data.shape[1]):
-                i = indice[t,c]
-                if i != -1:
-                    data[t, c, i:] = gate
-    elif len(np.shape(indice)) == 1:
-        for t in range(data.shape[0]):
-            i = indice[t]
-            if i != -1:
-                data[t, i:] = gate
-
-def gentle_denoise(data, gate, gate2=None, **kwargs):
+    mask = _tail_mask(indice, data.shape[-1])
+    np.copyto(out, np.asarray(gate, dtype=out.dtype), where=mask)
+    return out
+
+def gentle_denoise(data, gate, gate2=None, out=None, **kwargs):
+    """set the data from the first value below gate on (see find_first_index_below_gate) to their mean,
+    means below gate2 are replaced with gate2.
+    data: a LidarDataset object, array[TIME, CHANNEL, BIN] or array[TIME, BIN], changed in place if out is None.
+    gate: the threshold.
+    gate2: the lower limit of means, default is gate.
+    out: array to hold the result.
+    kwargs: passed to find_first_index_below_gate.
+    Returns the denoised array.
+    """
     if gate2 is None:
         gate2 = gate
-    if isinstance(data, LidarDataset):
-        data = data['data']
+    data, out = _denoise_target(data, out)
     indice = find_first_index_below_gate(data, gate, **kwargs)
-    if len(np.shape(indice)) == 2:
-        for t in range(data.shape[0]):
-            for c in range(data.shape[1]):
-                i = indice[t,c]
-                if i != -1:
-                    aver = np.ma.masked_invalid(data[t, c, i:]).mean()
-                    if aver < gate2:
-                        aver = gate2
-                    data[t,c,i:] = aver
-    elif len(np.shape(indice)) == 1:
-        for t in range(data.shape[0]):
-            i = indice[t]
-            if i != -1:
-                aver = np.ma.masked_invalid(data[t, i:]).mean()
-                if aver < gate2:
-                    aver = gate2
-                data[t,i:] = aver
+    aver, count = _tail_means(data, indice)
+    aver = np.where(aver < gate2, gate2, aver)
+    # no valid value in the tail
+    aver[count == 0] = 0.0
+    mask = _tail_mask(indice, data.shape[-1])
+    np.copyto(out, aver.astype(out.dtype)[..., np.newaxis], where=mask)
+    return out
 
 def find_first_index_below_gate(data, gate, start_i=0):
     """find the index of first small value in lidar data.
@@ -145,7 +190,7 @@ def find_first_index_below_gate(data, gate, start_i=0):
     if isinstance(data, LidarDataset):
         data = data['data']
     # to treat nan as values below gate
-    cre = -(data >= gate)
+    cre = ~(data >= gate)
     cre[...,:start_i] = False
     res = cre.argmax(axis=-1)
     # for the case all cre value are false
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+
+# test_data_bin.py
+"""Tests of metlib.data.data_bin.
+Run with: python -m unittest discover -s metlib/test -p 'test_*.py'
+"""
+
+import unittest
+import numpy as np
+from metlib.data.data_bin import data_bin, data_2d_bin, bin_ids_2d, calc_bins, DataBins
+
+def _old_data_bin(data, binsize, start=None, end=None):
+    """the list based data_bin, as reference: (data list, where list, bin_info)"""
+    if start is None:
+        start = data[0]
+    if end is None:
+        end = data[-1] + binsize * 0.5
+    else:
+        end = end + binsize * 0.001
+    split_points = np.arange(start, end, binsize)
+    d_result = []
+    w_result = []
+    bin_info = []
+    for bi in range(len(split_points) - 1):
+        with np.errstate(invalid='ignore'):
+            w = np.where((data >= split_points[bi]) & (data < split_points[bi+1]))
+        w_result.append(w)
+        d_result.append(data[w])
+        bin_info.append((split_points[bi], split_points[bi+1]))
+    return d_result, w_result, bin_info
+
+class DataBinTest(unittest.TestCase):
+    def setUp(self):
+        self.rs = np.random.RandomState(0)
+
+    def assert_same_bins(self, data, binsize, start=None, end=None):
+        old_d, old_w, old_info = _old_data_bin(data, binsize, start, end)
+        bins, info = data_bin(data, binsize, start, end, return_bin_info=True)
+        wheres, winfo = data_bin(data, binsize, start, end, return_where=True, return_bin_info=True)
+        self.assertIsInstance(bins, DataBins)
+        self.assertEqual(len(bins), len(old_d))
+        self.assertEqual(len(wheres), len(old_w))
+        self.assertEqual(info, old_info)
+        self.assertEqual(winfo, old_info)
+        for a, b in zip(bins, old_d):
+            np.testing.assert_array_equal(a, b)
+        for a, b in zip(wheres, old_w):
+            self.assertEqual(len(a), 1)
+            np.testing.assert_array_equal(a[0], b[0])
+        return bins
+
+    def test_sorted(self):
+        data = np.sort(self.rs.rand(500))
+        self.assert_same_bins(data, 0.07)
+        self.assert_same_bins(data, 0.1, 0.0, 1.0)
+
+    def test_unsorted(self):
+        data = self.rs.rand(500) * 3.0
+        bins = self.assert_same_bins(data, 0.25, 0.5, 2.0)
+        # # values out of [0.5, 2.0) are in no bin
+        self.assertEqual(bins.count().sum(), np.sum((data >= bins.edges[0]) & (data < bins.edges[-1])))
+
+    def test_nan(self):
+        data = self.rs.rand(200)
+        data[::7] = np.nan
+        bins = self.assert_same_bins(data, 0.1, 0.0, 1.0)
+        self.assertEqual(bins.count().sum(), np.sum(np.isfinite(data)))
+        self.assertFalse(np.any(np.isnan(bins.mean())))
+
+    def test_empty(self):
+        bins = data_bin([], 1.0)
+        self.assertIsInstance(bins, DataBins)
+        self.assertEqual(len(bins), 0)
+        self.assertEqual(list(bins), [])
+        bins, info = data_bin([], 1.0, return_bin_info=True)
+        self.assertEqual(len(bins), 0)
+        self.assertEqual(info, [])
+        self.assertEqual(len(data_bin([], 1.0, return_where=True)), 0)
+        bins = data_bin(np.zeros(0), 1.0, 0.0, 3.0)
+        self.assertEqual(len(bins), 3)
+        np.testing.assert_array_equal(bins.count(), [0, 0, 0])
+        self.assertTrue(np.all(np.isnan(bins.mean())))
+
+    def test_indexing(self):
+        data = self.rs.rand(300)
+        old_d = _old_data_bin(data, 0.1, 0.0, 1.0)[0]
+        bins = data_bin(data, 0.1, 0.0, 1.0)
+        np.testing.assert_array_equal(bins[-1], old_d[-1])
+        np.testing.assert_array_equal(bins[-10], old_d[-10])
+        for a, b in zip(bins[1:3], old_d[1:3]):
+            np.testing.assert_array_equal(a, b)
+        np.testing.assert_array_equal(bins.view(2), old_d[2])
+        self.assertRaises(IndexError, bins.__getitem__, 10)
+        self.assertRaises(IndexError, bins.__getitem__, -11)
+
+    def test_calc_bins(self):
+        data = self.rs.rand(400)
+        old_d = _old_data_bin(data, 0.1, 0.0, 1.0)[0]
+        bins = data_bin(data, 0.1, 0.0, 1.0)
+        expected = np.array([np.std(b) for b in old_d])
+        np.testing.assert_allclose(calc_bins(bins, np.std), expected)
+        np.testing.assert_allclose(calc_bins(bins, 'std'), expected)
+        np.testing.assert_allclose(calc_bins(bins, 'median'), [np.median(b) for b in old_d])
+        np.testing.assert_array_equal(calc_bins(bins, 'count', dtype='i8'), [len(b) for b in old_d])
+
+class Data2DBinTest(unittest.TestCase):
+    x_points = [0.0, 20.0, 50.0, 100.0, 120.0]
+    y_points = [24.0, 50.0, 60.0, 100.0]
+
+    def setUp(self):
+        rs = np.random.RandomState(1)
+        self.data = rs.rand(3000)
+        self.xs = rs.rand(3000) * 130.0 - 5.0
+        self.ys = rs.rand(3000) * 100.0
+
+    def old_bins(self):
+        """nested lists of the old double loop"""
+        res = []
+        for jy in range(len(self.y_points) - 1):
+            row = []
+            wy = (self.y_points[jy] <= self.ys) & (self.ys < self.y_points[jy+1])
+            for ix in range(len(self.x_points) - 1):
+                wx = (self.x_points[ix] <= self.xs) & (self.xs < self.x_points[ix+1])
+                row.append(self.data[wy & wx])
+            res.append(row)
+        return res
+
+    def test_edges(self):
+        # # bins include their lower edges only, the last upper edge is out of range
+        xs = np.array([0.0, 20.0, 49.999, 50.0, 120.0, -0.1, 10.0, 10.0])
+        ys = np.array([24.0, 24.0, 50.0, 59.9, 30.0, 30.0, 100.0, 23.9])
+        ids = bin_ids_2d(xs, ys, self.x_points, self.y_points)
+        np.testing.assert_array_equal(ids, [0, 1, 5, 6, -1, -1, -1, -1])
+
+    def test_same_as_loops(self):
+        bins = data_2d_bin(self.data, self.xs, self.ys, self.x_points, self.y_points)
+        old = self.old_bins()
+        self.assertEqual(bins.shape, (3, 4))
+        self.assertEqual(len(bins), 3)
+        inside = sum([len(b) for row in old for b in row])
+        self.assertEqual(bins.count().sum(), inside)
+        self.assertLess(inside, len(self.data))
+        for jy in range(3):
+            for ix in range(4):
+                np.testing.assert_array_equal(bins[jy][ix], old[jy][ix])
+                np.testing.assert_array_equal(bins[jy, ix], old[jy][ix])
+        np.testing.assert_array_equal(bins[-1][-1], old[2][3])
+        np.testing.assert_array_equal(bins[-1, -2], old[2][2])
+
+    def test_reductions(self):
+        bins = data_2d_bin(self.data, self.xs, self.ys, self.x_points, self.y_points)
+        old = self.old_bins()
+        for name, func in [('mean', np.mean), ('std', np.std), ('min', np.min), ('max', np.max),
+                ('median', np.median), ('sum', np.sum)]:
+            res = getattr(bins, name)()
+            for jy in range(3):
+                for ix in range(4):
+                    self.assertAlmostEqual(res[jy, ix], func(old[jy][ix]))
+        q = bins.percentile([10, 90])
+        self.assertEqual(q.shape, (2, 3, 4))
+        np.testing.assert_allclose(q[:, 1, 2], np.percentile(old[1][2], [10, 90]))
+
+    def test_empty_bins(self):
+        bins = data_2d_bin(self.data, self.xs, self.ys, [200.0, 210.0, 220.0], self.y_points)
+        np.testing.assert_array_equal(bins.count(), np.zeros((3, 2)))
+        for name in ('mean', 'std', 'min', 'max', 'median'):
+            self.assertTrue(np.all(np.isnan(getattr(bins, name)())), name)
+        self.assertTrue(np.all(np.isnan(bins.percentile([5, 50, 95]))))
+        np.testing.assert_array_equal(bins.sum(), np.zeros((3, 2)))
+        # # partly empty
+        bins = data_2d_bin(np.array([1.0, 3.0]), np.array([1.0, 2.0]), np.array([30.0, 30.0]), self.x_points, self.y_points)
+        self.assertEqual(bins.median()[0, 0], 2.0)
+        self.assertEqual(np.sum(np.isnan(bins.median())), 11)
+        self.assertEqual(np.sum(np.isnan(bins.percentile(75))), 11)
+
+    def test_calc_bins(self):
+        bins = data_2d_bin(self.data, self.xs, self.ys, self.x_points, self.y_points)
+        np.testing.assert_allclose(calc_bins(bins, np.mean), bins.mean(), equal_nan=True)
+        np.testing.assert_allclose(calc_bins(bins, 'max'), bins.max(), equal_nan=True)
+
+if __name__ == '__main__':
+    unittest.main()
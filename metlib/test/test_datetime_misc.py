@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+
+# test_datetime_misc.py
+"""Tests of datetime_match and datetime_filter of metlib.datetime.misc.
+Run with: python -m unittest discover -s metlib/test -p 'test_*.py'
+"""
+
+import unittest
+from datetime import datetime, timedelta
+import numpy as np
+from metlib.datetime.parser import parse_datetime
+from metlib.datetime.misc import datetime_match, datetime_filter, _match_keys, _join_keys
+
+def _old_datetime_match(rec, ref_dts, fmt, fmt2=None, rec_dts_field='datetime', fill_value=np.nan):
+    """the dict of strftime strs based datetime_match, as reference: (res, index list)"""
+    if fmt2 is None:
+        fmt2 = fmt
+    rec = np.array(rec)
+    ref_dts = parse_datetime(ref_dts)
+    rec_dts = rec if rec_dts_field is None else rec[rec_dts_field]
+    rec_dict = dict(zip([dt.strftime(fmt) for dt in rec_dts], range(len(rec_dts))))
+    ref_dtstr = [dt.strftime(fmt2) for dt in ref_dts]
+    res_i = [rec_dict.get(dtstr, None) for dtstr in ref_dtstr]
+    if rec_dts_field is None:
+        res = np.zeros(len(res_i), dtype='O')
+    else:
+        res = np.atleast_1d(np.zeros(len(res_i), rec.dtype))
+    res[:] = fill_value
+    for i, rec_i in enumerate(res_i):
+        if rec_i is not None:
+            res[i] = rec[rec_i]
+        elif rec_dts_field is not None:
+            res[rec_dts_field][i] = parse_datetime(ref_dtstr[i])
+    return res, res_i
+
+def _old_datetime_filter(rec, ref_dts, fmt, rec_dts_field='datetime'):
+    """the dict of strftime strs based datetime_filter, as reference: index list"""
+    rec = np.array(rec)
+    if isinstance(ref_dts[0], (str, unicode)):
+        ref_dtstr = ref_dts
+    else:
+        ref_dtstr = [dt.strftime(fmt) for dt in parse_datetime(ref_dts)]
+    rec_dts = rec if rec_dts_field is None else rec[rec_dts_field]
+    rec_dict = dict()
+    for i, dtstr in enumerate([dt.strftime(fmt) for dt in rec_dts]):
+        rec_dict.setdefault(dtstr, []).append(i)
+    res_i = []
+    for dtstr in ref_dtstr:
+        res_i.extend(rec_dict.get(dtstr, []))
+    return res_i
+
+class _MatchData(object):
+    """unsorted records with duplicated hours, and hourly refs, some not in records"""
+    def setUp(self):
+        rs = np.random.RandomState(0)
+        base = datetime(2015, 12, 30, 22)
+        # # unsorted, with duplicated hours
+        hours = rs.randint(0, 60, 150)
+        minutes = rs.randint(0, 3, 150) * 20
+        self.dts = [base + timedelta(hours=int(h), minutes=int(m)) for h, m in zip(hours, minutes)]
+        self.rec = np.zeros(150, dtype=[('datetime', 'O'), ('v', 'f8'), ('n', 'i4')])
+        self.rec['datetime'] = self.dts
+        self.rec['v'] = rs.rand(150)
+        self.rec['v'][::11] = np.nan
+        self.rec['n'] = np.arange(150)
+        # # every hour, most of them in rec, some not
+        self.ref_dts = [base + timedelta(hours=h, minutes=5) for h in range(-3, 66)]
+
+class DatetimeMatchTest(_MatchData, unittest.TestCase):
+    def assert_same_match(self, fmt, fmt2=None, **kwargs):
+        old_res, old_i = _old_datetime_match(self.rec, self.ref_dts, fmt, fmt2, **kwargs)
+        res, index = datetime_match(self.rec, self.ref_dts, fmt, fmt2, return_index=True, **kwargs)
+        self.assertEqual(list(index), old_i)
+        self.assertEqual(res.dtype, old_res.dtype)
+        for f in res.dtype.names:
+            if res[f].dtype.kind == 'f':
+                np.testing.assert_array_equal(res[f], old_res[f])
+            else:
+                self.assertEqual(list(res[f]), list(old_res[f]))
+        np.testing.assert_array_equal(datetime_match(self.rec, self.ref_dts, fmt, fmt2, **kwargs)['v'], res['v'])
+        return res, index
+
+    def test_last_wins(self):
+        res, index = self.assert_same_match('%Y%m%d%H')
+        keys = [dt.strftime('%Y%m%d%H') for dt in self.dts]
+        for dt, i in zip(self.ref_dts, index):
+            key = dt.strftime('%Y%m%d%H')
+            if key in keys:
+                self.assertEqual(i, len(keys) - 1 - keys[::-1].index(key))
+        self.assertTrue(any(keys.count(k) > 1 for k in keys))
+
+    def test_unmatched(self):
+        res, index = self.assert_same_match('%Y%m%d%H', fill_value=-1)
+        unmatched = np.array([i is None for i in index])
+        self.assertTrue(np.any(unmatched))
+        self.assertFalse(np.all(unmatched))
+        self.assertEqual(index.dtype, np.dtype('O'))
+        self.assertTrue(np.all(res['n'][unmatched] == -1))
+        # # unmatched datetimes are the ref datetimes truncated to fmt
+        for dt, rdt in zip(res['datetime'][unmatched], np.array(self.ref_dts, dtype='O')[unmatched]):
+            self.assertEqual(dt, rdt.replace(minute=0))
+        self.assert_same_match('%Y%m%d')
+        self.assert_same_match('%Y%j%H')
+        self.assert_same_match('%m%d%H')
+
+    def test_str_keys(self):
+        # # fmts without int keys, and fmt2 != fmt
+        self.assert_same_match('%Y-%m-%d %H %a')
+        self.assert_same_match('%Y%m%d%H', '%Y%m%d12')
+        self.assert_same_match('%Y-%m-%dT%H', '%Y-%m-%dT%H')
+
+    def test_all_matched(self):
+        ref_dts = self.dts[::-3]
+        res, index = datetime_match(self.rec, ref_dts, '%Y%m%d%H%M%S', return_index=True)
+        self.assertEqual(index.dtype.kind, 'i')
+        self.assertEqual(list(index), _old_datetime_match(self.rec, ref_dts, '%Y%m%d%H%M%S')[1])
+
+    def test_dts_only(self):
+        old_res, old_i = _old_datetime_match(self.dts, self.ref_dts, '%Y%m%d%H', rec_dts_field=None)
+        res, index = datetime_match(self.dts, self.ref_dts, '%Y%m%d%H', rec_dts_field=None, return_index=True)
+        self.assertEqual(list(index), old_i)
+        self.assertEqual([str(x) for x in res], [str(x) for x in old_res])
+
+class DatetimeFilterTest(_MatchData, unittest.TestCase):
+    def assert_same_filter(self, fmt, ref_dts=None):
+        if ref_dts is None:
+            ref_dts = self.ref_dts
+        old_i = _old_datetime_filter(self.rec, ref_dts, fmt)
+        res, index = datetime_filter(self.rec, ref_dts, fmt, return_index=True)
+        self.assertEqual(list(index), old_i)
+        self.assertEqual(list(res['n']), old_i)
+        return index
+
+    def test_filter(self):
+        index = self.assert_same_filter('%Y%m%d%H')
+        # # all the records of a key, not only the last one
+        self.assertGreater(len(index), len(set([self.dts[i].strftime('%Y%m%d%H') for i in index])))
+        self.assert_same_filter('%Y%m%d')
+        self.assert_same_filter('%Y-%m-%d %H %a')
+        self.assert_same_filter('%Y%m%d%H', [dt.strftime('%Y%m%d%H') for dt in self.ref_dts] + ['bad', '2016-01-01'])
+        self.assertEqual(list(datetime_filter(self.rec, ['bad'], '%Y%m%d%H', return_index=True)[1]), [])
+
+    def test_join_keys(self):
+        rec_keys, ref_keys = _match_keys('%Y%m%d%H', '%Y%m%d%H', self.dts, self.ref_dts)
+        self.assertEqual(rec_keys.dtype, np.dtype('i8'))
+        order, begs, ends = _join_keys(rec_keys, ref_keys)
+        for i, key in enumerate(ref_keys):
+            matched = order[begs[i]:ends[i]]
+            self.assertEqual(list(matched), list(np.flatnonzero(rec_keys == key)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+# test_datetime_parser.py
+"""Tests of the bulk parsing and the cache of metlib.datetime.parser.
+Run with: python -m unittest discover -s metlib/test -p 'test_*.py'
+"""
+
+import unittest
+from datetime import datetime, date, timedelta
+import numpy as np
+from metlib.datetime import parser
+from metlib.datetime.parser import parse_datetime, _parse_one, _parse_bulk, _parse_one_cached, _infer_template, _parse_datetime64
+
+class ParseBulkTest(unittest.TestCase):
+    def setUp(self):
+        parser._parse_cache.clear()
+        base = datetime(2015, 3, 4, 5, 6)
+        self.dts = [base + timedelta(hours=i * 7) for i in range(100)]
+        self.sample_i = set(np.linspace(0, 99, parser._bulk_sample_size).astype('i8'))
+
+    def tearDown(self):
+        parser._parse_cache.clear()
+
+    def assert_same_as_one(self, timestrs):
+        expected = [_parse_one(x) for x in timestrs]
+        self.assertEqual(parse_datetime(timestrs), expected)
+        np.testing.assert_array_equal(_parse_datetime64(timestrs), np.array(expected, dtype='M8[us]'))
+
+    def test_infer_template(self):
+        self.assertEqual(_infer_template('2015-03-04 05:06'), 'YYYY-mm-dd HH:MM')
+        self.assertEqual(_infer_template('2015/03/04T05:06:07'), 'YYYY/mm/ddTHH:MM:SS')
+        self.assertEqual(_infer_template('2015063'), 'YYYYjjj')
+        self.assertEqual(_infer_template('2015030405'), 'YYYYmmddHH')
+        self.assertEqual(_infer_template('12:00'), None)
+        self.assertEqual(_infer_template('2015-3-4'), None)
+        self.assertEqual(_infer_template('20150304056'), None)
+
+    def test_uniform(self):
+        strs = [dt.strftime('%Y-%m-%d %H:%M') for dt in self.dts]
+        res, outliers = _parse_bulk(strs)
+        self.assertEqual(len(outliers), 0)
+        self.assertEqual(res.astype('O').tolist(), self.dts)
+        self.assert_same_as_one(strs)
+        ints = [int(dt.strftime('%Y%m%d%H')) for dt in self.dts]
+        self.assertEqual(len(_parse_bulk(ints)[1]), 0)
+        self.assert_same_as_one(ints)
+        self.assert_same_as_one([dt.strftime('%Y%j') for dt in self.dts])
+        self.assertIsNone(_parse_bulk(strs[:parser._bulk_min_size-1]))
+
+    def test_mixed_formats(self):
+        # # the sampled items share one format, the others do not and must be parsed one by one
+        strs = [dt.strftime('%Y-%m-%d %H:%M') for dt in self.dts]
+        others = {
+                1: '2015/03/04 11:06',
+                2: '20150304',
+                3: 'Mar 4 2015 13:00',
+                4: '2015-03-04',
+                5: '2015-02-30 00:00',
+                6: '2015-03-04 05:06:07',
+                7: '04-03-2015 05:06',
+                }
+        for i, s in others.items():
+            self.assertNotIn(i, self.sample_i)
+            strs[i] = s
+        res, outliers = _parse_bulk(strs)
+        self.assertEqual(sorted(outliers), sorted(others))
+        self.assert_same_as_one(strs)
+        self.assertEqual(parse_datetime(strs)[5], None)
+        self.assertTrue(np.isnat(_parse_datetime64(strs)[5]))
+
+        ints = [int(dt.strftime('%Y%m%d%H')) for dt in self.dts]
+        ints[1] = 20150304
+        ints[2] = 201503041122
+        ints[3] = 2015023112
+        res, outliers = _parse_bulk(ints)
+        self.assertEqual(sorted(outliers), [1, 2, 3])
+        self.assert_same_as_one(ints)
+
+        objs = list(strs)
+        objs[1] = datetime(2001, 2, 3)
+        objs[2] = date(2001, 2, 3)
+        self.assert_same_as_one(objs)
+
+    def test_sample_mismatch(self):
+        # # no bulk parsing if the samples are in different formats
+        strs = [dt.strftime('%Y-%m-%d %H:%M') for dt in self.dts]
+        strs[0] = self.dts[0].strftime('%Y%m%d%H%M')
+        res, outliers = _parse_bulk(strs)
+        self.assertEqual(len(outliers), len(strs) - 1)
+        self.assert_same_as_one(strs)
+        strs[0] = 'Mar 4 2015 05:06'
+        self.assertIsNone(_parse_bulk(strs))
+        self.assert_same_as_one(strs)
+        mixed = list(strs)
+        mixed[14] = 20150304
+        self.assertIsNone(_parse_bulk(mixed))
+        self.assert_same_as_one(mixed)
+
+class ParseCacheTest(unittest.TestCase):
+    def setUp(self):
+        parser._parse_cache.clear()
+
+    def tearDown(self):
+        parser._parse_cache.clear()
+
+    def test_round_trip(self):
+        res = _parse_one_cached('2015-03-04 05:06')
+        self.assertEqual(res, datetime(2015, 3, 4, 5, 6))
+        self.assertIn((str, '2015-03-04 05:06'), parser._parse_cache)
+        self.assertIs(_parse_one_cached('2015-03-04 05:06'), res)
+        self.assertEqual(parse_datetime(2015030405), datetime(2015, 3, 4, 5))
+        self.assertIn((int, 2015030405), parser._parse_cache)
+        self.assertEqual(parse_datetime('2015030405'), datetime(2015, 3, 4, 5))
+        self.assertIn((str, '2015030405'), parser._parse_cache)
+        self.assertEqual(len(parser._parse_cache), 3)
+
+    def test_partial_not_cached(self):
+        for s in ('12:00', 'Mar 4', '2015-3-4', 'not a date'):
+            self.assertEqual(_parse_one_cached(s), _parse_one(s))
+        self.assertEqual(parse_datetime(['12:00'] * 3), [_parse_one('12:00')] * 3)
+        self.assertEqual(len(parser._parse_cache), 0)
+
+    def test_size(self):
+        old_size = parser._parse_cache_size
+        parser._parse_cache_size = 4
+        try:
+            for i in range(1, 7):
+                _parse_one_cached('2015-03-%02d' % i)
+            self.assertEqual(list(parser._parse_cache), [(str, '2015-03-%02d' % i) for i in range(3, 7)])
+            _parse_one_cached('2015-03-03')
+            _parse_one_cached('2015-03-07')
+            self.assertEqual(list(parser._parse_cache), [(str, '2015-03-%02d' % i) for i in (5, 6, 3, 7)])
+        finally:
+            parser._parse_cache_size = old_size
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+# test_lidar_load.py
+"""Tests of loading lidar files with metlib.lidar.lidar.LidarDataset.
+Run with: python -m unittest discover -s metlib/test -p 'test_*.py'
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from metlib.lidar.lidar import LidarDataset
+from metlib.lidar.benchmark import fake_dataset
+
+class AppendFilesTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.fnames = []
+        for i in range(5):
+            d = fake_dataset(n_records=20 + i, n_channels=2, n_bins=30, seed=i)
+            d.vars['datetime'] = d.vars['datetime'] + np.timedelta64(3600 * i, 's')
+            if i == 3:
+                # # a file lacking a var, which fails to be filled
+                del d.vars['temperature'], d.var_dims['temperature'], d.var_aver_methods['temperature']
+            self.fnames.append(self.save(d, 'good%d.nc' % i))
+        corrupt = os.path.join(self.tmpdir, 'corrupt.nc')
+        with open(corrupt, 'wb') as f:
+            f.write('CDF\x01' + '\x00\xff junk ' * 50)
+        missing = os.path.join(self.tmpdir, 'missing.nc')
+        self.fnames = self.fnames[:2] + [corrupt] + self.fnames[2:4] + [missing] + self.fnames[4:]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def save(self, d, name):
+        fname = os.path.join(self.tmpdir, name)
+        d.save(fname)
+        return fname
+
+    def assert_same_dataset(self, d1, d2):
+        self.assertEqual(len(d1), len(d2))
+        self.assertEqual(sorted(d1.vars), sorted(d2.vars))
+        self.assertEqual(d1.dims, d2.dims)
+        np.testing.assert_array_equal(d1.datetimes, d2.datetimes)
+        for vname in d1.vars:
+            self.assertEqual(d1[vname].dtype, d2[vname].dtype)
+            np.testing.assert_array_equal(d1[vname], d2[vname])
+
+    def test_skip_bad_files(self):
+        d = LidarDataset(self.fnames)
+        # # corrupt and missing files are skipped, good3.nc lacks temperature and is dropped
+        self.assertEqual(len(d), 20 + 21 + 22 + 24)
+        good = [LidarDataset(fn) for fn in self.fnames if os.path.basename(fn) in ('good0.nc', 'good1.nc', 'good2.nc', 'good4.nc')]
+        expected = good[0].copy()
+        expected.append_datasets(good[1:])
+        self.assert_same_dataset(d, expected)
+        self.assertTrue(np.all(d.datetimes[1:] > d.datetimes[:-1]))
+
+    @unittest.skipUnless(os.name == 'posix', 'workers need fork')
+    def test_workers(self):
+        d1 = LidarDataset(self.fnames, workers=1)
+        d2 = LidarDataset(self.fnames, workers=2)
+        self.assert_same_dataset(d1, d2)
+        d3 = LidarDataset(self.fnames[:1])
+        d3.append_files(self.fnames[1:], workers=3)
+        self.assert_same_dataset(d1, d3)
+        self.assertTrue(np.any(np.isnan(d2['data'])))
+
+    def test_all_bad(self):
+        d = LidarDataset(self.fnames[:1])
+        before = d.copy()
+        d.append_files([self.fnames[2], self.fnames[5]], workers=1)
+        self.assert_same_dataset(d, before)
+
+if __name__ == '__main__':
+    unittest.main()